@@ -0,0 +1,67 @@
+'''Benchmark base module
+
+Benchmarks recreate the schemas of the configured database, so point ENV to a
+dedicated dotenv file before running them.
+
+'''
+
+
+import config
+import model
+import time
+import asyncio
+import aiopg.sa
+import redis
+
+
+def async_bench(func):
+    '''An async benchmark decorator.'''
+
+    def wrapper(*args, **kwargs):
+        '''Wrapper.'''
+
+        model.drop_schemas(config.DB_URL)
+        model.create_schemas(config.DB_URL)
+
+        async def async_lambda():
+            '''Async lambda function.'''
+
+            rsconn = redis.StrictRedis.from_url(config.REDIS_URL)
+
+            async with aiopg.sa.create_engine(config.DB_URL) as engine:
+                async with engine.acquire() as conn:
+                    task = asyncio.Task.current_task()
+                    task._conn = conn
+                    task._redis = rsconn
+
+                    return await func(*args, **kwargs)
+
+        loop = asyncio.get_event_loop()
+        return loop.run_until_complete(loop.create_task(async_lambda()))
+
+    return wrapper
+
+
+async def measure(name, func, *args, repeat=3, **kwargs):
+    '''Measure the best wall time of an async function.
+
+    Args:
+        name (string): Benchmark name.
+        func (function): Async function.
+        repeat (int): Repeat times.
+
+    Returns:
+        Float
+
+    '''
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    print('{:<32} {:10.3f} ms'.format(name, best * 1000.0))
+    return best
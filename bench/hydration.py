@@ -0,0 +1,151 @@
+'''Hydration benchmark
+
+Compare hydrating the challenge rows with the precomputed hydration plans, with
+the old per-row result keys, and with the old eager reverse relation queries.
+
+Usage:
+    python -m bench.hydration [users] [challenges]
+
+'''
+
+
+import sys
+import tracemalloc
+import bench
+import model.scoring
+from datetime import datetime, timezone
+from model import model_context
+from model.user import UserModel, UserLevel, UserCategory
+from model.problem import ProblemModel
+from model.challenge import ChallengeModel, JudgeState
+
+
+def build_reverse_relations(instance):
+    '''Build all reverse relation queries like the old eager hydration.'''
+
+    for key, relation in instance._relations.items():
+        if relation.reverse:
+            getattr(instance, key)
+        else:
+            build_reverse_relations(instance._fields[key])
+
+
+def legacy_hydrate(model_cls, row, prefix=''):
+    '''Hydrate with the result keys computed per row like the old way.'''
+
+    fields = dict((key, row[prefix + column.name])
+        for key, column in model_cls._columns.items())
+
+    for key, relation in model_cls._relations.items():
+        if not relation.reverse:
+            fields[key] = legacy_hydrate(relation.target_cls, row,
+                '{}__{}_'.format(prefix, key))
+
+    instance = object.__new__(model_cls)
+    object.__setattr__(instance, '_fields', fields)
+    object.__setattr__(instance, '_dirty', set())
+    object.__setattr__(instance, '_snapshots', None)
+    return instance
+
+
+async def hydrate_plan(rows):
+    '''Hydrate with the hydration plan and lazy reverse relations.'''
+
+    return [ChallengeModel.hydrate(row, ChallengeModel._plan)
+        for row in rows]
+
+
+async def hydrate_legacy(rows):
+    '''Hydrate with per-row result keys and lazy reverse relations.'''
+
+    return [legacy_hydrate(ChallengeModel, row) for row in rows]
+
+
+async def hydrate_eager(rows):
+    '''Hydrate with per-row result keys and eager reverse relations.'''
+
+    challenges = [legacy_hydrate(ChallengeModel, row) for row in rows]
+    for challenge in challenges:
+        build_reverse_relations(challenge)
+
+    return challenges
+
+
+async def measure_memory(name, func, rows):
+    '''Measure the peak memory of the hydration.'''
+
+    tracemalloc.start()
+    challenges = await func(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{:<32} {:10.1f} KiB'.format(name, peak / 1024.0))
+    return challenges
+
+
+@model_context
+async def populate(num_users, num_challenges, ctx=None):
+    '''Populate the users, problems and challenges.'''
+
+    conn = ctx.conn
+    now = datetime.now(tz=timezone.utc)
+
+    await (UserModel.insert().values([{
+            'uid': uid,
+            'level': UserLevel.user,
+            'mail': 'user{}'.format(uid),
+            'password': '',
+            'name': 'User{}'.format(uid),
+            'category': UserCategory.algo,
+            'metadata': {},
+        } for uid in range(1, num_users + 1)])
+        .execute(conn))
+
+    tests = [{ 'data': [idx], 'weight': 10 } for idx in range(10)]
+    await (ProblemModel.insert().values([{
+            'uid': uid,
+            'name': 'Problem{}'.format(uid),
+            'revision': 'deadbeef',
+            'metadata': { 'name': 'Problem{}'.format(uid), 'score': 100,
+                'test': tests },
+        } for uid in range(1, 11)])
+        .execute(conn))
+
+    await (ChallengeModel.insert().values([{
+            'uid': uid,
+            'revision': 'deadbeef',
+            'state': JudgeState.done,
+            'timestamp': now,
+            'metadata': {},
+            'code_hash': None,
+            '_rel_submitter': uid % num_users + 1,
+            '_rel_problem': uid % 10 + 1,
+        } for uid in range(1, num_challenges + 1)])
+        .execute(conn))
+
+
+@model_context
+async def fetch_rows(ctx=None):
+    '''Fetch the raw challenge rows.'''
+
+    results = await ctx.conn.execute(ChallengeModel.select().expr)
+    return await results.fetchall()
+
+
+@bench.async_bench
+async def main(num_users=2000, num_challenges=2000):
+    '''Main benchmark.'''
+
+    await populate(num_users, num_challenges)
+    rows = await fetch_rows()
+
+    await bench.measure('eager reverse relations', hydrate_eager, rows)
+    await bench.measure('per-row result keys', hydrate_legacy, rows)
+    await bench.measure('hydration plan', hydrate_plan, rows)
+    await measure_memory('eager peak memory', hydrate_eager, rows)
+    await measure_memory('hydration plan peak memory', hydrate_plan, rows)
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
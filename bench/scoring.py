@@ -0,0 +1,264 @@
+'''Scoring benchmark
+
+Compare the set-based scoring pipeline with the old row-by-row pipeline.
+
+Usage:
+    python -m bench.scoring [users] [problems] [tests]
+
+'''
+
+
+import sys
+import math
+import random
+import bench
+import model.scoring
+from datetime import datetime, timedelta, timezone
+from model import model_context, select
+from model.user import UserModel, UserLevel, UserCategory
+from model.problem import ProblemModel
+from model.proset import ProSetModel, ProItemModel
+from model.challenge import ChallengeModel, SubtaskModel
+from model.challenge import JudgeState, JudgeResult
+from model.scoring import TestWeightModel, RateCountModel, RateScoreModel
+from sqlalchemy import Integer, func
+
+
+async def legacy_update_rate_count(category, conn):
+    '''Old row-by-row rate count update.'''
+
+    base_tbl = (select([
+            ProblemModel.uid,
+            func.coalesce(func.max(ProItemModel.deadline), 'infinity')
+                .label('deadline')
+        ])
+        .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+        .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+            int(category))
+        .group_by(ProblemModel.uid)
+        .alias())
+
+    count_tbl = (select([base_tbl.expr.c.uid, SubtaskModel.index]).
+        select_from(base_tbl
+            .join(ChallengeModel)
+            .join(SubtaskModel)
+            .join(UserModel))
+        .where(UserModel.category == category)
+        .where(ChallengeModel.state == JudgeState.done)
+        .where(ChallengeModel.timestamp <= base_tbl.expr.c.deadline)
+        .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
+            int(JudgeResult.STATUS_AC))
+        .distinct(UserModel.uid, base_tbl.expr.c.uid, SubtaskModel.index)
+        .alias())
+
+    count_query = (select([
+            count_tbl.expr.c.uid.label('problem_uid'),
+            count_tbl.expr.c.index,
+            func.count().label('count'),
+            TestWeightModel.score
+        ])
+        .select_from(count_tbl.join(TestWeightModel,
+            (count_tbl.expr.c.uid == TestWeightModel.problem_uid) &
+            (count_tbl.expr.c.index == TestWeightModel.index)))
+        .group_by(count_tbl.expr.c.uid, count_tbl.expr.c.index,
+            TestWeightModel.score))
+
+    async with conn.begin():
+        await (RateCountModel.delete()
+            .where(RateCountModel.category == category)
+            .execute(conn))
+
+        async for result in await count_query.execute(conn):
+            score = result.score * (2**(28.0 / (result.count + 13.0)))
+            await RateCountModel(category=category,
+                problem_uid=result.problem_uid, index=result.index,
+                count=result.count, score=score).save(conn)
+
+
+async def legacy_update_rate_score(category, conn):
+    '''Old row-by-row rate score update.'''
+
+    base_tbl = (select([
+            UserModel.uid.label('user_uid'),
+            ProblemModel.uid.label('problem_uid'),
+            SubtaskModel.index,
+            func.max(ProItemModel.deadline).label('deadline'),
+            func.min(ChallengeModel.timestamp).label('timestamp')
+        ])
+        .select_from(UserModel
+            .join(ChallengeModel)
+            .join(SubtaskModel)
+            .join(ProblemModel)
+            .join(ProItemModel)
+            .join(ProSetModel))
+        .where(UserModel.category == category)
+        .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+            int(category))
+        .where(ChallengeModel.state == JudgeState.done)
+        .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
+            int(JudgeResult.STATUS_AC))
+        .group_by(UserModel.uid, ProblemModel.uid, SubtaskModel.index)
+        .alias())
+
+    score_query = (select([
+            base_tbl.expr,
+            TestWeightModel.score.label('max_score'),
+            RateCountModel.score
+        ])
+        .select_from(base_tbl
+            .join(TestWeightModel,
+                (base_tbl.expr.c.problem_uid == TestWeightModel.problem_uid) &
+                (base_tbl.expr.c.index == TestWeightModel.index))
+            .join(RateCountModel,
+                (RateCountModel.category == category) &
+                (base_tbl.expr.c.problem_uid == RateCountModel.problem_uid) &
+                (base_tbl.expr.c.index == RateCountModel.index),
+                isouter=True)))
+
+    async with conn.begin():
+        await (RateScoreModel.delete()
+            .where(RateScoreModel.category == category)
+            .execute(conn))
+
+        async for result in await score_query.execute(conn):
+            score = result.score
+            if score is None:
+                score = result.max_score * 4
+
+            ratio = 1.0
+            if result.deadline is not None:
+                delta = (result.timestamp - result.deadline).total_seconds()
+                if delta > 0:
+                    ratio = 1.0 - min(1.0, (math.ceil(delta / 86400.0) * 0.15))
+
+            score = int(score * ratio)
+            if score > 0:
+                await RateScoreModel(category=category,
+                    user_uid=result.user_uid, problem_uid=result.problem_uid,
+                    index=result.index, score=score).save(conn)
+
+
+@model_context
+async def legacy_refresh(ctx=None):
+    '''Old row-by-row refresh.'''
+
+    for category in UserCategory:
+        if category == UserCategory.universe:
+            continue
+
+        await legacy_update_rate_count(category, ctx.conn)
+        await legacy_update_rate_score(category, ctx.conn)
+
+
+@model_context
+async def populate(num_users, num_problems, num_tests, ctx=None):
+    '''Populate random users, problems and challenges.'''
+
+    conn = ctx.conn
+    rand = random.Random(42)
+    now = datetime.now(tz=timezone.utc)
+
+    await (UserModel.insert().values([{
+            'level': UserLevel.user,
+            'mail': 'user{}'.format(uid),
+            'password': '',
+            'name': 'User{}'.format(uid),
+            'category': UserCategory.algo,
+            'metadata': {},
+        } for uid in range(1, num_users + 1)])
+        .execute(conn))
+
+    tests = [{ 'data': [idx], 'weight': 100 // num_tests }
+        for idx in range(num_tests)]
+    await (ProblemModel.insert().values([{
+            'uid': uid,
+            'name': 'Problem{}'.format(uid),
+            'revision': 'deadbeef',
+            'metadata': { 'name': 'Problem{}'.format(uid), 'score': 100,
+                'test': tests },
+        } for uid in range(1, num_problems + 1)])
+        .execute(conn))
+
+    await (ProSetModel.insert().values(uid=1, name='Bench', hidden=False,
+            metadata={ 'category': int(UserCategory.algo) })
+        .execute(conn))
+
+    await (ProItemModel.insert().values([{
+            'hidden': False,
+            'deadline': now - timedelta(days=rand.randint(-3, 3)),
+            'metadata': {},
+            '_rel_parent': 1,
+            '_rel_problem': uid,
+        } for uid in range(1, num_problems + 1)])
+        .execute(conn))
+
+    challenges = []
+    subtasks = []
+    for user_uid in range(1, num_users + 1):
+        for problem_uid in rand.sample(range(1, num_problems + 1),
+                max(1, num_problems // 3)):
+            uid = len(challenges) + 1
+            challenges.append({
+                'uid': uid,
+                'revision': 'deadbeef',
+                'state': JudgeState.done,
+                'timestamp': now - timedelta(days=rand.randint(0, 6)),
+                'metadata': {},
+                '_rel_submitter': user_uid,
+                '_rel_problem': problem_uid,
+            })
+            for idx in range(num_tests):
+                result = rand.choice([JudgeResult.STATUS_AC,
+                    JudgeResult.STATUS_WA])
+                subtasks.append({
+                    'index': idx,
+                    'state': JudgeState.done,
+                    'metadata': { 'result': int(result) },
+                    '_rel_challenge': uid,
+                })
+
+    await ChallengeModel.insert().values(challenges).execute(conn)
+    for offset in range(0, len(subtasks), 5000):
+        await (SubtaskModel.insert().values(subtasks[offset:offset + 5000])
+            .execute(conn))
+
+    for problem_uid in range(1, num_problems + 1):
+        await model.scoring.change_problem(problem_uid, True)
+
+
+@model_context
+async def dump(ctx=None):
+    '''Dump rate counts and rate scores.'''
+
+    counts = []
+    async for row in await RateCountModel.select().execute(ctx.conn):
+        counts.append((row.category, row.problem_uid, row.index, row.count,
+            row.score))
+
+    scores = []
+    async for row in await RateScoreModel.select().execute(ctx.conn):
+        scores.append((row.category, row.user_uid, row.problem_uid, row.index,
+            row.score))
+
+    return (sorted(counts), sorted(scores))
+
+
+@bench.async_bench
+async def main(num_users=200, num_problems=30, num_tests=5):
+    '''Main benchmark.'''
+
+    await populate(num_users, num_problems, num_tests)
+
+    await bench.measure('legacy refresh', legacy_refresh)
+    legacy = await dump()
+
+    await bench.measure('set-based refresh', model.scoring.refresh)
+    current = await dump()
+
+    print('rate_count rows: {}, rate_score rows: {}, identical: {}'.format(
+        len(current[0]), len(current[1]), legacy == current))
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*args)
@@ -0,0 +1,77 @@
+'''Consistency check of the precomputed user scores
+
+Compare the user_score table with the on-the-fly computation, and print the
+mismatches.
+
+Usage:
+    python check_score.py
+
+'''
+
+
+import sys
+import config
+import asyncio
+import aiopg.sa
+import redis
+import model.user
+import model.proset
+import model.scoring
+
+
+async def check():
+    '''Check all users and problem sets.
+
+    Returns:
+        Int: Number of mismatches.
+
+    '''
+
+    mismatches = 0
+
+    users = await model.user.get_list()
+    prosets = await model.proset.get_list(hidden=True)
+
+    for user in users:
+        spec_proset_uids = [None]
+        for proset in prosets:
+            if proset.metadata.get('category') == int(user.category):
+                spec_proset_uids.append(proset.uid)
+
+        for spec_proset_uid in spec_proset_uids:
+            expected = await model.scoring.get_user_score(user,
+                spec_proset_uid=spec_proset_uid)
+            actual = await model.scoring.get_user_rate(user,
+                spec_proset_uid=spec_proset_uid)
+
+            if expected != actual:
+                mismatches += 1
+                print('user {} proset {}: expected {}, got {}'.format(
+                    user.uid, spec_proset_uid, expected, actual))
+
+    return mismatches
+
+
+def main():
+    '''Main function.'''
+
+    async def async_lambda():
+        '''Async lambda function.'''
+
+        async with aiopg.sa.create_engine(config.DB_URL) as engine:
+            async with engine.acquire() as conn:
+                task = asyncio.Task.current_task()
+                task._conn = conn
+                task._redis = redis.StrictRedis.from_url(config.REDIS_URL)
+
+                return await check()
+
+    loop = asyncio.get_event_loop()
+    mismatches = loop.run_until_complete(loop.create_task(async_lambda()))
+    print('{} mismatches'.format(mismatches))
+
+    return 1 if mismatches > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
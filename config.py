@@ -5,6 +5,26 @@ Server configuration.
 Attributes:
     DB_URL (str): Connection configuration of PostgreSQL.
     REDIS_URL (str): Connection configuration of Redis.
+    JUDGE_URLS ([str]): URLs of the judge servers.
+    SCORING_WINDOW (float): Seconds to merge the scoring invalidations.
+    SCORING_CONCURRENCY (int): Maximum connections of the scoring worker.
+    JUDGE_CONCURRENCY (int): Maximum running jobs of a judge dispatcher.
+    JUDGE_LEASE (float): Seconds of the lease of a claimed judge job.
+    JUDGE_ATTEMPTS (int): Maximum attempts of a judge job.
+    JUDGE_POLL (float): Seconds to poll the expired judge jobs.
+    JUDGE_TIMEOUT (float): Seconds to wait for a judge response.
+    JUDGE_BACKOFF (float): Initial seconds to back off from a failed judge.
+    JUDGE_MAX_BACKOFF (float): Maximum seconds to back off from a judge.
+    JUDGE_CALLBACK_URL (str | None): Base URL for the judge servers to post
+        the results back, None means waiting for the judge responses.
+    JUDGE_SECRET (str): Secret to sign the judge callbacks.
+    JUDGE_STREAM_INTERVAL (float): Seconds to batch the streamed results.
+    REJUDGE_CONCURRENCY (int): Maximum running rejudge jobs.
+    JUDGE_CACHE (str): Verdict cache policy, 'off', 'ce' or 'all'.
+    JUDGE_CACHE_EXPIRE (int): Seconds to keep the cached verdicts.
+    CODE_ACCEL (bool): Serve the code through x-accel-redirect of
+        /internal/code/, which maps to CODE_DIR.
+    CODE_CACHE_SIZE (int): Maximum materialized code files to keep.
 
 '''
 
@@ -28,8 +48,30 @@ DB_URL = 'postgresql://{}:{}@{}:{}/{}'.format(
 REDIS_URL = 'redis://@{}:{}/0'.format(
     environ.get('REDISHOST'), environ.get('REDISPORT'))
 
-JUDGE_URL = environ.get('JUDGEURL')
+# Comma separated, JUDGEURL is a single URL for compatibility.
+JUDGE_URLS = [url.strip() for url
+    in environ.get('JUDGEURLS', environ.get('JUDGEURL', '')).split(',')
+    if url.strip() != '']
 
 PROBLEM_DIR = environ.get('PROBLEMDIR')
 CODE_DIR = environ.get('CODEDIR')
 CODE_LIMIT = int(environ.get('CODELIMIT'))
+
+SCORING_WINDOW = float(environ.get('SCORINGWINDOW', '0.5'))
+SCORING_CONCURRENCY = int(environ.get('SCORINGCONCURRENCY', '2'))
+
+JUDGE_CONCURRENCY = int(environ.get('JUDGECONCURRENCY', '4'))
+JUDGE_LEASE = float(environ.get('JUDGELEASE', '60'))
+JUDGE_ATTEMPTS = int(environ.get('JUDGEATTEMPTS', '3'))
+JUDGE_POLL = float(environ.get('JUDGEPOLL', '5'))
+JUDGE_TIMEOUT = float(environ.get('JUDGETIMEOUT', '600'))
+JUDGE_BACKOFF = float(environ.get('JUDGEBACKOFF', '1'))
+JUDGE_MAX_BACKOFF = float(environ.get('JUDGEMAXBACKOFF', '60'))
+JUDGE_CALLBACK_URL = environ.get('JUDGECALLBACKURL') or None
+JUDGE_SECRET = environ.get('JUDGESECRET', '')
+JUDGE_STREAM_INTERVAL = float(environ.get('JUDGESTREAMINTERVAL', '0.2'))
+REJUDGE_CONCURRENCY = int(environ.get('REJUDGECONCURRENCY', '2'))
+JUDGE_CACHE = environ.get('JUDGECACHE', 'off')
+JUDGE_CACHE_EXPIRE = int(environ.get('JUDGECACHEEXPIRE', '86400'))
+CODE_ACCEL = environ.get('CODEACCEL', '') == 'true'
+CODE_CACHE_SIZE = int(environ.get('CODECACHESIZE', '1024'))
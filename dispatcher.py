@@ -0,0 +1,42 @@
+'''Judge dispatcher program
+
+Claim the judge jobs from the queue and emit them to the judge server. Many
+dispatchers can run at the same time.
+
+Usage:
+    python dispatcher.py
+
+'''
+
+
+import config
+import model.scoring
+import judge
+import judge.pool
+import asyncio
+import logging
+import redis
+import aiopg.sa
+
+
+def start_dispatcher():
+    '''Start the judge dispatcher.'''
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def async_lambda():
+        '''Async lambda function.'''
+
+        engine = await aiopg.sa.create_engine(config.DB_URL)
+        redis_pool = redis.ConnectionPool.from_url(config.REDIS_URL)
+        model.scoring.start_scheduler(engine, redis_pool)
+        pool = judge.pool.JudgePool()
+        dispatcher = judge.Dispatcher(engine, redis_pool, pool)
+        await dispatcher.run()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(loop.create_task(async_lambda()))
+
+
+if __name__ == '__main__':
+    start_dispatcher()
@@ -0,0 +1,455 @@
+'''Judge module
+
+Judge jobs are claimed from the durable queue in model.job, then emitted to
+the judge server.
+
+'''
+
+
+import config
+import model.challenge
+import model.job
+import model.code
+import model.verdict
+import os
+import json
+import hmac
+import hashlib
+import socket
+import asyncio
+import logging
+import collections
+import redis
+from sqlalchemy.sql.expression import text
+from model.challenge import JudgeState, JudgeResult
+
+
+# Seconds to keep the published status of a dispatcher.
+STATUS_EXPIRE = 60
+
+
+def get_code_path(challenge):
+    '''Get the file path of the submitted code.
+
+    The stored code is materialized to a plain file.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        String
+
+    '''
+
+    code_path = model.code.materialize(challenge)
+    if code_path is None:
+        raise RuntimeError('Failed to materialize challenge {}.'.format(
+            challenge.uid))
+
+    return code_path
+
+
+def sign(challenge_uid, job_uid):
+    '''Sign the callback of the judge job.
+
+    Args:
+        challenge_uid (int): Challenge ID.
+        job_uid (int): Judge job ID.
+
+    Returns:
+        String
+
+    '''
+
+    message = '{}:{}'.format(challenge_uid, job_uid)
+    return hmac.new(config.JUDGE_SECRET.encode('utf-8'),
+        message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def verify(challenge_uid, job_uid, token):
+    '''Verify the callback token of the judge job.
+
+    Args:
+        challenge_uid (int): Challenge ID.
+        job_uid (int): Judge job ID.
+        token (string): Callback token.
+
+    Returns:
+        True | False
+
+    '''
+
+    if config.JUDGE_SECRET == '':
+        return False
+
+    return hmac.compare_digest(sign(challenge_uid, job_uid), token)
+
+
+def parse_results(results):
+    '''Convert the judge results to the subtask results.
+
+    Args:
+        results ([object]): Results from the judge server.
+
+    Returns:
+        [(index (int), state (JudgeState), metadata (object))]
+
+    '''
+
+    return [(result['test_idx'], JudgeState.done, {
+        'result': result['state'],
+        'runtime': result['runtime'],
+        'memory': result['peakmem'] / 1024,
+        'verdict': result['verdict'],
+    }) for result in results]
+
+
+async def apply_results(challenge, queue, interval=config.JUDGE_STREAM_INTERVAL):
+    '''Apply the streamed results in batches.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+        queue (asyncio.Queue): Results, ended with None.
+        interval (float): Seconds to wait for more results of a batch.
+
+    '''
+
+    while True:
+        items = [await queue.get()]
+        if items[0] is not None:
+            # Wait for the results arriving together.
+            await asyncio.sleep(interval)
+
+        while not queue.empty():
+            items.append(queue.get_nowait())
+
+        results = [item for item in items if item is not None]
+        if len(results) > 0:
+            if not await challenge.update_subtasks(parse_results(results)):
+                raise RuntimeError('Failed to update challenge {}.'.format(
+                    challenge.uid))
+
+        if None in items:
+            return
+
+
+async def judge(challenge, job, pool, callback_url=None):
+    '''Emit the challenge and update the results.
+
+    With the callback URL, the judge server returns immediately and posts the
+    results to /internal/judge/{challenge_uid}/result later. Only the subtasks
+    which aren't done are emitted, so the kept results of a selective rejudge
+    aren't judged again.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+        job (JudgeJobModel): Judge job.
+        pool (JudgePool): Judge pool.
+        callback_url (string) optional: Base URL of the callbacks.
+
+    Returns:
+        True | False: The results are stored or will be posted back.
+
+    '''
+
+    problem = challenge.problem
+    code_path = os.path.abspath(job.code_path)
+    res_path = os.path.abspath(
+        os.path.join(config.PROBLEM_DIR, '{}/res'.format(problem.uid)))
+    code_path = code_path[len('/home/sptoj'):]
+    res_path = res_path[len('/home/sptoj'):]
+
+    subtasks = await challenge.list()
+    if subtasks is None:
+        raise RuntimeError('Failed to list challenge {}.'.format(
+            challenge.uid))
+
+    indices = set(subtask.index for subtask in subtasks
+        if subtask.state != JudgeState.done)
+    if len(indices) == 0:
+        return True
+
+    tests = []
+    for idx, test in enumerate(problem.metadata['test']):
+        if idx not in indices:
+            continue
+
+        tests.append({
+            'test_idx': idx,
+            'timelimit': problem.metadata['timelimit'],
+            'memlimit': problem.metadata['memlimit'] * 1024,
+            'metadata': { 'data': test['data'] }
+        })
+
+    if not await challenge.start():
+        raise RuntimeError('Failed to start challenge {}.'.format(
+            challenge.uid))
+
+    data = {
+        'chal_id': challenge.uid,
+        'code_path': code_path,
+        'res_path': res_path,
+        'comp_type': problem.metadata['compile'],
+        'check_type': problem.metadata['check'],
+        'metadata': problem.metadata.get('metadata', {}),
+        'test': tests,
+    }
+
+    if callback_url is not None:
+        data['callback'] = {
+            'url': '{}/internal/judge/{}/result'.format(callback_url,
+                challenge.uid),
+            'job': job.uid,
+            'token': sign(challenge.uid, job.uid),
+        }
+        await pool.request(data)
+        return False
+
+    # Apply the streamed results in another task with the same context.
+    loop = asyncio.get_event_loop()
+    task = asyncio.Task.current_task()
+    queue = asyncio.Queue()
+    writer = loop.create_task(apply_results(challenge, queue))
+    writer._conn = task._conn
+    writer._redis = task._redis
+
+    try:
+        response = await pool.request(data, stream=queue.put_nowait)
+    finally:
+        queue.put_nowait(None)
+        await writer
+
+    # Fallback to the results at once.
+    if response is not None:
+        if not await challenge.update_subtasks(
+                parse_results(response['result'])):
+            raise RuntimeError('Failed to update challenge {}.'.format(
+                challenge.uid))
+
+    return True
+
+
+async def abort(challenge):
+    '''Finish the challenge with system errors.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    '''
+
+    if not await challenge.update_subtasks([(idx, JudgeState.done, {
+            'result': JudgeResult.STATUS_ERR,
+            'runtime': 0,
+            'memory': 0,
+            'verdict': [],
+        }) for idx, test in enumerate(challenge.problem.metadata['test'])]):
+        raise RuntimeError('Failed to abort challenge {}.'.format(
+            challenge.uid))
+
+
+class Dispatcher(object):
+    '''Judge dispatcher.
+
+    Jobs are delivered at least once. A job is removed only after its results
+    are stored, and the job of a dead worker is claimed again once its lease
+    is expired.
+
+    '''
+
+    def __init__(self, engine, redis_pool, pool,
+        concurrency=config.JUDGE_CONCURRENCY, lease_time=config.JUDGE_LEASE,
+        attempts=config.JUDGE_ATTEMPTS, poll=config.JUDGE_POLL,
+        callback_url=config.JUDGE_CALLBACK_URL,
+        rejudge_limit=config.REJUDGE_CONCURRENCY):
+        '''Initialize.
+
+        Args:
+            engine (object): Database engine.
+            redis_pool (object): Redis connection pool.
+            pool (JudgePool): Judge pool.
+            concurrency (int): Maximum number of running jobs.
+            lease_time (float): Lease time of a job in seconds.
+            attempts (int): Maximum attempts of a job.
+            poll (float): Seconds to poll the expired leases.
+            callback_url (string) optional: Base URL of the judge callbacks,
+                None means waiting for the results. It requires
+                config.JUDGE_SECRET to sign the callbacks.
+            rejudge_limit (int): Maximum running rejudge jobs of all
+                dispatchers.
+
+        '''
+
+        # All callbacks would be rejected without the secret.
+        if callback_url is not None and config.JUDGE_SECRET == '':
+            raise ValueError('JUDGE_SECRET is required by the judge callbacks.')
+
+        self.engine = engine
+        self.redis_pool = redis_pool
+        self.pool = pool
+        self.concurrency = concurrency
+        self.lease_time = lease_time
+        self.attempts = attempts
+        self.poll = poll
+        self.callback_url = callback_url
+        self.rejudge_limit = rejudge_limit
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.counter = collections.Counter()
+
+    def status(self):
+        '''Get the status.
+
+        Returns:
+            { 'name' (string), 'running' (int), 'done' (int),
+                'failed' (int), 'judges' ([Object]) }
+
+        '''
+
+        return {
+            'name': self.name,
+            'running': self.counter['claimed'] - self.counter['done'] -
+                self.counter['failed'],
+            'done': self.counter['done'],
+            'failed': self.counter['failed'],
+            'judges': self.pool.status(),
+        }
+
+    async def report(self):
+        '''Publish the status to Redis periodically.'''
+
+        rsconn = redis.StrictRedis(connection_pool=self.redis_pool)
+
+        while True:
+            try:
+                rsconn.setex('JUDGESTATUS@{}'.format(self.name),
+                    STATUS_EXPIRE, json.dumps(self.status()))
+            except:
+                logging.exception('Failed to publish the status.')
+
+            await asyncio.sleep(STATUS_EXPIRE / 3)
+
+    async def run(self):
+        '''Dispatcher loop.'''
+
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.report())
+
+        async with self.engine.acquire() as listen_conn:
+            count = await model.job.recover(conn=listen_conn)
+            if count > 0:
+                logging.info('Recovered %d challenges.', count)
+
+            await listen_conn.execute(text('LISTEN {}'.format(
+                model.job.NOTIFY_CHANNEL)))
+            notifies = listen_conn.connection.notifies
+
+            while True:
+                await self.semaphore.acquire()
+
+                job = None
+                try:
+                    async with self.engine.acquire() as conn:
+                        job = await model.job.claim(self.name,
+                            self.lease_time, self.rejudge_limit, conn=conn)
+                except:
+                    logging.exception('Failed to claim a job.')
+
+                if job is None:
+                    self.semaphore.release()
+
+                    # Wait for new jobs or expired leases.
+                    try:
+                        await asyncio.wait_for(notifies.get(), self.poll)
+                    except asyncio.TimeoutError:
+                        pass
+
+                    continue
+
+                self.counter['claimed'] += 1
+                loop.create_task(self.execute(job))
+
+    async def keep_lease(self, job):
+        '''Renew the lease until cancelled.
+
+        Args:
+            job (JudgeJobModel): Job.
+
+        '''
+
+        while True:
+            await asyncio.sleep(self.lease_time / 3)
+
+            try:
+                async with self.engine.acquire() as conn:
+                    if not await model.job.renew(job, self.lease_time,
+                            conn=conn):
+                        logging.warning('Lost the lease of job %d.', job.uid)
+                        return
+            except:
+                logging.exception('Failed to renew job %d.', job.uid)
+
+    async def execute(self, job):
+        '''Execute a job.
+
+        Args:
+            job (JudgeJobModel): Job.
+
+        '''
+
+        loop = asyncio.get_event_loop()
+        keeper = loop.create_task(self.keep_lease(job))
+
+        try:
+            async with self.engine.acquire() as conn:
+                # Setup model context.
+                task = asyncio.Task.current_task()
+                task._conn = conn
+                task._redis = redis.StrictRedis(connection_pool=self.redis_pool)
+
+                done = True
+                challenge = await model.challenge.get(job.challenge.uid)
+                if challenge is not None:
+                    # Materialize again on every claim, since the cached
+                    # file may be evicted since the last claim.
+                    if job.code_path is None or challenge.code_hash is not None:
+                        job.code_path = await loop.run_in_executor(None,
+                            get_code_path, challenge)
+
+                    if job.rejudge is not None:
+                        # Rejudge jobs are queued in bulk, and the challenges
+                        # are reset when claimed.
+                        rejudge = await model.job.get_rejudge(job.rejudge)
+                        if rejudge is None or not await challenge.reset(
+                                rejudge.selective):
+                            raise RuntimeError(
+                                'Failed to reset challenge {}.'.format(
+                                    challenge.uid))
+
+                    if job.attempts > self.attempts:
+                        logging.error('Give up challenge %d.', challenge.uid)
+                        await abort(challenge)
+                    else:
+                        done = await judge(challenge, job, self.pool,
+                            self.callback_url)
+
+                keeper.cancel()
+                if done:
+                    if challenge is not None and job.fingerprint is not None:
+                        await model.verdict.store(job.fingerprint, challenge)
+
+                    await model.job.finish(job, conn=conn)
+                else:
+                    # Hold the job until the final callback removes it, or
+                    # claim it again after the timeout.
+                    await model.job.renew(job, config.JUDGE_TIMEOUT,
+                        conn=conn)
+
+            self.counter['done'] += 1
+        except:
+            # Keep the job, it'll be claimed again after the lease.
+            logging.exception('Failed to judge challenge %d.',
+                job.challenge.uid)
+            self.counter['failed'] += 1
+        finally:
+            keeper.cancel()
+            self.semaphore.release()
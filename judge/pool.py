@@ -0,0 +1,244 @@
+'''Judge pool module
+
+Route the challenges to many judge servers.
+
+'''
+
+
+import config
+import json
+import asyncio
+import aiohttp
+
+
+# Content type of the streamed results.
+NDJSON_TYPE = 'application/x-ndjson'
+
+
+class JudgeError(Exception):
+    '''Judge request failed.'''
+
+
+class JudgeEndpoint(object):
+    '''Judge server endpoint with a keep-alive session.'''
+
+    def __init__(self, url, connections):
+        '''Initialize.
+
+        Args:
+            url (string): Judge server URL.
+            connections (int): Maximum connections.
+
+        '''
+
+        self.url = url
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections))
+        self.inflight = 0
+        self.failures = 0
+        self.backoff_until = 0
+        self.requests = 0
+        self.tests = 0
+        self.errors = 0
+        self.latency = 0.0
+
+    def is_available(self, now):
+        '''Check if the endpoint isn't backing off.
+
+        Args:
+            now (float): Loop time.
+
+        Returns:
+            True | False
+
+        '''
+
+        return self.backoff_until <= now
+
+    def status(self):
+        '''Get the status.
+
+        Returns:
+            { 'url' (string), 'inflight' (int), 'requests' (int),
+                'tests' (int), 'errors' (int), 'latency' (float),
+                'available' (bool) }
+
+        '''
+
+        latency = 0.0
+        if self.requests > 0:
+            latency = self.latency / self.requests
+
+        loop = asyncio.get_event_loop()
+        return {
+            'url': self.url,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'tests': self.tests,
+            'errors': self.errors,
+            'latency': latency,
+            'available': self.is_available(loop.time()),
+        }
+
+
+class JudgePool(object):
+    '''Judge server pool.
+
+    Each request goes to the available endpoint with the fewest in-flight
+    tests. Failed endpoints back off exponentially until a request succeeds.
+
+    '''
+
+    def __init__(self, urls=config.JUDGE_URLS, timeout=config.JUDGE_TIMEOUT,
+        backoff=config.JUDGE_BACKOFF, max_backoff=config.JUDGE_MAX_BACKOFF,
+        connections=config.JUDGE_CONCURRENCY):
+        '''Initialize.
+
+        Args:
+            urls ([string]): Judge server URLs.
+            timeout (float): Request timeout in seconds.
+            backoff (float): Initial backoff in seconds.
+            max_backoff (float): Maximum backoff in seconds.
+            connections (int): Maximum connections per endpoint.
+
+        '''
+
+        assert len(urls) > 0
+
+        self.endpoints = [JudgeEndpoint(url, connections) for url in urls]
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def pick(self):
+        '''Pick the endpoint of the next request.
+
+        If all endpoints are backing off, the one which recovers first is
+        picked.
+
+        Returns:
+            JudgeEndpoint
+
+        '''
+
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+
+        endpoints = [endpoint for endpoint in self.endpoints
+            if endpoint.is_available(now)]
+        if len(endpoints) == 0:
+            return min(self.endpoints,
+                key=lambda endpoint: endpoint.backoff_until)
+
+        return min(endpoints, key=lambda endpoint: endpoint.inflight)
+
+    async def request(self, data, stream=None):
+        '''Emit a judge request.
+
+        If the judge server responds NDJSON, each line is a test result or
+        an object with a list of results, and they are passed to the stream
+        function as they arrive.
+
+        Args:
+            data (object): Request data.
+            stream (function) optional: Receive the streamed results.
+
+        Returns:
+            Object | None: Response data, None if the results are streamed, or
+                the judge server accepts the request and posts the results
+                back later.
+
+        '''
+
+        headers = {}
+        if stream is not None:
+            headers['accept'] = '{}, application/json'.format(NDJSON_TYPE)
+
+        loop = asyncio.get_event_loop()
+        endpoint = self.pick()
+        count = len(data['test'])
+
+        endpoint.inflight += count
+        start = loop.time()
+        try:
+            with aiohttp.Timeout(self.timeout):
+                async with endpoint.session.post(endpoint.url + '/reqjudge',
+                    data=json.dumps(data), headers=headers) as response:
+                    content_type = response.headers.get('content-type', '')
+                    if response.status == 202:
+                        # Accepted, the results will be posted back.
+                        result = None
+                    elif (response.status == 200 and stream is not None and
+                        content_type.startswith(NDJSON_TYPE)):
+                        result = None
+                        await self.read_stream(response, stream)
+                    elif response.status == 200:
+                        result = await response.json()
+                    else:
+                        raise JudgeError('{} responded {}.'.format(
+                            endpoint.url, response.status))
+        except asyncio.CancelledError:
+            # The caller gave up, the endpoint didn't fail.
+            raise
+        except Exception as err:
+            endpoint.errors += 1
+            endpoint.failures += 1
+            backoff = min(self.max_backoff,
+                self.backoff * 2**(endpoint.failures - 1))
+            endpoint.backoff_until = loop.time() + backoff
+
+            if isinstance(err, JudgeError):
+                raise
+
+            raise JudgeError('{} failed.'.format(endpoint.url)) from err
+        finally:
+            endpoint.inflight -= count
+
+        endpoint.failures = 0
+        endpoint.backoff_until = 0
+        endpoint.requests += 1
+        endpoint.tests += count
+        endpoint.latency += loop.time() - start
+
+        return result
+
+    async def read_stream(self, response, stream):
+        '''Read the NDJSON results.
+
+        Args:
+            response (object): Response.
+            stream (function): Receive the results.
+
+        '''
+
+        while True:
+            line = await response.content.readline()
+            if len(line) == 0:
+                break
+
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            item = json.loads(line.decode('utf-8'))
+            if 'result' in item:
+                for result in item['result']:
+                    stream(result)
+            else:
+                stream(item)
+
+    def status(self):
+        '''Get the status of all endpoints.
+
+        Returns:
+            [Object]
+
+        '''
+
+        return [endpoint.status() for endpoint in self.endpoints]
+
+    def close(self):
+        '''Close all sessions.'''
+
+        for endpoint in self.endpoints:
+            endpoint.session.close()
@@ -0,0 +1,121 @@
+'''Migrate the submitted code to the code store
+
+Move the code of the challenges without the code hash from
+CODE_DIR/{challenge_uid}/main.cpp to the content-addressed code store.
+
+The code hash column is added to the existing challenge table first, since
+create_schemas doesn't alter the existing tables. Run it before starting the
+upgraded server.
+
+Usage:
+    python migrate_code.py [--remove]
+
+    --remove: Remove the migrated legacy files.
+
+'''
+
+
+import sys
+import os
+import shutil
+import config
+import asyncio
+import aiopg.sa
+import model.scoring
+import model.code
+from model.challenge import ChallengeModel
+
+
+# Number of challenges per batch.
+BATCH_SIZE = 1000
+
+
+async def upgrade_schema(conn):
+    '''Add the code hash column and its index to the challenge table.'''
+
+    await conn.execute('ALTER TABLE challenge '
+        'ADD COLUMN IF NOT EXISTS code_hash varchar')
+    await conn.execute('CREATE INDEX IF NOT EXISTS ix_challenge_code_hash '
+        'ON challenge (code_hash)')
+
+
+async def migrate(conn, remove):
+    '''Migrate all legacy challenges.
+
+    Args:
+        remove (bool): Remove the migrated legacy files.
+
+    Returns:
+        (migrated (int), missing (int))
+
+    '''
+
+    loop = asyncio.get_event_loop()
+    migrated = 0
+    missing = 0
+    last_uid = 0
+
+    while True:
+        challenges = []
+        async for challenge in await (ChallengeModel.select()
+            .where(ChallengeModel.code_hash == None)
+            .where(ChallengeModel.uid > last_uid)
+            .order_by(ChallengeModel.uid)
+            .limit(BATCH_SIZE)
+            .execute(conn)):
+            challenges.append(challenge)
+
+        if len(challenges) == 0:
+            break
+
+        for challenge in challenges:
+            last_uid = challenge.uid
+
+            code = await loop.run_in_executor(None, model.code.load,
+                challenge)
+            if code is None:
+                print('challenge {}: missing code'.format(challenge.uid))
+                missing += 1
+                continue
+
+            code_hash = await loop.run_in_executor(None, model.code.put, code)
+            if code_hash is None:
+                raise RuntimeError('Failed to store challenge {}.'.format(
+                    challenge.uid))
+
+            await (ChallengeModel.modify()
+                .where(ChallengeModel.uid == challenge.uid)
+                .values(code_hash=code_hash)
+                .execute(conn))
+            migrated += 1
+
+            if remove:
+                shutil.rmtree(os.path.dirname(
+                    model.code.get_legacy_path(challenge.uid)))
+
+    return (migrated, missing)
+
+
+def main():
+    '''Main function.'''
+
+    remove = '--remove' in sys.argv[1:]
+
+    async def async_lambda():
+        '''Async lambda function.'''
+
+        async with aiopg.sa.create_engine(config.DB_URL) as engine:
+            async with engine.acquire() as conn:
+                await upgrade_schema(conn)
+                return await migrate(conn, remove)
+
+    loop = asyncio.get_event_loop()
+    migrated, missing = loop.run_until_complete(
+        loop.create_task(async_lambda()))
+    print('{} migrated, {} missing'.format(migrated, missing))
+
+    return 1 if missing > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
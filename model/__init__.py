@@ -3,10 +3,37 @@
 
 import config
 import redis
+import json
 import collections
 import asyncio
+import weakref
 import sqlalchemy as sa
 from sqlalchemy import MetaData
+from sqlalchemy.dialects import postgresql
+
+
+# Maximum number of bind parameters per statement.
+MAX_PARAMS = 32767
+
+# Quote the identifiers in the raw SQL.
+identifier_preparer = postgresql.dialect().identifier_preparer
+
+# Cached queries by key.
+query_cache = {}
+query_counter = collections.Counter()
+
+
+class Deferred(object):
+    '''Value of the deferred fields until BaseModel.load fetches them.'''
+
+    __slots__ = ()
+
+    def __repr__(self):
+
+        return 'DEFERRED'
+
+
+DEFERRED = Deferred()
 
 
 class Relation(object):
@@ -99,8 +126,48 @@ class ShadowMeta(type):
 
         return (relation_columns, sa.select(select_columns, from_obj=query))
 
+    def build_hydration_plan(model_cls, prefix, deferred=frozenset()):
+        '''Build the plan to hydrate the instance from the result rows.
+
+        The result keys of all columns, including the nested relations, are
+        computed once instead of per row.
+
+        Args:
+            model_cls (ShadowMeta): Model class.
+            prefix (string): Result key prefix.
+            deferred (frozenset): Result keys of the deferred columns, whose
+                result keys are None in the plan.
+
+        Returns:
+            ([(field key, result key)], [(field key, target class, plan)])
+
+        '''
+
+        columns = []
+        for key, column in model_cls._columns.items():
+            result_key = prefix + column.name
+            if result_key in deferred:
+                result_key = None
+
+            columns.append((key, result_key))
+        columns = tuple(columns)
+
+        relations = []
+        for key, relation in model_cls._relations.items():
+            if not relation.reverse:
+                target_cls = relation.target_cls
+                relations.append((key, target_cls,
+                    ShadowMeta.build_hydration_plan(target_cls,
+                        '{}__{}_'.format(prefix, key), deferred)))
+
+        return (columns, tuple(relations))
+
     def __new__(cls, name, bases, namespace):
 
+        # Keep the fields in BaseModel._fields without the instance dict.
+        namespace = dict(namespace)
+        namespace.setdefault('__slots__', ())
+
         model_cls = type.__new__(cls, name, bases, namespace)
 
         if name == 'BaseModel':
@@ -159,6 +226,7 @@ class ShadowMeta(type):
             model_cls._metadata, *table_columns)
         model_cls._relcolumns, model_cls._relquery = cls.build_relation_query(
             model_cls._table, relations)
+        model_cls._plan = cls.build_hydration_plan(model_cls, '')
 
         return model_cls
 
@@ -181,10 +249,11 @@ class ShadowMeta(type):
 
 class ShadowExpr(object):
 
-    def __init__(self, expr, typ=None):
+    def __init__(self, expr, typ=None, deferred=frozenset()):
 
         self.expr = expr
         self.typ = typ
+        self.deferred = deferred
 
     def __getattr__(self, name):
 
@@ -201,10 +270,86 @@ class ShadowExpr(object):
             for key, value in kwargs.items():
                 proxy_kwargs[key] = self.proxy_value(value)
 
-            return ShadowExpr(func(*proxy_args, **proxy_kwargs), typ=self.typ)
+            return ShadowExpr(func(*proxy_args, **proxy_kwargs), typ=self.typ,
+                deferred=self.deferred)
 
         return wrapper
 
+    def project(self, is_deferred):
+        '''Drop the selected columns which are deferred.
+
+        Args:
+            is_deferred (function): Check if the column is deferred.
+
+        Returns:
+            ShadowExpr
+
+        '''
+
+        deferred = set(self.deferred)
+        select_columns = []
+        for column in self.expr.inner_columns:
+            # Relation columns are labeled in the relation query.
+            element = column
+            if isinstance(column, sa.sql.elements.Label):
+                element = column.element
+
+            if is_deferred(element):
+                deferred.add(column.name)
+            else:
+                select_columns.append(column)
+
+        return ShadowExpr(self.expr.with_only_columns(select_columns),
+            typ=self.typ, deferred=frozenset(deferred))
+
+    def defer(self, *columns):
+        '''Select the model without the columns.
+
+        The deferred fields of the instances are loaded by BaseModel.load.
+
+        Args:
+            columns ([sa.Column]): Columns, like ProblemModel.metadata or
+                ChallengeModel.problem.metadata.
+
+        Returns:
+            ShadowExpr
+
+        '''
+
+        column_ids = set(id(column) for column in columns)
+        return self.project(lambda column: id(column) in column_ids)
+
+    def only(self, *columns):
+        '''Select the model with only the columns and the primary keys.
+
+        Args:
+            columns ([sa.Column]): Columns.
+
+        Returns:
+            ShadowExpr
+
+        '''
+
+        column_ids = set(id(column) for column in columns)
+        return self.project(lambda column: (id(column) not in column_ids and
+            not column.primary_key))
+
+    def get_plan(self):
+        '''Get the hydration plan of the selected columns.
+
+        Returns:
+            object | None
+
+        '''
+
+        if not isinstance(self.typ, ShadowMeta):
+            return None
+
+        if len(self.deferred) == 0:
+            return self.typ._plan
+
+        return ShadowMeta.build_hydration_plan(self.typ, '', self.deferred)
+
     def proxy_value(self, value):
 
         if isinstance(value, ShadowExpr):
@@ -217,16 +362,19 @@ class ShadowExpr(object):
     async def execute(self, conn):
 
         results = await conn.execute(self.expr)
-        return ShadowResult(results, self.typ)
+        return ShadowResult(results, self.typ, self.get_plan())
 
 
 class ShadowResult(object):
 
-    def __init__(self, results, typ):
+    def __init__(self, results, typ, plan=None):
 
         self.results = results
         self.rowcount = self.results.rowcount
         self.typ = typ
+        self.plan = plan
+        if plan is None and isinstance(typ, ShadowMeta):
+            self.plan = typ._plan
 
     def __aiter__(self):
 
@@ -240,6 +388,8 @@ class ShadowResult(object):
         
         if self.typ is None:
             return result
+        elif isinstance(self.typ, ShadowMeta):
+            return self.typ.hydrate(result, self.plan)
         else:
             return self.typ(result)
 
@@ -252,6 +402,8 @@ class ShadowResult(object):
             return None
         elif self.typ is None:
             return result
+        elif isinstance(self.typ, ShadowMeta):
+            return self.typ.hydrate(result, self.plan)
         else:
             return self.typ(result)
 
@@ -268,19 +420,51 @@ class ShadowResult(object):
 
 class BaseModel(object, metaclass=ShadowMeta):
 
+    # The dirty fields of the persisted instance, or None if the instance
+    # isn't persisted, and the snapshots of the JSON values read.
+    __slots__ = ('_fields', '_dirty', '_snapshots')
+
     _metadata = MetaData()
 
+    @classmethod
+    def hydrate(cls, result_obj, plan):
+        '''Build the instance from the result row with the hydration plan.
+
+        Args:
+            result_obj (object): Result row.
+            plan (object): Plan from ShadowMeta.build_hydration_plan.
+
+        Returns:
+            BaseModel
+
+        '''
+
+        columns, relations = plan
+        fields = {}
+        for key, result_key in columns:
+            if result_key is None:
+                fields[key] = DEFERRED
+            else:
+                fields[key] = result_obj[result_key]
+
+        for key, target_cls, target_plan in relations:
+            fields[key] = target_cls.hydrate(result_obj, target_plan)
+
+        instance = object.__new__(cls)
+        object.__setattr__(instance, '_fields', fields)
+        object.__setattr__(instance, '_dirty', set())
+        object.__setattr__(instance, '_snapshots', None)
+        return instance
+
     def __init__(self, _result_obj=None, _prefix='', **kwargs):
 
         if _result_obj is not None:
-            fields = dict((key, _result_obj[_prefix + column.name])
-                for key, column in self._columns.items())
+            plan = self._plan
+            if _prefix != '':
+                plan = ShadowMeta.build_hydration_plan(type(self), _prefix)
 
-            for key, relation in self._relations.items():
-                if not relation.reverse:
-                    target_cls = relation.target_cls
-                    next_prefix = '{}__{}_'.format(_prefix, key)
-                    fields[key] = target_cls(_result_obj, next_prefix)
+            fields = self.hydrate(_result_obj, plan)._fields
+            dirty = set()
         else:
             fields = {}
             for key, column in self._columns.items():
@@ -296,14 +480,41 @@ class BaseModel(object, metaclass=ShadowMeta):
                 if not relation.reverse and key in kwargs:
                     fields[key] = kwargs[key]
 
-        object.__setattr__(self, '_fields', fields)
+            dirty = None
 
-        if self._pname is not None:
-            self.update_reverse_relations()
+        object.__setattr__(self, '_fields', fields)
+        object.__setattr__(self, '_dirty', dirty)
+        object.__setattr__(self, '_snapshots', None)
 
     def __getattr__(self, name):
 
-        return self._fields[name]
+        if name in BaseModel.__slots__:
+            raise AttributeError(name)
+
+        fields = self._fields
+        if name in fields:
+            value = fields[name]
+            if value is DEFERRED:
+                raise AttributeError('{} is deferred'.format(name))
+
+            # JSON values may be changed in place, so snapshot them on the
+            # first read to compare when saving.
+            if (isinstance(value, (dict, list)) and
+                self._dirty is not None and name not in self._dirty):
+                self.take_snapshot(name, value)
+
+            return value
+
+        # Reverse relation queries are built on access, since most hydrated
+        # instances never use them.
+        relation = self._relations.get(name)
+        if relation is not None and relation.reverse:
+            pval = fields.get(self._pname)
+            if pval is not None:
+                return relation.target_cls.select().where(
+                    relation.rkey == pval)
+
+        raise AttributeError(name)
 
     def __setattr__(self, name, value):
 
@@ -328,39 +539,94 @@ class BaseModel(object, metaclass=ShadowMeta):
                 raise AttributeError
 
         self._fields[name] = value
+        if self._dirty is not None:
+            self._dirty.add(name)
 
-    def update_reverse_relations(self):
+    def take_snapshot(self, name, value):
+        '''Take the snapshot of the JSON value on the first read.
 
-        pval = self._fields[self._pname]
-        reverse_relations = [(key, relation) for key, relation
-            in self._relations.items() if relation.reverse]
+        JSON values may be changed in place without __setattr__, so they are
+        compared with the snapshots when saving.
 
-        if pval is None:
-            for key, relation in reverse_relations:
-                if key in self._fields:
-                    del self._fields[key]
-        else:
-            for key, relation in reverse_relations:
-                self._fields[key] = (relation.target_cls.select()
-                    .where(relation.rkey == pval))
+        Args:
+            name (string): Field name.
+            value (object): JSON value.
 
-    async def save(self, conn):
+        '''
+
+        snapshots = self._snapshots
+        if snapshots is None:
+            snapshots = {}
+            object.__setattr__(self, '_snapshots', snapshots)
+
+        if name not in snapshots:
+            snapshots[name] = json.dumps(value, sort_keys=True, default=str)
+
+    def get_dirty(self):
+        '''Get the dirty fields, including the JSON values changed in place.
+
+        Returns:
+            set | None: None if the instance isn't persisted.
+
+        '''
+
+        dirty = self._dirty
+        if dirty is None or self._snapshots is None:
+            return dirty
+
+        for name, snapshot in self._snapshots.items():
+            if name in dirty:
+                continue
+
+            if json.dumps(self._fields[name], sort_keys=True,
+                    default=str) != snapshot:
+                dirty.add(name)
+
+        return dirty
+
+    def mark_persisted(self):
+        '''Mark the instance persisted without dirty fields.'''
+
+        object.__setattr__(self, '_dirty', set())
+        object.__setattr__(self, '_snapshots', None)
+
+    def table_fields(self, keys=None):
+        '''Get the table fields to be saved.
+
+        Args:
+            keys (set) optional: Only get the fields of the keys.
+
+        Returns:
+            {column name (string): value (object), ...}
+
+        '''
 
         table_fields = {}
 
         for key, column in self._columns.items():
+            if keys is not None and key not in keys:
+                continue
+
             if key not in self._fields:
                 raise AttributeError
 
-            if key == self._pname and self._fields[key] is None:
+            value = self._fields[key]
+            if key == self._pname and value is None:
                 continue
 
-            table_fields[column.name] = self._fields[key]
+            # Deferred columns are left untouched.
+            if value is DEFERRED:
+                continue
+
+            table_fields[column.name] = value
 
         for key, relation in self._relations.items():
             if relation.reverse:
                 continue
 
+            if keys is not None and key not in keys:
+                continue
+
             if key not in self._fields:
                 raise AttributeError
 
@@ -370,6 +636,37 @@ class BaseModel(object, metaclass=ShadowMeta):
 
             table_fields[relation.rkey.name] = target_pval
 
+        return table_fields
+
+    async def save(self, conn):
+        '''Save the instance.
+
+        A persisted instance only updates the dirty fields, and does nothing if
+        no field is dirty. Otherwise all fields are upserted.
+
+        '''
+
+        dirty = self.get_dirty()
+        if dirty is not None and len(dirty) == 0:
+            return
+
+        table_fields = self.table_fields()
+        pkey_names = set(column.name
+            for column in self._table.primary_key.columns)
+
+        if dirty is not None:
+            dirty_fields = self.table_fields(dirty)
+
+            # Changed primary keys can't locate the row to be updated.
+            if pkey_names.isdisjoint(dirty_fields.keys()):
+                await conn.execute(self._table.update()
+                    .where(sa.and_(*[column == table_fields[column.name]
+                        for column in self._table.primary_key.columns]))
+                    .values(**dirty_fields))
+
+                self.mark_persisted()
+                return
+
         expr = (sa.dialects.postgresql.insert(self._table)
             .values(**table_fields)
             .on_conflict_do_update(
@@ -387,15 +684,134 @@ class BaseModel(object, metaclass=ShadowMeta):
             pval = await result.scalar()
             assert pval is not None
             self._fields[self._pname] = pval
-            # Since we may change the primary value, update reversed relation
-            # queries.
-            self.update_reverse_relations()
+
+        self.mark_persisted()
+
+    async def load(self, conn, *names):
+        '''Load the deferred fields.
+
+        Fields can't be fetched on attribute access, since the access is
+        synchronous.
+
+        Args:
+            names ([string]): Field names, default to all deferred fields.
+
+        '''
+
+        if len(names) == 0:
+            names = [key for key, value in self._fields.items()
+                if value is DEFERRED]
+            if len(names) == 0:
+                return
+
+        columns = [self._columns[name] for name in names]
+        pkey = self._symbols[self._pname].obj
+        results = await conn.execute(sa.select(columns)
+            .where(pkey == self._fields[self._pname]))
+        result = await results.first()
+        assert result is not None
+
+        for name, column in zip(names, columns):
+            self._fields[name] = result[column.name]
+
+    @classmethod
+    async def save_all(cls, instances, conn, returning=False):
+        '''Save many instances with multi-row upserts.
+
+        Instances are grouped by their fields and chunked to keep the number of
+        parameters per statement under MAX_PARAMS. An instance must not appear
+        twice in the same call. Persisted instances without dirty fields are
+        skipped.
+
+        Args:
+            instances ([BaseModel]): Instances of this model.
+            returning (bool): Populate the primary values or not.
+
+        '''
+
+        dirty_instances = []
+        for instance in instances:
+            assert type(instance) is cls
+
+            dirty = instance.get_dirty()
+            if dirty is None or len(dirty) > 0:
+                dirty_instances.append(instance)
+
+        instances = dirty_instances
+
+        if returning and cls._pname is not None:
+            await cls.allocate([instance for instance in instances
+                if instance._fields.get(cls._pname) is None], conn)
+
+        groups = collections.OrderedDict()
+        for instance in instances:
+            table_fields = instance.table_fields()
+            keys = tuple(sorted(table_fields.keys()))
+            groups.setdefault(keys, []).append((instance, table_fields))
+
+        for keys, group in groups.items():
+            chunk_size = max(1, MAX_PARAMS // len(keys))
+
+            for offset in range(0, len(group), chunk_size):
+                chunk = group[offset:offset + chunk_size]
+
+                expr = (sa.dialects.postgresql.insert(cls._table)
+                    .values([table_fields for _, table_fields in chunk]))
+                expr = expr.on_conflict_do_update(
+                    constraint=cls._table.primary_key,
+                    set_=dict((key, expr.excluded[key]) for key in keys))
+                await conn.execute(expr)
+
+                for instance, _ in chunk:
+                    # Without the primary values, the rows can't be updated.
+                    if (cls._pname is None or
+                        instance._fields.get(cls._pname) is not None):
+                        instance.mark_persisted()
+
+    @classmethod
+    async def allocate(cls, instances, conn):
+        '''Allocate the primary values from the sequence of the primary key.
+
+        PostgreSQL doesn't guarantee the order of RETURNING of a multi-row
+        INSERT, so the values are allocated before inserting.
+
+        Args:
+            instances ([BaseModel]): Instances without the primary values.
+
+        '''
+
+        if len(instances) == 0:
+            return
+
+        pkey = cls._symbols[cls._pname].obj
+        sequence = sa.func.pg_get_serial_sequence(
+            identifier_preparer.format_table(cls._table), pkey.name)
+        results = await conn.execute(sa.select([sa.func.nextval(sequence)])
+            .select_from(sa.func.generate_series(1, len(instances))))
+
+        for instance, row in zip(instances, await results.fetchall()):
+            instance._fields[cls._pname] = row[0]
 
     @classmethod
     def select(cls):
 
         return ShadowExpr(cls._relquery, typ=cls)
 
+    @classmethod
+    def insert(cls):
+
+        return ShadowExpr(cls._table.insert())
+
+    @classmethod
+    def modify(cls):
+        '''Build an UPDATE statement of the table.
+
+        It isn't named update, since models use update to save themselves.
+
+        '''
+
+        return ShadowExpr(cls._table.update())
+
     @classmethod
     def delete(cls):
 
@@ -419,6 +835,88 @@ def select(fields, cls=None):
     return ShadowExpr(sa.select(query_fields), typ=cls)
 
 
+class CachedQuery(object):
+    '''Query built and compiled once, and executed with bind parameters.
+
+    aiopg.sa.SAConnection compiles the statement on every execution through
+    its compile method, so the method is replaced to keep the compiled form
+    of each dialect. The statement is still executed through the connection.
+
+    '''
+
+    def __init__(self, expr):
+
+        self.expr = expr
+        self.plan = expr.get_plan()
+        self.compiled = weakref.WeakKeyDictionary()
+
+        statement = expr.expr
+        compile_statement = statement.compile
+
+        def compile(bind=None, dialect=None, **kwargs):
+            '''Compile the statement once per dialect.'''
+
+            if bind is not None or dialect is None or len(kwargs) > 0:
+                return compile_statement(bind=bind, dialect=dialect, **kwargs)
+
+            compiled = self.compiled.get(dialect)
+            if compiled is None:
+                compiled = compile_statement(dialect=dialect)
+                self.compiled[dialect] = compiled
+                query_counter['compile'] += 1
+
+            return compiled
+
+        statement.compile = compile
+
+    async def execute(self, conn, **params):
+
+        results = await conn.execute(self.expr.expr, **params)
+        return ShadowResult(results, self.expr.typ, self.plan)
+
+
+def cached_query(key, build):
+    '''Get the cached query of the shape, or build it.
+
+    The values of the query must be sa.bindparam, and they are passed to
+    CachedQuery.execute.
+
+    Args:
+        key (object): Key of the query shape.
+        build (function): Build the ShadowExpr of the query.
+
+    Returns:
+        CachedQuery
+
+    '''
+
+    query = query_cache.get(key)
+    if query is None:
+        query_counter['miss'] += 1
+        query = CachedQuery(build())
+        query_cache[key] = query
+    else:
+        query_counter['hit'] += 1
+
+    return query
+
+
+def get_query_stat():
+    '''Get the counters of the query cache.
+
+    Returns:
+        { 'hit' (int), 'miss' (int), 'compile' (int), 'size' (int) }
+
+    '''
+
+    return {
+        'hit': query_counter['hit'],
+        'miss': query_counter['miss'],
+        'compile': query_counter['compile'],
+        'size': len(query_cache),
+    }
+
+
 def model_context(func):
 
     class Context:
@@ -444,6 +942,7 @@ def create_schemas(db_url):
     import model.problem
     import model.proset
     import model.challenge
+    import model.job
 
     engine = sa.create_engine(db_url)
     BaseModel._metadata.create_all(engine)
@@ -458,6 +957,7 @@ def drop_schemas(db_url):
     import model.problem
     import model.proset
     import model.challenge
+    import model.job
 
     engine = sa.create_engine(db_url)
     BaseModel._metadata.drop_all(engine)
@@ -2,15 +2,17 @@
 
 
 import enum
+import logging
 import model.scoring
 from datetime import datetime, timezone
 from sqlalchemy import Table, Column,Integer, String, Enum, DateTime
-from sqlalchemy.sql.expression import func, text
+from sqlalchemy import bindparam
+from sqlalchemy.sql.expression import func, text, cast, case, literal
 from sqlalchemy.dialects.postgresql import JSONB
 from model.user import UserModel
 from model.proset import ProSetModel, ProItemModel
 from model.problem import ProblemModel
-from . import BaseModel, Relation, model_context, select
+from . import BaseModel, Relation, model_context, select, cached_query
 
 
 @enum.unique
@@ -42,38 +44,112 @@ class ChallengeModel(BaseModel):
     _state = Column('state', Enum(JudgeState))
     timestamp = Column('timestamp', DateTime(timezone=True), index=True)
     metadata = Column('metadata', JSONB)
+    code_hash = Column('code_hash', String, index=True)
     _submitter = Relation(UserModel, back_populates="challenges")
     _problem = Relation(ProblemModel, back_populates="challenges")
 
     @model_context
-    async def reset(self, ctx):
+    async def reset(self, selective=False, ctx=None):
         '''Reset the challenge.
 
+        With selective, the done subtasks whose test signatures are unchanged
+        are kept, and the challenge stays done if no subtask is reset.
+
+        Args:
+            selective (bool): Only reset the changed subtasks.
+
         Returns:
             True | False
 
         '''
         try:
+            old_state = self.state
+            tests = self.problem.metadata['test']
+
             async with ctx.conn.begin() as transaction:
-                self._revision = self.problem.revision
-                self._state = JudgeState.pending
-                self._metadata = {}
-                await self.save(ctx.conn)
+                await self.lock(ctx.conn)
 
-                # TODO Stronger ORM delete.
+                kept = set()
+                removed = []
                 async for subtask in (await self.subtasks.execute(ctx.conn)):
+                    if subtask.index < len(tests):
+                        signature = tests[subtask.index].get('signature')
+                        if (selective and signature is not None and
+                            subtask.state == JudgeState.done and
+                            subtask.metadata.get('signature') == signature):
+                            kept.add(subtask.index)
+                            continue
+
+                    removed.append(subtask.uid)
+
+                if len(removed) > 0:
                     await (SubtaskModel.delete()
-                        .where(SubtaskModel.uid == subtask.uid)
+                        .where(SubtaskModel.uid.in_(removed))
                         .execute(ctx.conn))
 
-                for idx, test in enumerate(self.problem.metadata['test']):
-                    subtask = SubtaskModel(index=idx, state=JudgeState.pending,
-                        metadata={}, challenge=self)
-                    await subtask.save(ctx.conn)
+                await SubtaskModel.save_all([SubtaskModel(index=idx,
+                        state=JudgeState.pending,
+                        metadata={ 'signature': test.get('signature') },
+                        challenge=self)
+                    for idx, test in enumerate(tests) if idx not in kept],
+                    ctx.conn)
+
+                self._revision = self.problem.revision
+                # A problem without tests has no subtasks to summarize.
+                if len(tests) > 0 and len(kept) == len(tests):
+                    await self.summarize(ctx.conn)
+                else:
+                    self._state = JudgeState.pending
+                    self._metadata = {}
+                    await self.save(ctx.conn)
+
+            # The accepted subtasks are gone, which can't be handled by the
+            # incremental update.
+            if old_state == JudgeState.done and len(removed) > 0:
+                await model.scoring.change_problem(self.problem.uid)
 
-                return True
+            return True
+        except:
+            logging.exception('Failed to reset challenge %d.', self.uid)
+            return False
+
+    @model_context
+    async def start(self, ctx):
+        '''Mark the pending challenge and its subtasks running.
+
+        Both are updated in one transaction with one statement each, so the
+        cost doesn't grow with the number of subtasks. A running challenge is
+        claimed again after its lease, so it's started again.
+
+        Returns:
+            True | False
+
+        '''
+
+        subtask_tbl = (select([SubtaskModel.uid])
+            .select_from(SubtaskModel.join(ChallengeModel))
+            .where(ChallengeModel.uid == self.uid)
+            .where(SubtaskModel.state == JudgeState.pending))
+
+        try:
+            async with ctx.conn.begin():
+                result = await (ChallengeModel.modify()
+                    .where(ChallengeModel.uid == self.uid)
+                    .where(ChallengeModel.state.in_([JudgeState.pending,
+                        JudgeState.running]))
+                    .values(state=JudgeState.running)
+                    .execute(ctx.conn))
+                if result.rowcount == 0:
+                    return False
+
+                await (SubtaskModel.modify()
+                    .where(SubtaskModel.uid.in_(subtask_tbl.expr))
+                    .values(state=JudgeState.running)
+                    .execute(ctx.conn))
+
+            self._state = JudgeState.running
+            return True
         except:
-            raise
             return False
 
     @model_context
@@ -90,65 +166,138 @@ class ChallengeModel(BaseModel):
 
         '''
 
-        try:
-            async with ctx.conn.begin() as transaction:
-                # Update subtask.
-                subtask = (await (await self.subtasks
-                    .where(SubtaskModel.index == index)
-                    .execute(ctx.conn)).first())
+        return await self.update_subtasks([(index, state, metadata)])
+
+    @model_context
+    async def update_subtasks(self, results, ctx=None):
+        '''Update many subtasks in one statement.
 
-                subtask._state = state
+        The summary of the challenge is computed once, and the scoring is
+        triggered once when the challenge is done.
+
+        Args:
+            results ([(index (int), state (JudgeState), metadata (object))]):
+                Subtask results. Metadata can be None.
+
+        Returns:
+            True | False
+
+        '''
+
+        if len(results) == 0:
+            return True
+
+        state_type = SubtaskModel.state.type
+        state_map = {}
+        metadata_map = {}
+        try:
+            for index, state, metadata in results:
+                state_map[int(index)] = cast(literal(JudgeState(state),
+                    state_type), state_type)
 
                 if metadata is not None:
-                    subtask.metadata['memory'] = int(metadata['memory'])
-                    subtask.metadata['runtime'] = int(metadata['runtime'])
-                    subtask.metadata['result'] = int(metadata['result'])
-                    subtask.metadata['verdict'] = [str(verdict)
-                        for verdict in metadata['verdict']]
-
-                await subtask.save(ctx.conn)
-
-                # Get state summary.
-                table = self.subtasks.alias().expr
-                state = (await (await select([func.min(table.c.state)], int)
-                    .select_from(table)
-                    .execute(ctx.conn)).scalar())
-
-                self._state = state
-
-                # Update metadata.
-                if self.state == JudgeState.done:
-                    total_mem = 0
-                    total_runtime = 0
-                    result = 0
-                    verdict = ''
-
-                    for subtask in await self.list():
-                        total_mem += subtask.metadata['memory']
-                        total_runtime += subtask.metadata['runtime']
-                        result = max(result, subtask.metadata['result'])
-
-                        # Get compile error information.
-                        if result == JudgeResult.STATUS_CE and verdict == '':
-                            # All compile error verdicts are same.
-                            verdict = subtask.metadata['verdict'][0]
-
-                    self.metadata = {
-                        'memory': total_mem,
-                        'runtime': total_runtime,
-                        'result': result,
-                        'verdict': verdict,
+                    metadata = {
+                        'memory': int(metadata['memory']),
+                        'runtime': int(metadata['runtime']),
+                        'result': int(metadata['result']),
+                        'verdict': [str(verdict)
+                            for verdict in metadata['verdict']],
                     }
+                    metadata_map[int(index)] = SubtaskModel.metadata.op('||')(
+                        cast(literal(metadata, JSONB), JSONB))
+        except (KeyError, TypeError, ValueError):
+            # Malformed results from the judge.
+            return False
+
+        subtask_tbl = (select([SubtaskModel.uid])
+            .select_from(SubtaskModel.join(ChallengeModel))
+            .where(ChallengeModel.uid == self.uid)
+            .where(SubtaskModel.index.in_(list(state_map.keys()))))
+
+        values = { 'state': case(state_map, value=SubtaskModel.index) }
+        if len(metadata_map) > 0:
+            values['metadata'] = case(metadata_map, value=SubtaskModel.index,
+                else_=SubtaskModel.metadata)
 
-                await self.save(ctx.conn)
+        try:
+            async with ctx.conn.begin() as transaction:
+                await self.lock(ctx.conn)
+
+                await (SubtaskModel.modify()
+                    .where(SubtaskModel.uid.in_(subtask_tbl.expr))
+                    .values(**values)
+                    .execute(ctx.conn))
+
+                await self.summarize(ctx.conn)
 
             if self.state == JudgeState.done:
-                await model.scoring.change_problem(self.problem.uid)
+                await model.scoring.change_challenge(self)
 
             return True
         except:
             return False
 
+    async def lock(self, conn):
+        '''Lock the challenge row until the transaction ends.
+
+        Concurrent updates of the same challenge are serialized, so the summary
+        sees the subtasks committed by the others.
+
+        '''
+
+        await (await select([ChallengeModel.uid])
+            .where(ChallengeModel.uid == self.uid)
+            .with_for_update()
+            .execute(conn)).first()
+
+    async def summarize(self, conn):
+        '''Compute and save the state and metadata from the subtasks.'''
+
+        def subtask_field(key):
+            '''Get the integer field of the subtask metadata.'''
+
+            return SubtaskModel.metadata[key].astext.cast(Integer)
+
+        # Get state summary.
+        summary = await (await select([
+                func.min(SubtaskModel.state).label('state'),
+                func.sum(subtask_field('memory')).label('memory'),
+                func.sum(subtask_field('runtime')).label('runtime'),
+                func.max(subtask_field('result')).label('result')
+            ])
+            .select_from(SubtaskModel.join(ChallengeModel))
+            .where(ChallengeModel.uid == self.uid)
+            .execute(conn)).first()
+
+        self._state = JudgeState(summary.state)
+
+        # Update metadata.
+        if self.state == JudgeState.done:
+            verdict = ''
+
+            # Get compile error information.
+            if summary.result == JudgeResult.STATUS_CE:
+                # All compile error verdicts are same.
+                verdict = await (await select([
+                        SubtaskModel.metadata['verdict'][0].astext
+                    ], str)
+                    .select_from(SubtaskModel.join(ChallengeModel))
+                    .where(ChallengeModel.uid == self.uid)
+                    .where(subtask_field('result') ==
+                        int(JudgeResult.STATUS_CE))
+                    .order_by(SubtaskModel.index)
+                    .limit(1)
+                    .execute(conn)).scalar()
+
+            self.metadata = {
+                'memory': summary.memory,
+                'runtime': summary.runtime,
+                'result': summary.result,
+                'verdict': verdict or '',
+            }
+
+        await self.save(conn)
+
     @model_context
     async def remove(self, ctx):
         '''Remove a challenge.
@@ -164,6 +313,7 @@ class ChallengeModel(BaseModel):
         try:
             old_state = self.state
             problem_uid = self.problem.uid
+            submitter_uid = self.submitter.uid
 
             result =  (await ChallengeModel.delete()
                 .where(ChallengeModel.uid == self.uid)
@@ -171,8 +321,10 @@ class ChallengeModel(BaseModel):
             if result == 0:
                 return False
 
+            # The submitter may have no other challenges of the problem.
             if old_state == JudgeState.done:
-                await model.scoring.change_problem(problem_uid)
+                await model.scoring.change_problem(problem_uid,
+                    user_uids=[submitter_uid])
 
             return True
         except:
@@ -229,12 +381,13 @@ class SubtaskModel(BaseModel):
 
 
 @model_context
-async def create(submitter, problem, ctx):
+async def create(submitter, problem, code_hash=None, ctx=None):
     '''Create a challenge.
 
     Args:
         submitter (UserModel): Submitter.
         problem (ProblemModel): Problem.
+        code_hash (string) optional: Hash of the stored code.
 
     Returns:
         ChallengeModel | None
@@ -248,14 +401,17 @@ async def create(submitter, problem, ctx):
                 state=JudgeState.pending,
                 timestamp=datetime.now(tz=timezone.utc),
                 metadata={},
+                code_hash=code_hash,
                 submitter=submitter,
                 problem=problem)
             await challenge.save(ctx.conn)
 
-            for idx, test in enumerate(problem.metadata['test']):
-                subtask = SubtaskModel(index=idx, state=JudgeState.pending,
-                    metadata={}, challenge=challenge)
-                await subtask.save(ctx.conn)
+            await SubtaskModel.save_all([SubtaskModel(index=idx,
+                    state=JudgeState.pending,
+                    metadata={ 'signature': test.get('signature') },
+                    challenge=challenge)
+                for idx, test in enumerate(problem.metadata['test'])],
+                ctx.conn)
 
         return challenge
     except:
@@ -274,17 +430,18 @@ async def get(uid, ctx):
 
     '''
 
+    query = cached_query('challenge.get', lambda: ChallengeModel.select()
+        .where(ChallengeModel.uid == bindparam('uid')))
+
     try:
-        return await (await ChallengeModel.select()
-            .where(ChallengeModel.uid == uid)
-            .execute(ctx.conn)).first()
+        return await (await query.execute(ctx.conn, uid=uid)).first()
     except:
         return None
 
 
 @model_context
 async def get_list(offset=0, limit=None, user_uid=None, problem_uid=None,
-    state=None, result=None, ctx=None):
+    state=None, result=None, defer=(), ctx=None):
     '''List the challenges.
 
     Args:
@@ -294,6 +451,7 @@ async def get_list(offset=0, limit=None, user_uid=None, problem_uid=None,
         problem_uid (int): Problem ID filter.
         state (JudgeState): State filter.
         result (JudgeResult): Result filter.
+        defer ([sa.Column]): Columns not to be loaded.
 
     Returns:
         { 'count' (int), 'data' ([ChallengeModel]) } | None
@@ -302,6 +460,9 @@ async def get_list(offset=0, limit=None, user_uid=None, problem_uid=None,
 
     query = ChallengeModel.select()
 
+    if len(defer) > 0:
+        query = query.defer(*defer)
+
     if user_uid is not None:
         query = query.where(ChallengeModel.submitter.uid == user_uid)
 
@@ -332,16 +493,15 @@ async def get_list(offset=0, limit=None, user_uid=None, problem_uid=None,
         return None
 
 
-@model_context
-async def stat_result(user_uids, problem_uids, ctx=None):
-    '''Statistic results.
+async def query_stat_result(user_uids, problem_uids, conn=None):
+    '''Statistic results with the connection.
 
     Args:
         user_uids ([int]): Included User IDs.
         problem_uids ([int]): Included Problem IDs.
 
     Returns:
-        {(user_uid (int), problem_uid (int)): result (int), ...} | None
+        {(user_uid (int), problem_uid (int)): result (int), ...}
 
     '''
 
@@ -360,11 +520,27 @@ async def stat_result(user_uids, problem_uids, ctx=None):
         .where(ProblemModel.uid.in_(problem_uids))
         .group_by(UserModel.uid, ProblemModel.uid))
 
-    try:
-        ret_map = {}
-        async for result in await query.execute(ctx.conn):
-            ret_map[(result.user_uid, result.problem_uid)] = result.result
+    ret_map = {}
+    async for result in await query.execute(conn):
+        ret_map[(result.user_uid, result.problem_uid)] = result.result
+
+    return ret_map
+
 
-        return ret_map
+@model_context
+async def stat_result(user_uids, problem_uids, ctx=None):
+    '''Statistic results.
+
+    Args:
+        user_uids ([int]): Included User IDs.
+        problem_uids ([int]): Included Problem IDs.
+
+    Returns:
+        {(user_uid (int), problem_uid (int)): result (int), ...} | None
+
+    '''
+
+    try:
+        return await query_stat_result(user_uids, problem_uids, conn=ctx.conn)
     except:
         return None
@@ -0,0 +1,300 @@
+'''Code store module
+
+Submitted code is stored once per content under CODE_DIR, and challenges
+point to it by the code hash:
+
+    objects/{hash[:2]}/{hash[2:]}.zst: Code compressed with zstd, or .gz with
+        gzip if zstandard isn't installed.
+    cache/{hash}/main.cpp: Materialized code for the judge server. The least
+        recently used entries beyond CODE_CACHE_SIZE are evicted once they
+        are older than JUDGE_TIMEOUT, when the judge servers are done with
+        them.
+
+Challenges submitted before the store keep their code at {challenge_uid}/main.cpp
+until migrate_code.py moves them.
+
+'''
+
+
+import config
+import os
+import time
+import gzip
+import shutil
+import hashlib
+import tempfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def get_hash(code):
+    '''Get the hash of the code.
+
+    Args:
+        code (string): Code.
+
+    Returns:
+        String
+
+    '''
+
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def get_object_path(code_hash, suffix):
+    '''Get the path of the stored code.
+
+    Args:
+        code_hash (string): Code hash.
+        suffix (string): '.zst' or '.gz'.
+
+    Returns:
+        String
+
+    '''
+
+    return os.path.join(config.CODE_DIR, 'objects', code_hash[:2],
+        code_hash[2:] + suffix)
+
+
+def get_legacy_path(challenge_uid):
+    '''Get the path of the code stored before the code store.
+
+    Args:
+        challenge_uid (int): Challenge ID.
+
+    Returns:
+        String
+
+    '''
+
+    return os.path.join(config.CODE_DIR, '{}'.format(challenge_uid),
+        'main.cpp')
+
+
+def get_cache_path(code_hash):
+    '''Get the path of the materialized code.
+
+    Args:
+        code_hash (string): Code hash.
+
+    Returns:
+        String
+
+    '''
+
+    return os.path.join(config.CODE_DIR, 'cache', code_hash, 'main.cpp')
+
+
+def write_atomic(path, data):
+    '''Write the file atomically, so readers never see partial files.
+
+    Args:
+        path (string): File path.
+        data (bytes): Data.
+
+    '''
+
+    dir_path = os.path.dirname(path)
+    os.makedirs(dir_path, mode=0o755, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def put(code):
+    '''Store the code if it isn't stored.
+
+    Args:
+        code (string): Code.
+
+    Returns:
+        String | None: Code hash.
+
+    '''
+
+    code_hash = get_hash(code)
+    try:
+        for suffix in ['.zst', '.gz']:
+            if os.path.exists(get_object_path(code_hash, suffix)):
+                return code_hash
+
+        data = code.encode('utf-8')
+        if zstandard is not None:
+            write_atomic(get_object_path(code_hash, '.zst'),
+                zstandard.ZstdCompressor().compress(data))
+        else:
+            write_atomic(get_object_path(code_hash, '.gz'),
+                gzip.compress(data))
+
+        return code_hash
+    except:
+        return None
+
+
+def get(code_hash):
+    '''Load the stored code.
+
+    Args:
+        code_hash (string): Code hash.
+
+    Returns:
+        String | None
+
+    '''
+
+    try:
+        path = get_object_path(code_hash, '.zst')
+        if zstandard is not None and os.path.exists(path):
+            with open(path, 'rb') as object_file:
+                data = zstandard.ZstdDecompressor().decompress(
+                    object_file.read())
+        else:
+            with open(get_object_path(code_hash, '.gz'), 'rb') as object_file:
+                data = gzip.decompress(object_file.read())
+
+        return data.decode('utf-8')
+    except:
+        return None
+
+
+def load(challenge):
+    '''Load the code of the challenge.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        String | None
+
+    '''
+
+    if challenge.code_hash is not None:
+        return get(challenge.code_hash)
+
+    try:
+        with open(get_legacy_path(challenge.uid), 'r') as main_file:
+            return main_file.read()
+    except:
+        return None
+
+
+def get_cached(challenge):
+    '''Get the plain file of the challenge code if it exists.
+
+    The entry is marked recently used.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        String | None: File path.
+
+    '''
+
+    if challenge.code_hash is None:
+        path = get_legacy_path(challenge.uid)
+        if os.path.exists(path):
+            return path
+
+        return None
+
+    path = get_cache_path(challenge.code_hash)
+    try:
+        os.utime(os.path.dirname(path))
+    except OSError:
+        return None
+
+    if not os.path.exists(path):
+        return None
+
+    return path
+
+
+def evict(limit=None, min_age=None):
+    '''Evict the least recently used materialized code beyond the limit.
+
+    Args:
+        limit (int) optional: Entries to keep, default to
+            config.CODE_CACHE_SIZE.
+        min_age (float) optional: Seconds to keep the recently used entries,
+            default to config.JUDGE_TIMEOUT.
+
+    Returns:
+        Int: Number of the evicted entries.
+
+    '''
+
+    if limit is None:
+        limit = config.CODE_CACHE_SIZE
+
+    if min_age is None:
+        min_age = config.JUDGE_TIMEOUT
+
+    cache_dir = os.path.join(config.CODE_DIR, 'cache')
+    try:
+        entries = []
+        for name in os.listdir(cache_dir):
+            entry_path = os.path.join(cache_dir, name)
+            entries.append((os.stat(entry_path).st_mtime, entry_path))
+    except OSError:
+        return 0
+
+    if len(entries) <= limit:
+        return 0
+
+    entries.sort(reverse=True)
+    deadline = time.time() - min_age
+
+    count = 0
+    for mtime, entry_path in entries[limit:]:
+        if mtime > deadline:
+            continue
+
+        shutil.rmtree(entry_path, ignore_errors=True)
+        count += 1
+
+    return count
+
+
+def materialize(challenge):
+    '''Get the plain file of the challenge code for the judge server.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        String | None: File path.
+
+    '''
+
+    if challenge.code_hash is None:
+        return get_legacy_path(challenge.uid)
+
+    path = get_cached(challenge)
+    if path is not None:
+        return path
+
+    code = get(challenge.code_hash)
+    if code is None:
+        return None
+
+    path = get_cache_path(challenge.code_hash)
+    try:
+        write_atomic(path, code.encode('utf-8'))
+    except:
+        return None
+
+    evict()
+    return path
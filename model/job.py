@@ -0,0 +1,426 @@
+'''Judge job model module'''
+
+
+import json
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy.sql.expression import func, text, literal
+from model.problem import ProblemModel
+from model.challenge import ChallengeModel, JudgeState
+from . import BaseModel, Relation, model_context, select
+
+
+# Channel to notify the dispatchers of new jobs.
+NOTIFY_CHANNEL = 'judge_job'
+
+# Default priority, higher priorities are claimed first.
+DEFAULT_PRIORITY = 0
+
+# Priority of the rejudge jobs, lower than the submissions.
+REJUDGE_PRIORITY = -1
+
+
+class RejudgeModel(BaseModel):
+    '''Rejudge model.
+
+    The jobs of a rejudge refer to it, so the progress is the number of its
+    remaining jobs. A selective rejudge only judges the subtasks whose test
+    signatures changed.
+
+    '''
+
+    __tablename__ = 'rejudge'
+
+    uid = Column('uid', Integer, primary_key=True)
+    timestamp = Column('timestamp', DateTime(timezone=True))
+    total = Column('total', Integer)
+    selective = Column('selective', Boolean)
+    _problem = Relation(ProblemModel, back_populates="rejudges")
+
+    @model_context
+    async def get_remaining(self, ctx):
+        '''Get the number of remaining jobs.
+
+        Returns:
+            Int | None
+
+        '''
+
+        try:
+            return await (await select([func.count()], int)
+                .select_from(JudgeJobModel)
+                .where(JudgeJobModel.rejudge == self.uid)
+                .execute(ctx.conn)).scalar() or 0
+        except:
+            return None
+
+
+class JudgeJobModel(BaseModel):
+    '''Judge job model.
+
+    A job is available if it has no lease or its lease is expired, so the jobs
+    of dead workers are claimed again.
+
+    '''
+
+    __tablename__ = 'judge_job'
+
+    uid = Column('uid', Integer, primary_key=True)
+    priority = Column('priority', Integer, index=True)
+    code_path = Column('code_path', String)
+    timestamp = Column('timestamp', DateTime(timezone=True))
+    lease = Column('lease', DateTime(timezone=True), index=True)
+    worker = Column('worker', String)
+    attempts = Column('attempts', Integer)
+    fingerprint = Column('fingerprint', String)
+    rejudge = Column('rejudge', Integer,
+        ForeignKey(RejudgeModel.uid, onupdate="CASCADE", ondelete="CASCADE"),
+        index=True)
+    _challenge = Relation(ChallengeModel, back_populates="jobs")
+
+
+async def push_job(challenge, code_path, priority=DEFAULT_PRIORITY,
+    fingerprint=None, conn=None):
+    '''Push a judge job with the connection.
+
+    A pending job of the same challenge is replaced.
+
+    Returns:
+        JudgeJobModel
+
+    '''
+
+    challenge_key = JudgeJobModel._relations['challenge'].rkey
+
+    async with conn.begin() as transaction:
+        await (JudgeJobModel.delete()
+            .where(challenge_key == challenge.uid)
+            .execute(conn))
+
+        job = JudgeJobModel(priority=priority, code_path=code_path,
+            timestamp=datetime.now(tz=timezone.utc), lease=None, worker=None,
+            attempts=0, fingerprint=fingerprint, rejudge=None,
+            challenge=challenge)
+        await job.save(conn)
+
+        await conn.execute(text('NOTIFY {}'.format(NOTIFY_CHANNEL)))
+
+    return job
+
+
+@model_context
+async def push(challenge, code_path, priority=DEFAULT_PRIORITY,
+    fingerprint=None, ctx=None):
+    '''Push a judge job.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+        code_path (string | None): File path of the code, None to get it when
+            the job is claimed.
+        priority (int): Priority.
+        fingerprint (string) optional: Fingerprint to cache the verdicts.
+
+    Returns:
+        JudgeJobModel | None
+
+    '''
+
+    try:
+        return await push_job(challenge, code_path, priority, fingerprint,
+            conn=ctx.conn)
+    except:
+        return None
+
+
+@model_context
+async def rejudge(problem, selective=False, ctx=None):
+    '''Queue the done challenges of the problem to be rejudged.
+
+    The jobs are inserted with one INSERT ... SELECT. Each challenge is reset
+    when its job is claimed, so the old results are kept until then.
+
+    Args:
+        problem (ProblemModel): Problem.
+        selective (bool): Only judge the changed subtasks.
+
+    Returns:
+        RejudgeModel | None
+
+    '''
+
+    challenge_key = JudgeJobModel._relations['challenge'].rkey
+
+    try:
+        async with ctx.conn.begin() as transaction:
+            rejudge = RejudgeModel(timestamp=datetime.now(tz=timezone.utc),
+                total=0, selective=selective, problem=problem)
+            await rejudge.save(ctx.conn)
+
+            done_tbl = (select([ChallengeModel.uid])
+                .select_from(ChallengeModel.join(ProblemModel))
+                .where(ProblemModel.uid == problem.uid)
+                .where(ChallengeModel.state == JudgeState.done))
+
+            await (JudgeJobModel.delete()
+                .where(challenge_key.in_(done_tbl.expr))
+                .execute(ctx.conn))
+
+            challenge_query = (select([
+                    literal(REJUDGE_PRIORITY),
+                    func.now(),
+                    literal(0),
+                    literal(rejudge.uid),
+                    ChallengeModel.uid
+                ])
+                .select_from(ChallengeModel.join(ProblemModel))
+                .where(ProblemModel.uid == problem.uid)
+                .where(ChallengeModel.state == JudgeState.done)
+                .order_by(ChallengeModel.uid))
+
+            rejudge.total = (await (JudgeJobModel.insert()
+                .from_select(['priority', 'timestamp', 'attempts', 'rejudge',
+                    challenge_key.name],
+                    challenge_query)
+                .execute(ctx.conn)).rowcount)
+            await rejudge.save(ctx.conn)
+
+            await ctx.conn.execute(text('NOTIFY {}'.format(NOTIFY_CHANNEL)))
+
+        return rejudge
+    except:
+        return None
+
+
+@model_context
+async def get_rejudge(uid, ctx=None):
+    '''Get the rejudge by rejudge ID.
+
+    Args:
+        uid (int): Rejudge ID.
+
+    Returns:
+        RejudgeModel | None
+
+    '''
+
+    try:
+        return await (await RejudgeModel.select()
+            .where(RejudgeModel.uid == uid)
+            .execute(ctx.conn)).first()
+    except:
+        return None
+
+
+async def claim(worker, lease_time, rejudge_limit=None, conn=None):
+    '''Claim an available job.
+
+    Rejudge jobs aren't claimed once the number of running rejudge jobs
+    reaches the limit. The limit is checked without locks, so concurrent
+    dispatchers may exceed it by one each.
+
+    Args:
+        worker (string): Worker name.
+        lease_time (float): Lease time in seconds.
+        rejudge_limit (int) optional: Maximum running rejudge jobs.
+
+    Returns:
+        JudgeJobModel | None
+
+    '''
+
+    now = datetime.now(tz=timezone.utc)
+
+    async with conn.begin() as transaction:
+        query = (JudgeJobModel.select()
+            .where((JudgeJobModel.lease == None) |
+                (JudgeJobModel.lease < now)))
+
+        if rejudge_limit is not None:
+            running = await (await select([func.count()], int)
+                .select_from(JudgeJobModel)
+                .where(JudgeJobModel.rejudge != None)
+                .where(JudgeJobModel.lease >= now)
+                .execute(conn)).scalar()
+            if running >= rejudge_limit:
+                query = query.where(JudgeJobModel.rejudge == None)
+
+        job = await (await query
+            .order_by(JudgeJobModel.priority.desc(), JudgeJobModel.uid)
+            .limit(1)
+            .with_for_update(skip_locked=True, of=JudgeJobModel)
+            .execute(conn)).first()
+        if job is None:
+            return None
+
+        job.lease = now + timedelta(seconds=lease_time)
+        job.worker = worker
+        job.attempts += 1
+        await job.save(conn)
+
+    return job
+
+
+async def renew(job, lease_time, conn=None):
+    '''Renew the lease of the claimed job.
+
+    Args:
+        job (JudgeJobModel): Job.
+        lease_time (float): Lease time in seconds.
+
+    Returns:
+        True | False: The job is still owned or not.
+
+    '''
+
+    async with conn.begin() as transaction:
+        owned = await (await JudgeJobModel.select()
+            .where(JudgeJobModel.uid == job.uid)
+            .where(JudgeJobModel.worker == job.worker)
+            .with_for_update(of=JudgeJobModel)
+            .execute(conn)).first()
+        if owned is None:
+            return False
+
+        job.lease = datetime.now(tz=timezone.utc) + timedelta(
+            seconds=lease_time)
+        await job.save(conn)
+
+    return True
+
+
+async def finish(job, conn=None):
+    '''Remove the finished job.
+
+    The job may be claimed by another worker after the lease is expired, then
+    it's kept for that worker.
+
+    Args:
+        job (JudgeJobModel): Job.
+
+    Returns:
+        True | False
+
+    '''
+
+    result = (await JudgeJobModel.delete()
+        .where(JudgeJobModel.uid == job.uid)
+        .where(JudgeJobModel.worker == job.worker)
+        .execute(conn)).rowcount
+
+    return result > 0
+
+
+async def recover(code_path_of=None, conn=None):
+    '''Push the jobs of unfinished challenges which have no job.
+
+    Challenges are emitted in the web process before the queue existed, so
+    they are lost with the process.
+
+    Args:
+        code_path_of (function) optional: Get the code path of the challenge,
+            None to get it when the job is claimed.
+
+    Returns:
+        Int: Number of recovered challenges.
+
+    '''
+
+    queued = set()
+    async for job in await JudgeJobModel.select().execute(conn):
+        queued.add(job.challenge.uid)
+
+    query = (ChallengeModel.select()
+        .where(ChallengeModel.state != JudgeState.done)
+        .order_by(ChallengeModel.uid))
+
+    challenges = []
+    async for challenge in await query.execute(conn):
+        if challenge.uid not in queued:
+            challenges.append(challenge)
+
+    for challenge in challenges:
+        code_path = None
+        if code_path_of is not None:
+            code_path = code_path_of(challenge)
+
+        await push_job(challenge, code_path, conn=conn)
+
+    return len(challenges)
+
+
+@model_context
+async def get(uid, ctx=None):
+    '''Get the judge job by job ID.
+
+    Args:
+        uid (int): Job ID.
+
+    Returns:
+        JudgeJobModel | None
+
+    '''
+
+    try:
+        return await (await JudgeJobModel.select()
+            .where(JudgeJobModel.uid == uid)
+            .execute(ctx.conn)).first()
+    except:
+        return None
+
+
+@model_context
+async def remove(uid, ctx=None):
+    '''Remove the judge job whichever worker owns it.
+
+    Args:
+        uid (int): Job ID.
+
+    Returns:
+        True | False
+
+    '''
+
+    try:
+        result = (await JudgeJobModel.delete()
+            .where(JudgeJobModel.uid == uid)
+            .execute(ctx.conn)).rowcount
+        return result > 0
+    except:
+        return False
+
+
+@model_context
+async def get_count(ctx=None):
+    '''Get the number of queued jobs.
+
+    Returns:
+        Int | None
+
+    '''
+
+    try:
+        return (await JudgeJobModel.select().execute(ctx.conn)).rowcount
+    except:
+        return None
+
+
+@model_context
+async def get_dispatchers(ctx=None):
+    '''Get the published status of the running dispatchers.
+
+    Returns:
+        [Object] | None
+
+    '''
+
+    try:
+        dispatchers = []
+        for key in sorted(ctx.redis.scan_iter('JUDGESTATUS@*')):
+            status = ctx.redis.get(key)
+            if status is not None:
+                dispatchers.append(json.loads(status.decode('utf-8')))
+
+        return dispatchers
+    except:
+        return None
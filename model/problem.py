@@ -1,10 +1,11 @@
 '''Problem model module'''
 
 
+import model.user
 import model.scoring
-from sqlalchemy import Table, Column, Integer, String
+from sqlalchemy import Table, Column, Integer, String, bindparam
 from sqlalchemy.dialects.postgresql import JSONB
-from . import BaseModel, model_context
+from . import BaseModel, model_context, cached_query
 
 
 class ProblemModel(BaseModel):
@@ -29,13 +30,18 @@ class ProblemModel(BaseModel):
         try:
             problem_uid = self.uid
 
+            # The submitters can't be found after the challenges are gone.
+            user_uids = await model.scoring.get_submitter_uids(problem_uid)
+
             result = (await ProblemModel.delete()
                 .where(ProblemModel.uid == problem_uid)
                 .execute(ctx.conn)).rowcount
             if result == 0:
                 return False
 
-            await model.scoring.change_problem(problem_uid, True)
+            # The problem is gone from all problem sets.
+            await model.scoring.change_problem(problem_uid, user_uids=user_uids,
+                removed=True)
 
             return True
         except:
@@ -67,6 +73,7 @@ async def create(uid, revision, metadata, ctx):
             tests.append({
                 'weight': int(test['weight']),
                 'data': [int(dataidx) for dataidx in test['data']],
+                'signature': test.get('signature'),
             })
         metadata['test'] = tests
 
@@ -94,10 +101,11 @@ async def get(uid, ctx):
 
     '''
 
+    query = cached_query('problem.get', lambda: ProblemModel.select()
+        .where(ProblemModel.uid == bindparam('uid')))
+
     try:
-        return await (await ProblemModel.select()
-            .where(ProblemModel.uid == uid)
-            .execute(ctx.conn)).first()
+        return await (await query.execute(ctx.conn, uid=uid)).first()
     except:
         return None
 
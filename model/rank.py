@@ -0,0 +1,600 @@
+'''Rank model module
+
+Leaderboards are cached in Redis per problem set:
+
+    RANK@{category}:{proset_uid}: ZSET of user IDs scored by encode_rate.
+    RANKUSER@{category}:{proset_uid}: HASH of user ID to user name.
+    RANKRESULT@{category}:{proset_uid}: HASH of '{user_uid}:{problem_uid}' to
+        the best result.
+    RANKSET@{category}: SET of the cached problem set IDs of the category.
+
+A problem set is cached only if it's a member of RANKSET@{category}. A miss
+builds the cache, and falls back to PostgreSQL if it fails. When the user
+scores are updated, the scoring module writes only the affected users into
+the cached problem sets, and rebuilds them after the full updates.
+
+'''
+
+
+import model.scoring
+import model.challenge
+from sqlalchemy import Integer, func
+from model.user import UserModel, UserCategory
+from model.problem import ProblemModel
+from model.proset import ProSetModel, ProItemModel
+from . import model_context, select, ShadowExpr
+
+
+# Scale of the rates in ZSET scores. Rates and user IDs must be less than it.
+RANK_SCALE = 2**26
+
+
+def encode_rate(rate, user_uid):
+    '''Encode the rate to the ZSET score.
+
+    Higher rates go first, then lower user IDs.
+
+    Args:
+        rate (int): Rate.
+        user_uid (int): User ID.
+
+    Returns:
+        int
+
+    '''
+
+    return rate * RANK_SCALE - user_uid
+
+
+def decode_rate(score, user_uid):
+    '''Decode the rate from the ZSET score.
+
+    Args:
+        score (float): ZSET score.
+        user_uid (int): User ID.
+
+    Returns:
+        int
+
+    '''
+
+    return (int(score) + user_uid) // RANK_SCALE
+
+
+def get_cache_keys(proset_uid, category):
+    '''Get the cache keys of the problem set.
+
+    Args:
+        proset_uid (int): Problem set ID.
+        category (UserCategory): Category of the problem set.
+
+    Returns:
+        (rank key (str), user key (str), result key (str))
+
+    '''
+
+    suffix = '{}:{}'.format(int(category), proset_uid)
+    return ('RANK@' + suffix, 'RANKUSER@' + suffix, 'RANKRESULT@' + suffix)
+
+
+def build_user(uid, name, category):
+    '''Build a partial user for the ranker profile.
+
+    Args:
+        uid (int): User ID.
+        name (str): User name.
+        category (UserCategory): User category.
+
+    Returns:
+        UserModel
+
+    '''
+
+    return UserModel(uid=uid, level=None, mail=None, password=None, name=name,
+        category=category, metadata=None)
+
+
+def build_rank_query(proset_uid, category):
+    '''Build the query of rankers ordered by rate.
+
+    Args:
+        proset_uid (int): Problem set ID.
+        category (UserCategory): Category of the problem set.
+
+    Returns:
+        ShadowExpr
+
+    '''
+
+    UserScoreModel = model.scoring.UserScoreModel
+
+    rate = func.coalesce(UserScoreModel.score, 0)
+    order = [rate.desc(), UserModel.uid]
+
+    query = (UserModel.select()
+        .column(rate.label('rate'))
+        .column(func.row_number().over(order_by=order).label('position'))
+        .column(func.count().over().label('count'))
+        .select_from(UserModel.join(UserScoreModel,
+            (UserScoreModel.user_uid == UserModel.uid) &
+            (UserScoreModel.proset_uid == proset_uid),
+            isouter=True))
+        .where(UserModel.category == category)
+        .order_by(*order))
+
+    # Rows are not users only.
+    return ShadowExpr(query.expr)
+
+
+async def build_cache(proset_uid, category, conn=None, rsconn=None):
+    '''Build the cached leaderboard of the problem set.
+
+    Args:
+        proset_uid (int): Problem set ID.
+        category (UserCategory): Category of the problem set.
+
+    '''
+
+    rankers = []
+    async for result in await build_rank_query(proset_uid,
+        category).execute(conn):
+        rankers.append((result.uid, result.name, result.rate))
+
+    query = (select([ProblemModel.uid])
+        .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+        .where(ProSetModel.uid == proset_uid)
+        .distinct(ProblemModel.uid))
+
+    problem_uids = []
+    async for result in await query.execute(conn):
+        problem_uids.append(result.uid)
+
+    result_map = await model.challenge.query_stat_result(
+        [uid for uid, _, _ in rankers], problem_uids, conn=conn)
+
+    rank_key, user_key, result_key = get_cache_keys(proset_uid, category)
+
+    pipe = rsconn.pipeline()
+    pipe.delete(rank_key, user_key, result_key)
+
+    if len(rankers) > 0:
+        args = []
+        for uid, _, rate in rankers:
+            args.extend([encode_rate(rate, uid), uid])
+
+        pipe.zadd(rank_key, *args)
+        pipe.hmset(user_key, dict((uid, name) for uid, name, _ in rankers))
+
+    if len(result_map) > 0:
+        pipe.hmset(result_key, dict(('{}:{}'.format(*key), result)
+            for key, result in result_map.items()))
+
+    pipe.sadd('RANKSET@{}'.format(int(category)), proset_uid)
+    pipe.execute()
+
+
+def drop_cache(proset_uids, category, rsconn=None):
+    '''Drop the cached leaderboards.
+
+    Args:
+        proset_uids ([int]): Problem set IDs.
+        category (UserCategory): Category of the problem sets.
+
+    '''
+
+    if len(proset_uids) == 0:
+        return
+
+    pipe = rsconn.pipeline()
+    pipe.srem('RANKSET@{}'.format(int(category)), *proset_uids)
+    for proset_uid in proset_uids:
+        pipe.delete(*get_cache_keys(proset_uid, category))
+
+    pipe.execute()
+
+
+async def refresh_cache(category, conn=None, rsconn=None):
+    '''Rebuild the cached leaderboards of the category.
+
+    Args:
+        category (UserCategory): Category.
+
+    '''
+
+    cached = set(int(uid) for uid
+        in rsconn.smembers('RANKSET@{}'.format(int(category))))
+    if len(cached) == 0:
+        return
+
+    query = (select([ProSetModel.uid])
+        .where(ProSetModel.uid.in_(cached))
+        .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+            int(category)))
+
+    valid = set()
+    async for result in await query.execute(conn):
+        valid.add(result.uid)
+
+    # Drop the problem sets which are removed or moved to other categories.
+    drop_cache(sorted(cached - valid), category, rsconn=rsconn)
+
+    for proset_uid in sorted(valid):
+        await build_cache(proset_uid, category, conn=conn, rsconn=rsconn)
+
+
+async def update_cache(category, spec_problem_uids=None, spec_user_uids=None,
+    conn=None, rsconn=None):
+    '''Write the affected users into the cached leaderboards.
+
+    The users are the same as model.scoring.update_user_score, and their new
+    rates and best results are read after the user scores are updated.
+
+    Args:
+        category (UserCategory): Category.
+        spec_problem_uids ([int]) optional: Update the users who submitted
+            the specific problem IDs.
+        spec_user_uids ([int]) optional: Update the specific user IDs.
+
+    '''
+
+    cached = set(int(uid) for uid
+        in rsconn.smembers('RANKSET@{}'.format(int(category))))
+    if len(cached) == 0:
+        return
+
+    query = (select([ProSetModel.uid])
+        .where(ProSetModel.uid.in_(cached))
+        .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+            int(category)))
+
+    # The problem sets moved to other categories are dropped by the next
+    # refresh.
+    problem_map = {}
+    async for result in await query.execute(conn):
+        problem_map[result.uid] = []
+
+    if len(problem_map) == 0:
+        return
+
+    user_tbl = model.scoring.build_user_query(category, spec_problem_uids,
+        spec_user_uids)
+
+    names = {}
+    async for result in await (select([UserModel.uid, UserModel.name])
+        .where(UserModel.uid.in_(user_tbl.expr))
+        .execute(conn)):
+        names[result.uid] = result.name
+
+    if len(names) == 0:
+        return
+
+    user_uids = sorted(names.keys())
+
+    async for result in await (select([
+            ProSetModel.uid.label('proset_uid'),
+            ProblemModel.uid.label('problem_uid')
+        ])
+        .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+        .where(ProSetModel.uid.in_(list(problem_map.keys())))
+        .distinct(ProSetModel.uid, ProblemModel.uid)
+        .execute(conn)):
+        problem_map[result.proset_uid].append(result.problem_uid)
+
+    UserScoreModel = model.scoring.UserScoreModel
+
+    rate_map = {}
+    async for user_score in await (UserScoreModel.select()
+        .where(UserScoreModel.user_uid.in_(user_uids))
+        .where(UserScoreModel.proset_uid.in_(list(problem_map.keys())))
+        .execute(conn)):
+        key = (user_score.user_uid, user_score.proset_uid)
+        rate_map[key] = user_score.score
+
+    result_map = await model.challenge.query_stat_result(user_uids,
+        sorted(set(problem_uid for problem_uids in problem_map.values()
+            for problem_uid in problem_uids)), conn=conn)
+
+    pipe = rsconn.pipeline()
+    for proset_uid, problem_uids in sorted(problem_map.items()):
+        rank_key, user_key, result_key = get_cache_keys(proset_uid, category)
+
+        args = []
+        for uid in user_uids:
+            args.extend([encode_rate(rate_map.get((uid, proset_uid), 0),
+                uid), uid])
+
+        pipe.zadd(rank_key, *args)
+        pipe.hmset(user_key, names)
+
+        # The best results may be gone with the removed challenges.
+        fields = ['{}:{}'.format(uid, problem_uid) for uid in user_uids
+            for problem_uid in problem_uids]
+        if len(fields) > 0:
+            pipe.hdel(result_key, *fields)
+
+        results = dict(('{}:{}'.format(uid, problem_uid), result)
+            for (uid, problem_uid), result in result_map.items()
+            if problem_uid in problem_uids)
+        if len(results) > 0:
+            pipe.hmset(result_key, results)
+
+    pipe.execute()
+
+
+async def update_cache_result(category, user_uid, problem_uid, result,
+    conn=None, rsconn=None):
+    '''Update the cached best result of a new done challenge.
+
+    Args:
+        category (UserCategory): Category of the user.
+        user_uid (int): User ID.
+        problem_uid (int): Problem ID.
+        result (int): Result of the challenge.
+
+    '''
+
+    cached = set(int(uid) for uid
+        in rsconn.smembers('RANKSET@{}'.format(int(category))))
+    if len(cached) == 0:
+        return
+
+    query = (select([ProSetModel.uid])
+        .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+        .where(ProSetModel.uid.in_(cached))
+        .where(ProblemModel.uid == problem_uid)
+        .distinct(ProSetModel.uid))
+
+    field = '{}:{}'.format(user_uid, problem_uid)
+    async for proset in await query.execute(conn):
+        _, _, result_key = get_cache_keys(proset.uid, category)
+        old_result = rsconn.hget(result_key, field)
+        # Keep the best result like query_stat_result.
+        if old_result is None or result < int(old_result):
+            rsconn.hset(result_key, field, result)
+
+
+@model_context
+async def invalidate(category, ctx=None):
+    '''Drop the cached leaderboards of the category.
+
+    Args:
+        category (UserCategory): Category.
+
+    '''
+
+    cached = [int(uid) for uid
+        in ctx.redis.smembers('RANKSET@{}'.format(int(category)))]
+    drop_cache(cached, category, rsconn=ctx.redis)
+
+
+def load_cache_list(proset_uid, category, problem_uids, offset=0, limit=None,
+    rsconn=None):
+    '''Load the rankers from the cached leaderboard.
+
+    Returns:
+        Same as get_list | None if it's not cached.
+
+    '''
+
+    rank_key, user_key, result_key = get_cache_keys(proset_uid, category)
+
+    pipe = rsconn.pipeline()
+    pipe.sismember('RANKSET@{}'.format(int(category)), proset_uid)
+    pipe.zcard(rank_key)
+    if limit is None:
+        pipe.zrevrange(rank_key, offset, -1, withscores=True)
+    elif limit > 0:
+        pipe.zrevrange(rank_key, offset, offset + limit - 1, withscores=True)
+
+    results = pipe.execute()
+    if not results[0]:
+        return None
+
+    count = results[1]
+    members = []
+    if len(results) > 2:
+        members = [(int(uid), score) for uid, score in results[2]]
+
+    if len(members) == 0:
+        return { 'count': count, 'data': [] }
+
+    fields = ['{}:{}'.format(uid, problem_uid) for uid, _ in members
+        for problem_uid in problem_uids]
+
+    pipe = rsconn.pipeline()
+    pipe.hmget(user_key, [uid for uid, _ in members])
+    if len(fields) > 0:
+        pipe.hmget(result_key, fields)
+
+    results = pipe.execute()
+    names = results[0]
+    values = []
+    if len(fields) > 0:
+        values = results[1]
+
+    # Dropped in the middle.
+    if None in names:
+        return None
+
+    rankers = []
+    for idx, (uid, score) in enumerate(members):
+        rankers.append({
+            'user': build_user(uid, names[idx].decode('utf-8'), category),
+            'rate': decode_rate(score, uid),
+            'position': offset + idx + 1,
+            'results': {},
+        })
+
+    ranker_map = dict((ranker['user'].uid, ranker) for ranker in rankers)
+    for field, value in zip(fields, values):
+        if value is None:
+            continue
+
+        user_uid, problem_uid = (int(key) for key in field.split(':'))
+        ranker_map[user_uid]['results'][problem_uid] = int(value)
+
+    return { 'count': count, 'data': rankers }
+
+
+async def query_list(proset_uid, category, problem_uids, offset=0, limit=None,
+    conn=None):
+    '''List the rankers from PostgreSQL.
+
+    Returns:
+        Same as get_list.
+
+    '''
+
+    query = build_rank_query(proset_uid, category).offset(offset)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    count = 0
+    rankers = []
+    async for result in await query.execute(conn):
+        count = result.count
+        rankers.append({
+            'user': UserModel(result),
+            'rate': result.rate,
+            'position': result.position,
+            'results': {},
+        })
+
+    result_map = await model.challenge.query_stat_result(
+        [ranker['user'].uid for ranker in rankers], problem_uids, conn=conn)
+
+    ranker_map = dict((ranker['user'].uid, ranker) for ranker in rankers)
+    for key, result in result_map.items():
+        user_uid, problem_uid = key
+        ranker_map[user_uid]['results'][problem_uid] = result
+
+    return { 'count': count, 'data': rankers }
+
+
+@model_context
+async def get_list(proset, problem_uids, offset=0, limit=None, ctx=None):
+    '''List the rankers of the problem set.
+
+    Args:
+        proset (ProSetModel): Problem set.
+        problem_uids ([int]): Included problem IDs.
+        offset (int): The offset.
+        limit (int): The size limit.
+
+    Returns:
+        {
+            'count' (int),
+            'data' ([{
+                'user' (UserModel),
+                'rate' (int),
+                'position' (int),
+                'results' ({ problem_uid (int): result (int), ... }),
+            }]),
+        } | None
+
+    '''
+
+    category = UserCategory(proset.metadata['category'])
+
+    try:
+        partial_list = load_cache_list(proset.uid, category, problem_uids,
+            offset, limit, rsconn=ctx.redis)
+        if partial_list is None:
+            await build_cache(proset.uid, category, conn=ctx.conn,
+                rsconn=ctx.redis)
+            partial_list = load_cache_list(proset.uid, category,
+                problem_uids, offset, limit, rsconn=ctx.redis)
+
+        if partial_list is not None:
+            return partial_list
+    except:
+        pass
+
+    try:
+        return await query_list(proset.uid, category, problem_uids, offset,
+            limit, conn=ctx.conn)
+    except:
+        return None
+
+
+def load_cache_position(proset_uid, category, user_uid, rsconn=None):
+    '''Load the position from the cached leaderboard.
+
+    Returns:
+        Same as get_position | False if it's not cached.
+
+    '''
+
+    rank_key, _, _ = get_cache_keys(proset_uid, category)
+
+    pipe = rsconn.pipeline()
+    pipe.sismember('RANKSET@{}'.format(int(category)), proset_uid)
+    pipe.zrevrank(rank_key, user_uid)
+    pipe.zscore(rank_key, user_uid)
+    pipe.zcard(rank_key)
+    cached, rank, score, count = pipe.execute()
+
+    if not cached:
+        return False
+
+    if rank is None:
+        return None
+
+    return {
+        'rate': decode_rate(score, user_uid),
+        'position': rank + 1,
+        'count': count,
+    }
+
+
+@model_context
+async def get_position(proset, user, ctx=None):
+    '''Get the position of the user in the problem set.
+
+    Args:
+        proset (ProSetModel): Problem set.
+        user (UserModel): User.
+
+    Returns:
+        { 'rate' (int), 'position' (int), 'count' (int) } | None
+
+    '''
+
+    category = UserCategory(proset.metadata['category'])
+
+    try:
+        position = load_cache_position(proset.uid, category, user.uid,
+            rsconn=ctx.redis)
+        if position is False:
+            await build_cache(proset.uid, category, conn=ctx.conn,
+                rsconn=ctx.redis)
+            position = load_cache_position(proset.uid, category, user.uid,
+                rsconn=ctx.redis)
+
+        if position is not False:
+            return position
+    except:
+        pass
+
+    rank_tbl = build_rank_query(proset.uid, category).alias()
+
+    query = (select([
+            rank_tbl.expr.c.rate,
+            rank_tbl.expr.c.position,
+            rank_tbl.expr.c.count
+        ])
+        .where(rank_tbl.expr.c.uid == user.uid))
+
+    try:
+        result = await (await query.execute(ctx.conn)).first()
+        if result is None:
+            return None
+
+        return {
+            'rate': result.rate,
+            'position': result.position,
+            'count': result.count,
+        }
+    except:
+        return None
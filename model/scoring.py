@@ -1,17 +1,21 @@
 '''Scoring model module'''
 
 
-import math
 import asyncio
+import logging
+import collections
 import aiopg.sa
+import redis
 import config
+import model.rank
 import sqlalchemy as sa
 from model.user import UserModel, UserCategory
 from model.problem import ProblemModel
 from model.proset import ProSetModel, ProItemModel
 from model.challenge import ChallengeModel, SubtaskModel
 from model.challenge import JudgeState, JudgeResult
-from sqlalchemy import ForeignKey, Column, Integer, Enum, func, distinct
+from sqlalchemy import ForeignKey, Column, Integer, Float, Enum, func
+from sqlalchemy import distinct
 from . import BaseModel, model_context, select
 
 
@@ -60,13 +64,86 @@ class RateScoreModel(BaseModel):
     __primarykey__ = [category, user_uid, problem_uid, index]
 
 
+# Problem set ID of the global user scores.
+GLOBAL_PROSET_UID = 0
+
+
+class UserScoreModel(BaseModel):
+    '''User score model.
+
+    Scores of each user in each problem set of the user's category, and the
+    global score with GLOBAL_PROSET_UID.
+
+    '''
+
+    __tablename__ = 'user_score'
+
+    user_uid = Column('user_uid', Integer,
+        ForeignKey(UserModel.uid, onupdate='CASCADE', ondelete='CASCADE'))
+    proset_uid = Column('proset_uid', Integer, index=True)
+    score = Column('score', Integer)
+
+    __primarykey__ = [user_uid, proset_uid]
+
+
+async def update_test_weight(problem_uid, conn=None):
+    '''Sync test weights of the problem.
+
+    Args:
+        problem_uid (int): Problem ID.
+
+    Returns:
+        True | False: Changed or not.
+
+    '''
+
+    query = (select([
+            ProblemModel.metadata['test'].label('test'),
+            ProblemModel.metadata['score'].label('score')
+        ])
+        .where(ProblemModel.uid == problem_uid))
+
+    async with conn.begin() as transcation:
+        test_weights = []
+        problem = await (await query.execute(conn)).first()
+        if problem is not None:
+            for index, test in enumerate(problem.test):
+                weight = test['weight']
+                test_weights.append(TestWeightModel(problem_uid=problem_uid,
+                    index=index, weight=weight,
+                    score=int(problem.score * float(weight) / 100.0)))
+
+        query = (TestWeightModel.select()
+            .where(TestWeightModel.problem_uid == problem_uid)
+            .order_by(TestWeightModel.index))
+
+        old_weights = []
+        async for test_weight in await query.execute(conn):
+            old_weights.append((test_weight.index, test_weight.weight,
+                test_weight.score))
+
+        new_weights = [(test_weight.index, test_weight.weight,
+            test_weight.score) for test_weight in test_weights]
+        if old_weights == new_weights:
+            return False
+
+        await (TestWeightModel.delete()
+            .where(TestWeightModel.problem_uid == problem_uid)
+            .execute(conn))
+        await TestWeightModel.save_all(test_weights, conn)
+
+        return True
+
+
 async def update_rate_count(category, spec_problem_uid=None,
-    problem_updated=False, conn=None):
+    spec_indices=None, conn=None):
     '''Update rate count.
 
     Args:
         category (UserCategory): Category.
         spec_problem_uid (int) optional: Only update the specific problem ID.
+        spec_indices ([int]) optional: Only update the specific subtask
+            indices. Must be used with spec_problem_uid.
 
     '''
 
@@ -93,15 +170,26 @@ async def update_rate_count(category, spec_problem_uid=None,
         .where(ChallengeModel.state == JudgeState.done)
         .where(ChallengeModel.timestamp <= base_tbl.expr.c.deadline)
         .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
-            int(JudgeResult.STATUS_AC))
+            int(JudgeResult.STATUS_AC)))
+
+    if spec_indices is not None:
+        count_tbl = count_tbl.where(SubtaskModel.index.in_(spec_indices))
+
+    count_tbl = (count_tbl
         .distinct(UserModel.uid, base_tbl.expr.c.uid, SubtaskModel.index)
         .alias())
 
+    # score * 2^(28 / (count + 13))
+    rate = func.power(2.0, 28.0 / (sa.cast(func.count(), Float) + 13.0),
+        type_=Float)
+
     count_query = (select([
-            count_tbl.expr.c.uid.label('problem_uid'),
+            sa.cast(sa.literal(category, RateCountModel.category.type),
+                RateCountModel.category.type),
+            count_tbl.expr.c.uid,
             count_tbl.expr.c.index,
-            func.count().label('count'),
-            TestWeightModel.score
+            func.count(),
+            sa.cast(TestWeightModel.score * rate, Integer)
         ])
         .select_from(count_tbl.join(TestWeightModel,
             (count_tbl.expr.c.uid == TestWeightModel.problem_uid) &
@@ -110,24 +198,6 @@ async def update_rate_count(category, spec_problem_uid=None,
             TestWeightModel.score))
 
     async with conn.begin() as transcation:
-        # Update all tests, weights and scores.
-        if problem_updated:
-            await TestWeightModel.delete().execute(conn)
-
-            query = select([
-                    ProblemModel.uid,
-                    ProblemModel.metadata['test'].label('test'),
-                    ProblemModel.metadata['score'].label('score')
-                ])
-
-            async for problem in await query.execute(conn):
-                for index, test in enumerate(problem.test):
-                    weight = test['weight']
-                    test_weight = TestWeightModel(problem_uid=problem.uid,
-                        index=index, weight=weight,
-                        score=int(problem.score * float(weight) / 100.0))
-                    await test_weight.save(conn)
-
         # Remove old data.
         query = (RateCountModel.delete()
             .where(RateCountModel.category == category))
@@ -135,31 +205,27 @@ async def update_rate_count(category, spec_problem_uid=None,
         if spec_problem_uid is not None:
             query = query.where(RateCountModel.problem_uid == spec_problem_uid)
 
+        if spec_indices is not None:
+            query = query.where(RateCountModel.index.in_(spec_indices))
+
         await query.execute(conn)
 
         # Store accepted count.
-        async for result in await count_query.execute(conn):
-            problem_uid = result.problem_uid
-            index = result.index
-            count = result.count
-            score = result.score
-
-            assert count > 0
-
-            score = score * (2**(28.0 / (count + 13.0)))
-
-            rate_count = RateCountModel(category=category,
-                problem_uid=problem_uid, index=index, count=count, score=score)
+        await (RateCountModel.insert()
+            .from_select(['category', 'problem_uid', 'index', 'count',
+                'score'], count_query)
+            .execute(conn))
 
-            await rate_count.save(conn)
 
-
-async def update_rate_score(category, spec_problem_uid=None, conn=None):
+async def update_rate_score(category, spec_problem_uid=None,
+    spec_indices=None, conn=None):
     '''Update rate score.
 
     Args:
         category (UserCategory): Category.
         spec_problem_uid (int) optional: Only update the specific problem ID.
+        spec_indices ([int]) optional: Only update the specific subtask
+            indices. Must be used with spec_problem_uid.
 
     '''
 
@@ -186,23 +252,47 @@ async def update_rate_score(category, spec_problem_uid=None, conn=None):
     if spec_problem_uid is not None:
         base_tbl = base_tbl.where(ProblemModel.uid == spec_problem_uid)
 
+    if spec_indices is not None:
+        base_tbl = base_tbl.where(SubtaskModel.index.in_(spec_indices))
+
     base_tbl = (base_tbl.group_by(UserModel.uid, ProblemModel.uid,
         SubtaskModel.index)
         .alias())
 
-    score_query = (select([
-            base_tbl.expr,
-            TestWeightModel.score.label('max_score'),
-            RateCountModel.score
+    # Use 4 times of the full score if nobody accepted before the deadline.
+    score = func.coalesce(RateCountModel.score, TestWeightModel.score * 4)
+
+    # Lose 15% per late day.
+    delta = sa.cast(sa.extract('epoch',
+        base_tbl.expr.c.timestamp - base_tbl.expr.c.deadline), Float)
+    ratio = sa.case([
+        (base_tbl.expr.c.timestamp > base_tbl.expr.c.deadline,
+            1.0 - func.least(1.0,
+                func.ceil(delta / 86400.0, type_=Float) * 0.15, type_=Float))
+    ], else_=1.0)
+
+    score_tbl = (select([
+            sa.cast(sa.literal(category, RateScoreModel.category.type),
+                RateScoreModel.category.type).label('category'),
+            base_tbl.expr.c.user_uid,
+            base_tbl.expr.c.problem_uid,
+            base_tbl.expr.c.index,
+            sa.cast(func.trunc(score * ratio, type_=Float), Integer)
+                .label('score')
         ])
         .select_from(base_tbl
             .join(TestWeightModel,
                 (base_tbl.expr.c.problem_uid == TestWeightModel.problem_uid) &
                 (base_tbl.expr.c.index == TestWeightModel.index))
             .join(RateCountModel,
+                (RateCountModel.category == category) &
                 (base_tbl.expr.c.problem_uid == RateCountModel.problem_uid) &
                 (base_tbl.expr.c.index == RateCountModel.index),
-                isouter=True)))
+                isouter=True))
+        .alias())
+
+    score_query = (select([score_tbl.expr])
+        .where(score_tbl.expr.c.score > 0))
 
     async with conn.begin() as transcation:
         # Remove old data.
@@ -212,33 +302,543 @@ async def update_rate_score(category, spec_problem_uid=None, conn=None):
         if spec_problem_uid is not None:
             query = query.where(RateScoreModel.problem_uid == spec_problem_uid)
 
+        if spec_indices is not None:
+            query = query.where(RateScoreModel.index.in_(spec_indices))
+
         await query.execute(conn)
 
-        async for result in await score_query.execute(conn):
-            user_uid = result.user_uid
-            problem_uid = result.problem_uid
-            index = result.index
-            deadline = result.deadline
-            timestamp = result.timestamp
+        await (RateScoreModel.insert()
+            .from_select(['category', 'user_uid', 'problem_uid', 'index',
+                'score'], score_query)
+            .execute(conn))
+
+
+def build_user_query(category, spec_problem_uids=None, spec_user_uids=None):
+    '''Build the query of the users whose scores are updated.
+
+    Args:
+        category (UserCategory): Category.
+        spec_problem_uids ([int]) optional: Only the users who submitted the
+            specific problem IDs.
+        spec_user_uids ([int]) optional: Only the specific user IDs.
+
+    Returns:
+        ShadowExpr of the user IDs, which isn't correlated with the outer
+        queries.
+
+    '''
+
+    query = select([UserModel.uid]).where(UserModel.category == category)
+
+    if spec_problem_uids is not None or spec_user_uids is not None:
+        affected = sa.false()
+        if spec_problem_uids:
+            affected = affected | UserModel.uid.in_(select([UserModel.uid])
+                .select_from(ChallengeModel.join(UserModel).join(ProblemModel))
+                .where(ProblemModel.uid.in_(spec_problem_uids))
+                .expr)
+        if spec_user_uids:
+            affected = affected | UserModel.uid.in_(sorted(spec_user_uids))
+
+        query = query.where(affected)
+
+    # Don't correlate with the user table of the outer queries.
+    return query.correlate(None)
+
+
+async def update_user_score(category, spec_problem_uids=None,
+    spec_user_uids=None, conn=None):
+    '''Update user scores of the category.
+
+    With spec_problem_uids or spec_user_uids, only the affected users are
+    updated, and all their scores, including the global scores, are
+    recomputed.
+
+    Args:
+        category (UserCategory): Category.
+        spec_problem_uids ([int]) optional: Update the users who submitted
+            the specific problem IDs.
+        spec_user_uids ([int]) optional: Update the specific user IDs, e.g.
+            the submitters of the removed challenges.
+
+    '''
+
+    proset_tbl = (select([ProSetModel.uid])
+        .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+            int(category)))
+
+    user_tbl = build_user_query(category, spec_problem_uids, spec_user_uids)
+
+    if category == UserCategory.algo:
+        # Algo uses rate scoring.
+
+        item_tbl = (select([
+                ProSetModel.uid.label('proset_uid'),
+                ProblemModel.uid.label('problem_uid')
+            ])
+            .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+            .where(ProSetModel.uid.in_(proset_tbl.expr))
+            .distinct(ProSetModel.uid, ProblemModel.uid)
+            .alias())
+
+        proset_query = (select([
+                RateScoreModel.user_uid,
+                item_tbl.expr.c.proset_uid,
+                func.sum(RateScoreModel.score)
+            ])
+            .select_from(item_tbl.join(RateScoreModel,
+                RateScoreModel.problem_uid == item_tbl.expr.c.problem_uid))
+            .where(RateScoreModel.user_uid.in_(user_tbl.expr))
+            .group_by(RateScoreModel.user_uid, item_tbl.expr.c.proset_uid))
+
+        global_tbl = (select([ProblemModel.uid])
+            .select_from(ProItemModel.join(ProblemModel))
+            .distinct(ProblemModel.uid)
+            .alias())
+
+        global_query = (select([
+                RateScoreModel.user_uid,
+                sa.literal(GLOBAL_PROSET_UID),
+                func.sum(RateScoreModel.score)
+            ])
+            .select_from(RateScoreModel)
+            .where(RateScoreModel.user_uid.in_(user_tbl.expr))
+            .where(RateScoreModel.problem_uid.in_(global_tbl.expr))
+            .group_by(RateScoreModel.user_uid))
+    else:
+        # Default statistic scoring.
+
+        accepted_tbl = (select([
+                UserModel.uid.label('user_uid'),
+                ProblemModel.uid.label('problem_uid'),
+                SubtaskModel.index
+            ])
+            .select_from(ChallengeModel
+                .join(UserModel)
+                .join(ProblemModel)
+                .join(SubtaskModel))
+            .where(UserModel.uid.in_(user_tbl.expr))
+            .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
+                int(JudgeResult.STATUS_AC))
+            .distinct(UserModel.uid, ProblemModel.uid, SubtaskModel.index)
+            .alias())
+
+        item_query = (select([
+                ProSetModel.uid.label('proset_uid'),
+                TestWeightModel.problem_uid,
+                TestWeightModel.index,
+                TestWeightModel.score
+            ])
+            .select_from(ProItemModel
+                .join(ProblemModel)
+                .join(ProSetModel)
+                .join(TestWeightModel,
+                    ProblemModel.uid == TestWeightModel.problem_uid))
+            .where(ProSetModel.metadata['category'].astext.cast(Integer) ==
+                int(category))
+            .distinct(ProSetModel.uid, TestWeightModel.problem_uid,
+                TestWeightModel.index))
+
+        full_tbl = item_query.alias()
+        global_tbl = (select([
+                full_tbl.expr.c.problem_uid,
+                full_tbl.expr.c.index,
+                full_tbl.expr.c.score
+            ])
+            .distinct(full_tbl.expr.c.problem_uid, full_tbl.expr.c.index)
+            .alias())
+
+        item_tbl = (item_query
+            .where(ProSetModel.uid.in_(proset_tbl.expr))
+            .alias())
+
+        proset_query = (select([
+                accepted_tbl.expr.c.user_uid,
+                item_tbl.expr.c.proset_uid,
+                func.sum(item_tbl.expr.c.score)
+            ])
+            .select_from(accepted_tbl.join(item_tbl,
+                (accepted_tbl.expr.c.problem_uid ==
+                    item_tbl.expr.c.problem_uid) &
+                (accepted_tbl.expr.c.index == item_tbl.expr.c.index)))
+            .group_by(accepted_tbl.expr.c.user_uid,
+                item_tbl.expr.c.proset_uid))
+
+        global_query = (select([
+                accepted_tbl.expr.c.user_uid,
+                sa.literal(GLOBAL_PROSET_UID),
+                func.sum(global_tbl.expr.c.score)
+            ])
+            .select_from(accepted_tbl.join(global_tbl,
+                (accepted_tbl.expr.c.problem_uid ==
+                    global_tbl.expr.c.problem_uid) &
+                (accepted_tbl.expr.c.index == global_tbl.expr.c.index)))
+            .group_by(accepted_tbl.expr.c.user_uid))
+
+    async with conn.begin() as transcation:
+        # Remove old data.
+        await (UserScoreModel.delete()
+            .where(UserScoreModel.user_uid.in_(user_tbl.expr))
+            .execute(conn))
+
+        for query in [proset_query, global_query]:
+            await (UserScoreModel.insert()
+                .from_select(['user_uid', 'proset_uid', 'score'], query)
+                .execute(conn))
+
+
+async def update_rate(category, spec_problem_uid=None, spec_indices=None,
+    conn=None):
+    '''Update rate count and rate score of the category.
+
+    Args:
+        category (UserCategory): Category.
+        spec_problem_uid (int) optional: Only update the specific problem ID.
+        spec_indices ([int]) optional: Only update the specific subtask
+            indices. Must be used with spec_problem_uid.
+
+    '''
+
+    # Universe doesn't rate.
+    if category == UserCategory.universe:
+        return
+
+    await update_rate_count(category, spec_problem_uid, spec_indices,
+        conn=conn)
+    await update_rate_score(category, spec_problem_uid, spec_indices,
+        conn=conn)
+
+
+async def update_category(category, spec_problem_uid=None, spec_indices=None,
+    spec_user_uids=None, removed=False, conn=None, rsconn=None):
+    '''Update rates, user scores and cached leaderboards of the category.
+
+    Args:
+        category (UserCategory): Category.
+        spec_problem_uid (int) optional: Only update the specific problem ID.
+        spec_indices ([int]) optional: Only update the specific subtask
+            indices. Must be used with spec_problem_uid.
+        spec_user_uids ([int]) optional: Users whose scores may change
+            besides the submitters of the problem. Must be used with
+            spec_problem_uid.
+        removed (bool): The problem is removed from some problem sets, so
+            all cached leaderboards of the category are rebuilt instead of
+            updating the affected users.
+
+    '''
+
+    await update_rate(category, spec_problem_uid, spec_indices, conn=conn)
+
+    spec_problem_uids = None
+    if spec_problem_uid is not None:
+        spec_problem_uids = [spec_problem_uid]
+
+    await update_user_score(category, spec_problem_uids, spec_user_uids,
+        conn=conn)
+
+    if rsconn is not None:
+        # The problem sets which contained the problem can't be found.
+        if spec_problem_uids is None or removed:
+            await model.rank.refresh_cache(category, conn=conn, rsconn=rsconn)
+        else:
+            await model.rank.update_cache(category, spec_problem_uids,
+                spec_user_uids, conn=conn, rsconn=rsconn)
+
+
+class ScoringJob(object):
+    '''Pending scoring job.'''
+
+    def __init__(self, indices=None, user_uids=None, removed=False):
+        '''Initialize.
+
+        Args:
+            indices (set(int) | None): Subtask indices, None means all.
+            user_uids (set(int) | None): Users whose scores may change besides
+                the submitters of the problem.
+            removed (bool): The problem is removed from some problem sets.
+
+        '''
 
-            score = result.score
-            if score is None:
-                score = result.max_score * 4
+        self.indices = indices
+        self.user_uids = set(user_uids or ())
+        self.removed = removed
+
+    def merge(self, other):
+        '''Merge another job into this job.
+
+        Args:
+            other (ScoringJob): Another job.
+
+        '''
+
+        if self.indices is None or other.indices is None:
+            self.indices = None
+        else:
+            self.indices |= other.indices
+
+        self.user_uids |= other.user_uids
+        self.removed = self.removed or other.removed
+
+
+class ScoringScheduler(object):
+    '''Coalescing background scoring scheduler.
+
+    Invalidations are queued by (category, problem ID), and a None problem ID
+    stands for the whole category. Duplicated invalidations in the same window
+    are merged, then a single worker runs them with bounded connections.
+
+    '''
+
+    def __init__(self, engine, window, concurrency, redis_pool=None):
+        '''Initialize.
+
+        Args:
+            engine (object): Database engine.
+            window (float): Merging window in seconds.
+            concurrency (int): Maximum number of connections.
+            redis_pool (object) optional: Redis connection pool of the cached
+                leaderboards.
+
+        '''
+
+        self.engine = engine
+        self.redis_pool = redis_pool
+        self.window = window
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending = {}
+        self.running = {}
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.counter = collections.Counter()
+        self.worker = None
+
+    def start(self):
+        '''Start the worker.'''
+
+        loop = asyncio.get_event_loop()
+        self.worker = loop.create_task(self.run())
+
+    def schedule(self, category, problem_uid=None, job=None):
+        '''Queue an invalidation.
+
+        Args:
+            category (UserCategory): Category.
+            problem_uid (int) optional: Problem ID, None means all problems.
+            job (ScoringJob) optional: Job detail.
+
+        '''
+
+        if job is None:
+            job = ScoringJob()
+
+        self.counter['scheduled'] += 1
+
+        # The whole category covers all problems of the category.
+        whole_key = (category, None)
+        if problem_uid is None:
+            for key in [key for key in self.pending if key[0] == category]:
+                job.merge(self.pending.pop(key))
+                self.counter['merged'] += 1
+
+            job.indices = None
+            key = whole_key
+        elif whole_key in self.pending:
+            key = whole_key
+        else:
+            key = (category, problem_uid)
+
+        if key in self.pending:
+            self.pending[key].merge(job)
+            self.counter['merged'] += 1
+        else:
+            self.pending[key] = job
 
-            ratio = 1.0
-            if deadline is not None:
-                delta = (timestamp - deadline).total_seconds()
-                if delta > 0:
-                    ratio = 1.0 - min(1.0, (math.ceil(delta / 86400.0) * 0.15))
+        self.idle.clear()
+        self.wakeup.set()
 
-            score = int(score * ratio)
+    async def join(self):
+        '''Wait until all pending jobs are done.'''
 
-            if score > 0:
-                rate_score = RateScoreModel(category=category,
-                    user_uid=user_uid, problem_uid=problem_uid, index=index,
-                    score=score)
+        await self.idle.wait()
 
-                await rate_score.save(conn)
+    async def stop(self):
+        '''Wait until all pending jobs are done and stop the worker.'''
+
+        await self.join()
+
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+
+        self.worker = None
+
+    def status(self):
+        '''Get the status.
+
+        Returns:
+            { 'pending' (int), 'running' (int), 'scheduled' (int),
+                'merged' (int), 'done' (int), 'failed' (int) }
+
+        '''
+
+        return {
+            'pending': len(self.pending),
+            'running': len(self.running),
+            'scheduled': self.counter['scheduled'],
+            'merged': self.counter['merged'],
+            'done': self.counter['done'],
+            'failed': self.counter['failed'],
+        }
+
+    async def run(self):
+        '''Worker loop.'''
+
+        while True:
+            await self.wakeup.wait()
+            # Wait for more invalidations to merge.
+            await asyncio.sleep(self.window)
+            self.wakeup.clear()
+
+            self.running = self.pending
+            self.pending = {}
+
+            await asyncio.gather(*[self.execute(key, job) for key, job
+                in self.running.items()])
+
+            # Update user scores once per category.
+            categories = {}
+            for (category, problem_uid), job in self.running.items():
+                if problem_uid is None:
+                    categories[category] = (None, None, False)
+                    continue
+
+                problem_uids, user_uids, removed = categories.setdefault(
+                    category, (set(), set(), False))
+                if problem_uids is not None:
+                    categories[category] = (problem_uids | {problem_uid},
+                        user_uids | job.user_uids, removed or job.removed)
+
+            await asyncio.gather(*[self.execute_user_score(category, *spec)
+                for category, spec in categories.items()])
+
+            self.running = {}
+            if len(self.pending) == 0:
+                self.idle.set()
+
+    async def execute(self, key, job):
+        '''Execute a job.
+
+        Args:
+            key ((UserCategory, int | None)): Job key.
+            job (ScoringJob): Job.
+
+        '''
+
+        category, problem_uid = key
+        indices = None
+        if job.indices is not None:
+            indices = sorted(job.indices)
+
+        async with self.semaphore:
+            try:
+                async with self.engine.acquire() as conn:
+                    await update_rate(category, problem_uid, indices,
+                        conn=conn)
+
+                self.counter['done'] += 1
+            except:
+                logging.exception('Failed to update rates of %s.', key)
+                self.counter['failed'] += 1
+
+    async def execute_user_score(self, category, problem_uids,
+        user_uids=None, removed=False):
+        '''Update user scores.
+
+        Args:
+            category (UserCategory): Category.
+            problem_uids (set(int) | None): Problem IDs, None means all.
+            user_uids (set(int)) optional: Users whose scores may change
+                besides the submitters of the problems.
+            removed (bool): Some problems are removed from problem sets.
+
+        '''
+
+        if problem_uids is not None:
+            problem_uids = sorted(problem_uids)
+        if user_uids is not None:
+            user_uids = sorted(user_uids)
+
+        async with self.semaphore:
+            try:
+                async with self.engine.acquire() as conn:
+                    await update_user_score(category, problem_uids, user_uids,
+                        conn=conn)
+
+                    if self.redis_pool is not None:
+                        rsconn = redis.StrictRedis(
+                            connection_pool=self.redis_pool)
+                        # The problem sets which contained the removed
+                        # problems can't be found.
+                        if problem_uids is None or removed:
+                            await model.rank.refresh_cache(category,
+                                conn=conn, rsconn=rsconn)
+                        else:
+                            await model.rank.update_cache(category,
+                                problem_uids, user_uids, conn=conn,
+                                rsconn=rsconn)
+            except:
+                logging.exception('Failed to update user scores of %s.',
+                    category)
+                self.counter['failed'] += 1
+
+
+scheduler = None
+
+
+def start_scheduler(engine, redis_pool=None, window=config.SCORING_WINDOW,
+    concurrency=config.SCORING_CONCURRENCY):
+    '''Start the background scoring scheduler.
+
+    Without the scheduler, all updates are done inline.
+
+    Args:
+        engine (object): Database engine.
+        redis_pool (object) optional: Redis connection pool of the cached
+            leaderboards.
+        window (float): Merging window in seconds.
+        concurrency (int): Maximum number of connections.
+
+    '''
+
+    global scheduler
+
+    scheduler = ScoringScheduler(engine, window, concurrency, redis_pool)
+    scheduler.start()
+
+
+async def wait_pending():
+    '''Wait until all pending scoring jobs are done.'''
+
+    if scheduler is not None:
+        await scheduler.join()
+
+
+def get_pending():
+    '''Get the status of pending scoring jobs.
+
+    Returns:
+        Object | None
+
+    '''
+
+    if scheduler is None:
+        return None
+
+    return scheduler.status()
 
 
 @model_context
@@ -246,11 +846,7 @@ async def refresh(ctx=None):
     '''Refresh everything.'''
 
     for category in UserCategory:
-        if category == UserCategory.universe:
-            continue
-
-        await update_rate_count(category, conn=ctx.conn)
-        await update_rate_score(category, conn=ctx.conn)
+        await update_category(category, conn=ctx.conn, rsconn=ctx.redis)
 
 
 @model_context
@@ -266,41 +862,135 @@ async def change_category(old_category=None, new_category=None, ctx=None):
     if old_category == new_category:
         return
 
-    if old_category == UserCategory.universe:
-        old_category = None
+    for category in [old_category, new_category]:
+        if category is None:
+            continue
+
+        if scheduler is not None:
+            scheduler.schedule(category)
+        else:
+            await update_category(category, conn=ctx.conn, rsconn=ctx.redis)
+
+
+@model_context
+async def change_problem(problem_uid, problem_updated=False, user_uids=None,
+    removed=False, ctx=None):
+    '''Update the specific problem.
 
-    if new_category == UserCategory.universe:
-        new_category = None
+    Only the users who submitted the problem and the specific users are
+    rescored.
 
-    if old_category is not None:
-        await update_rate_count(old_category, conn=ctx.conn)
+    Args:
+        problem_uid (int): Problem ID.
+        problem_updated (bool): The problem itself is updated.
+        user_uids ([int]) optional: Users whose scores may change besides the
+            submitters of the problem, e.g. the submitters of the removed
+            challenges.
+        removed (bool): The problem is removed from some problem sets.
 
-    if new_category is not None:
-        await update_rate_count(new_category, conn=ctx.conn)
+    '''
 
-    if old_category is not None:
-        await update_rate_score(old_category, conn=ctx.conn)
+    # Nothing changes if the tests and the score of the problem are the same.
+    if problem_updated:
+        if not await update_test_weight(problem_uid, conn=ctx.conn):
+            return
 
-    if new_category is not None:
-        await update_rate_score(new_category, conn=ctx.conn)
+    for category in UserCategory:
+        if scheduler is not None:
+            scheduler.schedule(category, problem_uid,
+                ScoringJob(user_uids=user_uids, removed=removed))
+        else:
+            await update_category(category, problem_uid,
+                spec_user_uids=user_uids, removed=removed, conn=ctx.conn,
+                rsconn=ctx.redis)
 
 
 @model_context
-async def change_problem(problem_uid, problem_updated=False, ctx=None):
-    '''Update the specific problem.
+async def get_submitter_uids(problem_uid, ctx=None):
+    '''Get the users who submitted the problem.
 
     Args:
         problem_uid (int): Problem ID.
 
+    Returns:
+        Set of the user IDs.
+
     '''
 
-    for category in UserCategory:
-        if category == UserCategory.universe:
-            continue
+    query = (select([UserModel.uid])
+        .select_from(ChallengeModel.join(UserModel).join(ProblemModel))
+        .where(ProblemModel.uid == problem_uid)
+        .distinct(UserModel.uid))
+
+    user_uids = set()
+    async for result in await query.execute(ctx.conn):
+        user_uids.add(result.uid)
 
-        await update_rate_count(category, problem_uid, problem_updated,
-            conn=ctx.conn)
-        await update_rate_score(category, problem_uid, conn=ctx.conn)
+    return user_uids
+
+
+@model_context
+async def change_challenge(challenge, ctx=None):
+    '''Update incrementally when the challenge is done.
+
+    Only the subtasks which are accepted by the submitter for the first time
+    are recomputed, since the rate count and the rate score of a subtask only
+    depend on the earliest accepted challenge of each user.
+
+    Args:
+        challenge (ChallengeModel): Challenge.
+
+    '''
+
+    category = challenge.submitter.category
+    problem_uid = challenge.problem.uid
+
+    # Any done challenge may improve the cached best result.
+    await model.rank.update_cache_result(category, challenge.submitter.uid,
+        problem_uid, challenge.metadata['result'], conn=ctx.conn,
+        rsconn=ctx.redis)
+
+    query = (select([SubtaskModel.index])
+        .select_from(ChallengeModel.join(SubtaskModel))
+        .where(ChallengeModel.uid == challenge.uid)
+        .where(ChallengeModel.state == JudgeState.done)
+        .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
+            int(JudgeResult.STATUS_AC)))
+
+    indices = set()
+    async for result in await query.execute(ctx.conn):
+        indices.add(result.index)
+
+    if len(indices) == 0:
+        return
+
+    # Skip the subtasks which have been accepted before.
+    query = (select([SubtaskModel.index])
+        .select_from(ChallengeModel
+            .join(UserModel)
+            .join(ProblemModel)
+            .join(SubtaskModel))
+        .where(UserModel.uid == challenge.submitter.uid)
+        .where(ProblemModel.uid == problem_uid)
+        .where(ChallengeModel.uid != challenge.uid)
+        .where(ChallengeModel.state == JudgeState.done)
+        .where(ChallengeModel.timestamp <= challenge.timestamp)
+        .where(SubtaskModel.index.in_(indices))
+        .where(SubtaskModel.metadata['result'].astext.cast(Integer) ==
+            int(JudgeResult.STATUS_AC))
+        .distinct(SubtaskModel.index))
+
+    async for result in await query.execute(ctx.conn):
+        indices.discard(result.index)
+
+    if len(indices) == 0:
+        return
+
+    if scheduler is not None:
+        scheduler.schedule(category, problem_uid, ScoringJob(indices))
+    else:
+        await update_category(category, problem_uid, sorted(indices),
+            conn=ctx.conn, rsconn=ctx.redis)
 
 
 @model_context
@@ -384,10 +1074,43 @@ async def get_problem_rate(category, problem_uid, ctx=None):
             return sorted(results.values(), key=lambda x: x['index'])
 
 
+@model_context
+async def get_user_rate(user, spec_proset_uid=None, ctx=None):
+    '''Get the precomputed user score.
+
+    Args:
+        user (UserModel): User.
+        spec_proset_uid (int) optional: Problem set ID of the user's category.
+
+    Returns:
+        Int | None
+
+    '''
+
+    if spec_proset_uid is None:
+        spec_proset_uid = GLOBAL_PROSET_UID
+
+    query = (select([UserScoreModel.score], int)
+        .where(UserScoreModel.user_uid == user.uid)
+        .where(UserScoreModel.proset_uid == spec_proset_uid))
+
+    try:
+        score = await (await query.execute(ctx.conn)).scalar()
+        if score is None:
+            score = 0
+
+        return score
+    except:
+        logging.exception('Failed to get the score of user %d.', user.uid)
+        return None
+
+
 @model_context
 async def get_user_score(user, spec_problem_uid=None, spec_proset_uid=None,
     ctx=None):
-    '''Get user score.
+    '''Get user score on the fly.
+
+    The result should be the same as get_user_rate.
 
     Args:
         user (UserModel): User.
@@ -424,9 +1147,6 @@ async def get_user_score(user, spec_problem_uid=None, spec_proset_uid=None,
         return score
     else:
         # Default statistic scoring.
-
-        # TODO optimize the queries.
-
         base_tbl = (select([
                 TestWeightModel.problem_uid,
                 TestWeightModel.index,
@@ -460,8 +1180,7 @@ async def get_user_score(user, spec_problem_uid=None, spec_proset_uid=None,
                 int(JudgeResult.STATUS_AC)))
 
         if spec_problem_uid is not None:
-            score_tbl = score_tbl.where(
-                ProblemModel.problem_uid == spec_problem_uid)
+            score_tbl = score_tbl.where(ProblemModel.uid == spec_problem_uid)
 
         score_tbl = score_tbl.distinct(base_tbl.expr.c.problem_uid,
             base_tbl.expr.c.index, base_tbl.expr.c.score).alias()
@@ -4,9 +4,9 @@
 import enum
 import bcrypt
 import secrets
-from sqlalchemy import Table, Column, Integer, String, Enum
+from sqlalchemy import Table, Column, Integer, String, Enum, bindparam
 from sqlalchemy.dialects.postgresql import JSONB
-from . import BaseModel, model_context
+from . import BaseModel, model_context, cached_query
 
 
 @enum.unique
@@ -146,10 +146,11 @@ async def get(uid, ctx):
 
     '''
 
+    query = cached_query('user.get', lambda: UserModel.select()
+        .where(UserModel.uid == bindparam('uid')))
+
     try:
-        return await (await UserModel.select()
-            .where(UserModel.uid == uid)
-            .execute(ctx.conn)).first()
+        return await (await query.execute(ctx.conn, uid=uid)).first()
     except:
         return None
 
@@ -176,28 +177,36 @@ async def acquire(token, ctx):
 
     uid = int(uid)
 
+    query = cached_query('user.get', lambda: UserModel.select()
+        .where(UserModel.uid == bindparam('uid')))
+
     try:
-        return await (await UserModel.select()
-            .where(UserModel.uid == uid)
-            .execute(ctx.conn)).first()
+        return await (await query.execute(ctx.conn, uid=uid)).first()
     except:
         return None
 
 
 @model_context
-async def get_list(start_uid=0, limit=None, category=None, ctx=None):
+async def get_list(start_uid=0, limit=None, category=None, defer=(),
+    ctx=None):
     '''List the users.
 
     Args:
         start_uid (int): Lower bound of the user ID.
         limit (int): The size limit.
+        defer ([sa.Column]): Columns not to be loaded.
 
     Returns:
         [UserModel] | None
 
     '''
 
-    query = UserModel.select().where(UserModel.uid >= start_uid)
+    query = UserModel.select()
+
+    if len(defer) > 0:
+        query = query.defer(*defer)
+
+    query = query.where(UserModel.uid >= start_uid)
 
     if category is not None:
         query = query.where(UserModel.category == category)
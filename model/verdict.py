@@ -0,0 +1,159 @@
+'''Verdict cache module
+
+Verdicts of the judged code are cached in Redis, so resubmitting the same code
+to the same problem revision replays the verdicts instead of judging again:
+
+    JUDGECACHE@{fingerprint}: JSON of [[index, metadata], ...].
+    JUDGECACHESTAT: HASH of the hit and miss counters.
+
+The policy config.JUDGE_CACHE is 'off', 'ce' to cache only compile errors, or
+'all' to cache all verdicts except system errors.
+
+'''
+
+
+import config
+import json
+import hashlib
+from model.challenge import JudgeState, JudgeResult
+from . import model_context
+
+
+# Key of the counters.
+STAT_KEY = 'JUDGECACHESTAT'
+
+
+def fingerprint(code, problem):
+    '''Get the fingerprint of the code and the judge-relevant metadata.
+
+    Args:
+        code (string): Code.
+        problem (ProblemModel): Problem.
+
+    Returns:
+        String
+
+    '''
+
+    metadata = problem.metadata
+    content = json.dumps({
+        'revision': problem.revision,
+        'timelimit': metadata.get('timelimit'),
+        'memlimit': metadata.get('memlimit'),
+        'compile': metadata.get('compile'),
+        'check': metadata.get('check'),
+        'metadata': metadata.get('metadata', {}),
+        'test': [test['data'] for test in metadata['test']],
+    }, sort_keys=True)
+
+    code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+    return hashlib.sha256('{}:{}'.format(code_hash,
+        content).encode('utf-8')).hexdigest()
+
+
+def is_cacheable(result, policy=None):
+    '''Check if the result of the challenge can be cached.
+
+    Args:
+        result (JudgeResult): Result of the challenge.
+        policy (string) optional: Cache policy, default to config.JUDGE_CACHE.
+
+    Returns:
+        True | False
+
+    '''
+
+    if policy is None:
+        policy = config.JUDGE_CACHE
+
+    if result == JudgeResult.STATUS_ERR:
+        return False
+
+    if policy == 'all':
+        return True
+    elif policy == 'ce':
+        return result == JudgeResult.STATUS_CE
+
+    return False
+
+
+@model_context
+async def lookup(fp, ctx=None):
+    '''Look up the cached verdicts.
+
+    Args:
+        fp (string): Fingerprint.
+
+    Returns:
+        [(index (int), state (JudgeState), metadata (object))] | None
+
+    '''
+
+    try:
+        data = ctx.redis.get('JUDGECACHE@{}'.format(fp))
+        if data is None:
+            ctx.redis.hincrby(STAT_KEY, 'miss', 1)
+            return None
+
+        ctx.redis.hincrby(STAT_KEY, 'hit', 1)
+        return [(index, JudgeState.done, metadata) for index, metadata
+            in json.loads(data.decode('utf-8'))]
+    except:
+        return None
+
+
+@model_context
+async def store(fp, challenge, ctx=None):
+    '''Cache the verdicts of the done challenge if the policy allows.
+
+    Args:
+        fp (string): Fingerprint.
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        True | False: The verdicts are cached or not.
+
+    '''
+
+    if challenge.state != JudgeState.done:
+        return False
+
+    if not is_cacheable(challenge.metadata.get('result')):
+        return False
+
+    subtasks = await challenge.list()
+    if subtasks is None:
+        return False
+
+    try:
+        verdicts = [(subtask.index, {
+            'result': subtask.metadata['result'],
+            'runtime': subtask.metadata['runtime'],
+            'memory': subtask.metadata['memory'],
+            'verdict': subtask.metadata['verdict'],
+        }) for subtask in subtasks]
+
+        ctx.redis.setex('JUDGECACHE@{}'.format(fp), config.JUDGE_CACHE_EXPIRE,
+            json.dumps(verdicts))
+        return True
+    except:
+        return False
+
+
+@model_context
+async def get_stat(ctx=None):
+    '''Get the hit and miss counters.
+
+    Returns:
+        { 'hit' (int), 'miss' (int) } | None
+
+    '''
+
+    try:
+        stat = ctx.redis.hgetall(STAT_KEY)
+        return {
+            'hit': int(stat.get(b'hit', 0)),
+            'miss': int(stat.get(b'miss', 0)),
+        }
+    except:
+        return None
@@ -7,6 +7,8 @@ import view.problem
 import view.proset
 import view.challenge
 import view.rank
+import view.judge
+import model.scoring
 import asyncio
 import tornado.web
 import tornado.options
@@ -53,8 +55,14 @@ def create_application(engine, redis_pool):
         (r'/proset/(\d+)/(\d+)/remove', view.proset.RemoveItemHandler, param),
         (r'/challenge/list', view.challenge.ListHandler, param),
         (r'/challenge/rejudge', view.challenge.RejudgeHandler, param),
+        (r'/challenge/rejudge/(\d+)', view.challenge.RejudgeStatusHandler,
+            param),
         (r'/challenge/(\d+)/get', view.challenge.GetHandler, param),
+        (r'/challenge/(\d+)/code', view.challenge.CodeHandler, param),
         (r'/rank/(\d+)/list', view.rank.ListHandler, param),
+        (r'/rank/(\d+)/position', view.rank.PositionHandler, param),
+        (r'/judge/status', view.judge.StatusHandler, param),
+        (r'/internal/judge/(\d+)/result', view.judge.ResultHandler, param),
     ])
 
 
@@ -68,6 +76,7 @@ def start_server():
 
         engine = await aiopg.sa.create_engine(config.DB_URL)
         redis_pool = redis.ConnectionPool.from_url(config.REDIS_URL)
+        model.scoring.start_scheduler(engine, redis_pool)
         app = create_application(engine, redis_pool)
         app.listen(6600)
 
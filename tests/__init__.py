@@ -44,6 +44,8 @@ def async_test(func):
             global http_session
 
             rsconn = redis.StrictRedis.from_url(config.REDIS_URL)
+            # Drop the caches of the removed schemas.
+            rsconn.flushdb()
 
             async with aiopg.sa.create_engine(config.DB_URL) as engine:
                 async with engine.acquire() as conn:
@@ -0,0 +1,84 @@
+'''Fake judge server for unittest'''
+
+
+import json
+import asyncio
+from aiohttp import web
+
+
+class FakeJudge(object):
+    '''Fake judge server which accepts everything.'''
+
+    def __init__(self, port, delay=0, status=200, result=1, stream=False):
+        '''Initialize.
+
+        Args:
+            port (int): Listen port.
+            delay (float): Seconds to delay the responses.
+            status (int): HTTP status of the responses.
+            result (int): Result of all tests.
+            stream (bool): Stream NDJSON results if the client accepts, and
+                delay each result instead.
+
+        '''
+
+        self.port = port
+        self.delay = delay
+        self.status = status
+        self.result = result
+        self.stream = stream
+        self.requests = 0
+        self.url = 'http://localhost:{}'.format(port)
+
+    async def handle(self, request):
+        '''Handle a judge request.'''
+
+        data = await request.json()
+        self.requests += 1
+
+        results = [{
+            'test_idx': test['test_idx'],
+            'state': self.result,
+            'runtime': 1,
+            'peakmem': 1024,
+            'verdict': [],
+        } for test in data['test']]
+
+        if (self.stream and self.status == 200 and
+            'application/x-ndjson' in request.headers.get('accept', '')):
+            response = web.StreamResponse()
+            response.content_type = 'application/x-ndjson'
+            await response.prepare(request)
+            for result in results:
+                await asyncio.sleep(self.delay)
+                response.write((json.dumps(result) + '\n').encode('utf-8'))
+                await response.drain()
+
+            await response.write_eof()
+            return response
+
+        await asyncio.sleep(self.delay)
+
+        if self.status != 200:
+            return web.Response(status=self.status)
+
+        return web.json_response({ 'result': results })
+
+    async def start(self):
+        '''Start the server.'''
+
+        loop = asyncio.get_event_loop()
+        self.app = web.Application()
+        self.app.router.add_post('/reqjudge', self.handle)
+        self.handler = self.app.make_handler()
+        self.server = await loop.create_server(self.handler, 'localhost',
+            self.port)
+
+    async def stop(self):
+        '''Stop the server.'''
+
+        self.server.close()
+        await self.server.wait_closed()
+        await self.app.shutdown()
+        await self.handler.finish_connections()
+        await self.app.cleanup()
@@ -0,0 +1,330 @@
+'''Judge unittest'''
+
+
+import tests
+import config
+import judge
+import asyncio
+import model.user
+import model.problem
+import model.challenge
+import model.job
+from model.challenge import JudgeState, JudgeResult
+from tests.fake_judge import FakeJudge
+from judge.pool import *
+from unittest import TestCase
+
+
+def build_request(count):
+    '''Build a judge request with the number of tests.'''
+
+    return {
+        'chal_id': 1,
+        'test': [{ 'test_idx': idx } for idx in range(count)],
+    }
+
+
+class TestPool(TestCase):
+    '''Judge pool unittest.'''
+
+    @tests.async_test
+    async def test_route(self):
+        '''Test route to the least loaded endpoint.'''
+
+        slow = FakeJudge(2601, delay=0.5)
+        fast = FakeJudge(2602)
+        await slow.start()
+        await fast.start()
+
+        pool = JudgePool([slow.url, fast.url], backoff=10)
+        try:
+            loop = asyncio.get_event_loop()
+            task = loop.create_task(pool.request(build_request(5)))
+            await asyncio.sleep(0.1)
+            self.assertEqual(pool.endpoints[0].inflight, 5)
+            self.assertIs(pool.pick(), pool.endpoints[1])
+
+            for idx in range(3):
+                response = await pool.request(build_request(2))
+                self.assertEqual(len(response['result']), 2)
+
+            response = await task
+            self.assertEqual(len(response['result']), 5)
+
+            self.assertEqual(slow.requests, 1)
+            self.assertEqual(fast.requests, 3)
+
+            status = pool.status()
+            self.assertEqual(status[0]['tests'], 5)
+            self.assertEqual(status[1]['tests'], 6)
+            self.assertEqual(status[1]['inflight'], 0)
+            self.assertGreater(status[0]['latency'], status[1]['latency'])
+        finally:
+            pool.close()
+            await slow.stop()
+            await fast.stop()
+
+    @tests.async_test
+    async def test_backoff(self):
+        '''Test back off from the failed endpoint.'''
+
+        broken = FakeJudge(2601, status=500)
+        fast = FakeJudge(2602)
+        await broken.start()
+        await fast.start()
+
+        pool = JudgePool([broken.url, fast.url], backoff=10)
+        try:
+            with self.assertRaises(JudgeError):
+                await pool.request(build_request(1))
+
+            self.assertFalse(pool.status()[0]['available'])
+
+            for idx in range(3):
+                await pool.request(build_request(1))
+
+            self.assertEqual(broken.requests, 1)
+            self.assertEqual(fast.requests, 3)
+            self.assertEqual(pool.status()[0]['errors'], 1)
+        finally:
+            pool.close()
+            await broken.stop()
+            await fast.stop()
+
+    @tests.async_test
+    async def test_cancel(self):
+        '''Test cancelling a request doesn't back off the endpoint.'''
+
+        slow = FakeJudge(2601, delay=0.5)
+        await slow.start()
+
+        pool = JudgePool([slow.url], backoff=10)
+        try:
+            loop = asyncio.get_event_loop()
+            task = loop.create_task(pool.request(build_request(2)))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            status = pool.status()
+            self.assertEqual(status[0]['inflight'], 0)
+            self.assertEqual(status[0]['errors'], 0)
+            self.assertTrue(status[0]['available'])
+        finally:
+            pool.close()
+            await slow.stop()
+
+
+class TestStream(TestCase):
+    '''Streamed results unittest.'''
+
+    @tests.async_test
+    async def test_stream(self):
+        '''Test receive the results as they arrive.'''
+
+        stream = FakeJudge(2601, delay=0.1, stream=True)
+        await stream.start()
+
+        pool = JudgePool([stream.url])
+        try:
+            results = []
+            response = await pool.request(build_request(3),
+                stream=results.append)
+            self.assertIsNone(response)
+            self.assertEqual([result['test_idx'] for result in results],
+                [0, 1, 2])
+
+            # Fallback to the results at once.
+            response = await pool.request(build_request(3))
+            self.assertEqual(len(response['result']), 3)
+        finally:
+            pool.close()
+            await stream.stop()
+
+    @tests.async_test
+    async def test_apply(self):
+        '''Test apply the results in batches.'''
+
+        class FakeChallenge(object):
+            '''Challenge which records the updates.'''
+
+            uid = 1
+            batches = []
+
+            async def update_subtasks(self, results):
+                self.batches.append([idx for idx, state, metadata in results])
+                return True
+
+        def build_result(idx):
+            '''Build the result of the test.'''
+
+            return {
+                'test_idx': idx,
+                'state': int(JudgeResult.STATUS_AC),
+                'runtime': 1,
+                'peakmem': 1024,
+                'verdict': [],
+            }
+
+        challenge = FakeChallenge()
+        queue = asyncio.Queue()
+        loop = asyncio.get_event_loop()
+        task = loop.create_task(judge.apply_results(challenge, queue, 0.1))
+
+        queue.put_nowait(build_result(0))
+        queue.put_nowait(build_result(1))
+        await asyncio.sleep(0.2)
+        queue.put_nowait(build_result(2))
+        queue.put_nowait(None)
+        await task
+
+        self.assertEqual(challenge.batches, [[0, 1], [2]])
+
+    @tests.async_test
+    async def test_judge(self):
+        '''Test judge the challenge with the streamed results.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'timelimit': 1000,
+            'memlimit': 65536,
+            'compile': 'g++',
+            'check': 'diff',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        challenge = await model.challenge.create(user, problem)
+        job = await model.job.push(challenge, '/home/sptoj/main.cpp')
+
+        stream = FakeJudge(2601, delay=0.1, stream=True,
+            result=int(JudgeResult.STATUS_AC))
+        await stream.start()
+
+        pool = JudgePool([stream.url])
+        try:
+            self.assertTrue(await judge.judge(challenge, job, pool))
+        finally:
+            pool.close()
+            await stream.stop()
+
+        challenge = await model.challenge.get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(challenge.metadata['result'], JudgeResult.STATUS_AC)
+
+
+class TestCallback(TestCase):
+    '''Judge callback unittest.'''
+
+    def setUp(self):
+        '''Set the callback secret.'''
+
+        self.secret = config.JUDGE_SECRET
+        config.JUDGE_SECRET = 'secret'
+
+    def tearDown(self):
+        '''Restore the callback secret.'''
+
+        config.JUDGE_SECRET = self.secret
+
+    def test_secret(self):
+        '''Test the callbacks require the secret.'''
+
+        judge.Dispatcher(None, None, None, callback_url='http://localhost')
+
+        config.JUDGE_SECRET = ''
+        with self.assertRaises(ValueError):
+            judge.Dispatcher(None, None, None,
+                callback_url='http://localhost')
+
+        judge.Dispatcher(None, None, None, callback_url=None)
+
+    @tests.async_test
+    async def test_result(self):
+        '''Test post the results back.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        challenge = await model.challenge.create(user, problem)
+        job = await model.job.push(challenge, 'main.cpp')
+
+        def build_result(idx):
+            '''Build the accepted result of the test.'''
+
+            return {
+                'test_idx': idx,
+                'state': int(JudgeResult.STATUS_AC),
+                'runtime': 1,
+                'peakmem': 1024,
+                'verdict': [],
+            }
+
+        suffix = '/internal/judge/{}/result'.format(challenge.uid)
+        response = await tests.request(suffix, {
+            'job': job.uid,
+            'token': judge.sign(challenge.uid + 1, job.uid),
+            'result': [build_result(0)],
+        })
+        self.assertEqual(response, 'Error')
+
+        for idx in range(2):
+            response = await tests.request(suffix, {
+                'job': job.uid,
+                'token': judge.sign(challenge.uid, job.uid),
+                'result': [build_result(idx)],
+            })
+            self.assertEqual(response, 'Success')
+
+            challenge = await model.challenge.get(challenge.uid)
+            if idx == 0:
+                self.assertNotEqual(challenge.state, JudgeState.done)
+                self.assertEqual(await model.job.get_count(), 1)
+
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(await model.job.get_count(), 0)
+
+    @tests.async_test
+    async def test_concurrent_result(self):
+        '''Test post the results of all tests at once.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [{ 'data': [idx], 'weight': 10 } for idx in range(10)]
+        })
+        challenge = await model.challenge.create(user, problem)
+        job = await model.job.push(challenge, 'main.cpp')
+
+        suffix = '/internal/judge/{}/result'.format(challenge.uid)
+        token = judge.sign(challenge.uid, job.uid)
+
+        # Malformed bodies are rejected.
+        for data in [{}, { 'job': job.uid }, { 'job': job.uid, 'token': token },
+            { 'job': job.uid, 'token': token, 'result': [{}] }]:
+            self.assertEqual(await tests.request(suffix, data), 'Error')
+
+        responses = await asyncio.gather(*[tests.request(suffix, {
+                'job': job.uid,
+                'token': token,
+                'result': [{
+                    'test_idx': idx,
+                    'state': int(JudgeResult.STATUS_AC),
+                    'runtime': 1,
+                    'peakmem': 1024,
+                    'verdict': [],
+                }],
+            }) for idx in range(10)])
+        self.assertEqual(responses, ['Success'] * 10)
+
+        challenge = await model.challenge.get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(await model.job.get_count(), 0)
@@ -0,0 +1,300 @@
+'''Model base unittest'''
+
+
+import tests
+import model.user
+import model.problem
+import model.challenge
+from model import model_context, cached_query, get_query_stat
+from sqlalchemy import bindparam
+from model.user import UserModel, UserLevel, UserCategory
+from unittest import TestCase
+
+
+class TestSaveAll(TestCase):
+    '''Bulk save unittest.'''
+
+    @model_context
+    async def save_all(self, instances, returning=False, ctx=None):
+        '''Save all instances.'''
+
+        await UserModel.save_all(instances, ctx.conn, returning=returning)
+
+    @tests.async_test
+    async def test_save_all(self):
+        '''Test bulk save.'''
+
+        users = [UserModel(level=UserLevel.user, mail='user{}'.format(idx),
+                password='', name='User{}'.format(idx),
+                category=UserCategory.universe, metadata={})
+            for idx in range(10)]
+        await self.save_all(users, returning=True)
+
+        for idx, user in enumerate(users):
+            self.assertIsNotNone(user.uid)
+            user = await model.user.get(user.uid)
+            self.assertEqual(user.mail, 'user{}'.format(idx))
+
+        for user in users:
+            user.name = 'Foo'
+
+        await self.save_all(users)
+
+        users = await model.user.get_list()
+        self.assertEqual(len(users), 10)
+        self.assertTrue(all(user.name == 'Foo' for user in users))
+
+
+class TestQueryCache(TestCase):
+    '''Query cache unittest.'''
+
+    @model_context
+    async def get_by_level(self, level, ctx=None):
+        '''Get the users by level with the cached query.'''
+
+        query = cached_query('test.level', lambda: UserModel.select()
+            .where(UserModel.level == bindparam('level'))
+            .order_by(UserModel.uid))
+
+        users = []
+        async for user in await query.execute(ctx.conn, level=level):
+            users.append(user)
+
+        return users
+
+    @tests.async_test
+    async def test_cache(self):
+        '''Test execute the cached query with different parameters.'''
+
+        await model.user.create('admin', '1234', 'Admin',
+            level=UserLevel.kernel)
+        foo = await model.user.create('foo', '1234', 'Foo')
+
+        stat = get_query_stat()
+
+        users = await self.get_by_level(UserLevel.kernel)
+        self.assertEqual([user.name for user in users], ['Admin'])
+        self.assertEqual(users[0].level, UserLevel.kernel)
+
+        users = await self.get_by_level(UserLevel.user)
+        self.assertEqual([user.name for user in users], ['Foo'])
+
+        user = await model.user.get(foo.uid)
+        self.assertEqual(user.mail, 'foo')
+        self.assertIsNone(await model.user.get(foo.uid + 1))
+
+        new_stat = get_query_stat()
+        self.assertGreaterEqual(new_stat['hit'] - stat['hit'], 2)
+        self.assertLessEqual(new_stat['miss'] - stat['miss'], 2)
+
+        # The statement is compiled once for the dialect of the engine.
+        stat = new_stat
+        for level in [UserLevel.kernel, UserLevel.user, UserLevel.kernel]:
+            await self.get_by_level(level)
+
+        new_stat = get_query_stat()
+        self.assertEqual(new_stat['hit'] - stat['hit'], 3)
+        self.assertEqual(new_stat['compile'] - stat['compile'], 0)
+
+
+class TestRelation(TestCase):
+    '''Reverse relation unittest.'''
+
+    @model_context
+    async def count(self, query, ctx=None):
+        '''Count the rows of the query.'''
+
+        return (await query.execute(ctx.conn)).rowcount
+
+    @tests.async_test
+    async def test_lazy(self):
+        '''Test build the reverse relation query on access.'''
+
+        user = UserModel(level=UserLevel.user, mail='foo', password='',
+            name='Foo', category=UserCategory.universe, metadata={})
+        with self.assertRaises(AttributeError):
+            user.challenges
+
+        await TestSaveAll().save_all([user], returning=True)
+        self.assertNotIn('challenges', user._fields)
+        self.assertEqual(await self.count(user.challenges), 0)
+
+        user = await model.user.get(user.uid)
+        self.assertNotIn('challenges', user._fields)
+        self.assertEqual(await self.count(user.challenges), 0)
+
+
+class TestHydration(TestCase):
+    '''Hydration unittest.'''
+
+    @tests.async_test
+    async def test_hydrate(self):
+        '''Test hydrate the nested relations with the plan.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1], 'weight': 100 },
+            ]
+        })
+        challenge = await model.challenge.create(user, problem)
+
+        challenge = await model.challenge.get(challenge.uid)
+        self.assertEqual(challenge.submitter.name, 'Foo')
+        self.assertEqual(challenge.problem.uid, 1000)
+        self.assertEqual(challenge.problem.metadata['name'], 'foo')
+
+        # Fields are kept in the slot.
+        self.assertFalse(hasattr(challenge, '__dict__'))
+        self.assertFalse(hasattr(challenge.submitter, '__dict__'))
+        with self.assertRaises(AttributeError):
+            challenge.foo = 1
+
+
+class TestDefer(TestCase):
+    '''Deferred column unittest.'''
+
+    @model_context
+    async def load(self, instance, *names, ctx=None):
+        '''Load the deferred fields.'''
+
+        await instance.load(ctx.conn, *names)
+
+    @model_context
+    async def save(self, instance, ctx=None):
+        '''Save the instance.'''
+
+        await instance.save(ctx.conn)
+
+    @model_context
+    async def select_only(self, *columns, ctx=None):
+        '''Select the first user with only the columns.'''
+
+        return await (await UserModel.select().only(*columns)
+            .execute(ctx.conn)).first()
+
+    @tests.async_test
+    async def test_defer(self):
+        '''Test defer the columns of the relations.'''
+
+        user = await model.user.create('foo', '1234', 'Foo',
+            metadata={ 'foo': 'bar' })
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1], 'weight': 100 },
+            ]
+        })
+        await model.challenge.create(user, problem)
+
+        ChallengeModel = model.challenge.ChallengeModel
+        partial_list = await model.challenge.get_list(defer=(
+            ChallengeModel.problem.metadata,
+            ChallengeModel.submitter.metadata))
+        self.assertEqual(partial_list['count'], 1)
+
+        challenge = partial_list['data'][0]
+        self.assertEqual(challenge.problem.uid, 1000)
+        self.assertEqual(challenge.submitter.name, 'Foo')
+        with self.assertRaises(AttributeError):
+            challenge.problem.metadata
+        with self.assertRaises(AttributeError):
+            challenge.submitter.metadata
+
+        await self.load(challenge.problem)
+        self.assertEqual(challenge.problem.metadata['name'], 'foo')
+
+        # Saving leaves the deferred columns untouched.
+        user = challenge.submitter
+        user.name = 'Bar'
+        await self.save(user)
+        user = await model.user.get(user.uid)
+        self.assertEqual(user.name, 'Bar')
+        self.assertEqual(user.metadata, { 'foo': 'bar' })
+
+    @tests.async_test
+    async def test_only(self):
+        '''Test select only the columns.'''
+
+        await model.user.create('foo', '1234', 'Foo')
+
+        users = await model.user.get_list()
+        self.assertEqual(users[0].metadata, {})
+
+        users = await model.user.get_list(defer=(UserModel.metadata,))
+        with self.assertRaises(AttributeError):
+            users[0].metadata
+        await self.load(users[0], 'metadata')
+        self.assertEqual(users[0].metadata, {})
+
+        user = await self.select_only(UserModel.name)
+        self.assertEqual(user.name, 'Foo')
+        self.assertIsNotNone(user.uid)
+        with self.assertRaises(AttributeError):
+            user.mail
+
+
+class TestDirty(TestCase):
+    '''Dirty field unittest.'''
+
+    @model_context
+    async def save(self, instance, ctx=None):
+        '''Save the instance.'''
+
+        await instance.save(ctx.conn)
+
+    @model_context
+    async def modify(self, uid, ctx=None, **values):
+        '''Change the user row behind the instance.'''
+
+        await (UserModel.modify()
+            .where(UserModel.uid == uid)
+            .values(**values)
+            .execute(ctx.conn))
+
+    @tests.async_test
+    async def test_dirty(self):
+        '''Test save only the dirty fields.'''
+
+        user = UserModel(level=UserLevel.user, mail='foo', password='',
+            name='Foo', category=UserCategory.universe, metadata={})
+        self.assertIsNone(user._dirty)
+        await self.save(user)
+        self.assertEqual(user._dirty, set())
+
+        user = await model.user.get(user.uid)
+        self.assertEqual(user._dirty, set())
+
+        # A save without dirty fields writes nothing.
+        await self.modify(user.uid, name='Bar')
+        await self.save(user)
+        self.assertEqual((await model.user.get(user.uid)).name, 'Bar')
+
+        # Only the dirty fields are written.
+        await self.modify(user.uid, category=UserCategory.algo)
+        user.name = 'Baz'
+        self.assertEqual(user._dirty, { 'name' })
+        await self.save(user)
+        self.assertEqual(user._dirty, set())
+
+        new_user = await model.user.get(user.uid)
+        self.assertEqual(new_user.name, 'Baz')
+        self.assertEqual(new_user.category, UserCategory.algo)
+
+        # Reading JSON values doesn't make them dirty.
+        await self.modify(user.uid, metadata={ 'foo': 'baz' })
+        self.assertEqual(user.metadata, {})
+        user.name = 'Foo'
+        self.assertEqual(user.get_dirty(), { 'name' })
+        await self.save(user)
+        self.assertEqual((await model.user.get(user.uid)).metadata,
+            { 'foo': 'baz' })
+
+        # JSON values changed in place are dirty.
+        user.metadata['foo'] = 'bar'
+        self.assertEqual(user.get_dirty(), { 'metadata' })
+        await self.save(user)
+        self.assertEqual(user.get_dirty(), set())
+        self.assertEqual((await model.user.get(user.uid)).metadata,
+            { 'foo': 'bar' })
@@ -2,6 +2,7 @@
 
 
 import tests
+import asyncio
 import model.user
 import model.problem
 from model.challenge import *
@@ -33,3 +34,208 @@ class TestBasic(TestCase):
         self.assertTrue(await challenge.remove())
         challenge = await get(challenge.uid)
         self.assertIsNone(challenge)
+
+    @tests.async_test
+    async def test_update_subtasks(self):
+        '''Test update all subtasks at once.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        challenge = await create(user, problem)
+
+        self.assertTrue(await challenge.update_subtasks([
+            (0, JudgeState.done, {
+                'result': JudgeResult.STATUS_CE,
+                'runtime': 10,
+                'memory': 100,
+                'verdict': ['error'],
+            }),
+            (1, JudgeState.running, None),
+        ]))
+        self.assertEqual(challenge.state, JudgeState.running)
+
+        self.assertTrue(await challenge.update_subtasks([
+            (1, JudgeState.done, {
+                'result': JudgeResult.STATUS_CE,
+                'runtime': 20,
+                'memory': 200,
+                'verdict': ['error'],
+            }),
+        ]))
+
+        challenge = await get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(challenge.metadata, {
+            'memory': 300,
+            'runtime': 30,
+            'result': JudgeResult.STATUS_CE,
+            'verdict': 'error',
+        })
+
+        subtasks = await challenge.list()
+        self.assertEqual([subtask.state for subtask in subtasks],
+            [JudgeState.done, JudgeState.done])
+        self.assertEqual(subtasks[1].metadata['runtime'], 20)
+
+    async def update_concurrently(self, challenge_uid, results):
+        '''Update each subtask from a separate connection at once.'''
+
+        redis = asyncio.Task.current_task()._redis
+
+        async def update(result):
+            '''Update the subtask.'''
+
+            async with tests.engine.acquire() as conn:
+                task = asyncio.Task.current_task()
+                task._conn = conn
+                task._redis = redis
+
+                challenge = await get(challenge_uid)
+                return await challenge.update_subtasks([result])
+
+        return await asyncio.gather(*[update(result) for result in results])
+
+    @tests.async_test
+    async def test_update_concurrently(self):
+        '''Test the concurrent updates reach the done state.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [{ 'data': [idx], 'weight': 10 } for idx in range(10)]
+        })
+        challenge = await create(user, problem)
+
+        self.assertTrue(all(await self.update_concurrently(challenge.uid, [
+            (idx, JudgeState.done, {
+                'result': JudgeResult.STATUS_AC,
+                'runtime': 10,
+                'memory': 100,
+                'verdict': [],
+            }) for idx in range(10)
+        ])))
+
+        challenge = await get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(challenge.metadata['runtime'], 100)
+
+    @tests.async_test
+    async def test_start(self):
+        '''Test mark the challenge running.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        challenge = await create(user, problem)
+
+        self.assertTrue(await challenge.start())
+        self.assertEqual(challenge.state, JudgeState.running)
+
+        challenge = await get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.running)
+        self.assertEqual([subtask.state for subtask in await challenge.list()],
+            [JudgeState.running, JudgeState.running])
+
+        # Started challenges are kept.
+        self.assertTrue(await challenge.update_subtask(0, JudgeState.done, {
+            'result': JudgeResult.STATUS_AC,
+            'runtime': 0,
+            'memory': 0,
+            'verdict': [],
+        }))
+        self.assertTrue(await challenge.start())
+        self.assertEqual([subtask.state for subtask in await challenge.list()],
+            [JudgeState.done, JudgeState.running])
+
+        # Done challenges aren't started again.
+        self.assertTrue(await challenge.update_subtask(1, JudgeState.done, {
+            'result': JudgeResult.STATUS_AC,
+            'runtime': 0,
+            'memory': 0,
+            'verdict': [],
+        }))
+        challenge = await get(challenge.uid)
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertFalse(await challenge.start())
+        self.assertEqual(challenge.state, JudgeState.done)
+
+    @tests.async_test
+    async def test_reset(self):
+        '''Test reset only the changed subtasks.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60, 'signature': 'a' },
+                { 'data': [3], 'weight': 40, 'signature': 'b' },
+            ]
+        })
+        challenge = await create(user, problem)
+        self.assertTrue(await challenge.update_subtasks([
+            (idx, JudgeState.done, {
+                'result': JudgeResult.STATUS_AC,
+                'runtime': 10,
+                'memory': 100,
+                'verdict': [],
+            }) for idx in range(2)
+        ]))
+
+        # Nothing is changed.
+        challenge = await get(challenge.uid)
+        self.assertTrue(await challenge.reset(True))
+        self.assertEqual(challenge.state, JudgeState.done)
+
+        problem = await model.problem.create(1000, 'cafebabe', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 50, 'signature': 'a' },
+                { 'data': [3], 'weight': 50, 'signature': 'c' },
+            ]
+        })
+        challenge = await get(challenge.uid)
+        self.assertTrue(await challenge.reset(True))
+        self.assertEqual(challenge.state, JudgeState.pending)
+        self.assertEqual(challenge.revision, 'cafebabe')
+
+        subtasks = await challenge.list()
+        self.assertEqual([subtask.state for subtask in subtasks],
+            [JudgeState.done, JudgeState.pending])
+        self.assertEqual(subtasks[0].metadata['runtime'], 10)
+        self.assertEqual(subtasks[1].metadata['signature'], 'c')
+
+        self.assertTrue(await challenge.update_subtask(1, JudgeState.done, {
+            'result': JudgeResult.STATUS_WA,
+            'runtime': 20,
+            'memory': 200,
+            'verdict': [],
+        }))
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(challenge.metadata['runtime'], 30)
+        self.assertEqual(challenge.metadata['result'], JudgeResult.STATUS_WA)
+
+        # Reset all subtasks.
+        self.assertTrue(await challenge.reset())
+        self.assertEqual([subtask.state for subtask in await challenge.list()],
+            [JudgeState.pending, JudgeState.pending])
+
+        # A problem without tests.
+        problem = await model.problem.create(1001, 'deadbeef', {
+            'name': 'bar',
+            'test': []
+        })
+        challenge = await create(user, problem)
+        self.assertTrue(await challenge.reset(True))
+        self.assertEqual(challenge.state, JudgeState.pending)
+        self.assertEqual(await challenge.list(), [])
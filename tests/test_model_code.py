@@ -0,0 +1,79 @@
+'''Code store model unittest'''
+
+
+import tests
+import config
+import os
+import time
+import shutil
+from collections import namedtuple
+from model.code import *
+from unittest import TestCase
+
+
+# Challenge with only the fields of the code store.
+Challenge = namedtuple('Challenge', ['uid', 'code_hash'])
+
+
+class TestStore(TestCase):
+    '''Store unittest.'''
+
+    def test_store(self):
+        '''Test store, load and materialize the code.'''
+
+        code_hash = put('int main() { return 0; }')
+        self.assertEqual(code_hash, get_hash('int main() { return 0; }'))
+        self.assertEqual(put('int main() { return 0; }'), code_hash)
+        self.assertEqual(get(code_hash), 'int main() { return 0; }')
+        self.assertIsNone(get(get_hash('missing')))
+
+        challenge = Challenge(1, code_hash)
+        self.assertEqual(load(challenge), 'int main() { return 0; }')
+
+        code_path = materialize(challenge)
+        with open(code_path, 'r') as code_file:
+            self.assertEqual(code_file.read(), 'int main() { return 0; }')
+
+    def test_legacy(self):
+        '''Test load the code stored before the code store.'''
+
+        challenge = Challenge(1000000, None)
+        code_path = get_legacy_path(challenge.uid)
+        os.makedirs(os.path.dirname(code_path), exist_ok=True)
+        with open(code_path, 'w') as code_file:
+            code_file.write('int main() {}')
+
+        self.assertEqual(load(challenge), 'int main() {}')
+        self.assertEqual(materialize(challenge), code_path)
+
+    def test_evict(self):
+        '''Test evict the least recently used materialized code.'''
+
+        shutil.rmtree(os.path.join(config.CODE_DIR, 'cache'),
+            ignore_errors=True)
+
+        challenges = [Challenge(idx, put('int main() {{ return {}; }}'.format(
+            idx))) for idx in range(3)]
+
+        now = time.time()
+        code_paths = []
+        for idx, challenge in enumerate(challenges):
+            code_path = materialize(challenge)
+            os.utime(os.path.dirname(code_path), (now - 10 + idx,
+                now - 10 + idx))
+            code_paths.append(code_path)
+
+        # The recently used entries are kept.
+        self.assertEqual(evict(limit=1, min_age=3600), 0)
+
+        self.assertEqual(get_cached(challenges[0]), code_paths[0])
+        self.assertEqual(evict(limit=2, min_age=0), 1)
+        self.assertFalse(os.path.exists(code_paths[1]))
+        self.assertTrue(os.path.exists(code_paths[0]))
+        self.assertTrue(os.path.exists(code_paths[2]))
+        self.assertIsNone(get_cached(challenges[1]))
+
+        # Evicted code is materialized again from the store.
+        self.assertEqual(materialize(challenges[1]), code_paths[1])
+        with open(code_paths[1], 'r') as code_file:
+            self.assertEqual(code_file.read(), 'int main() { return 1; }')
@@ -0,0 +1,137 @@
+'''Judge job model unittest'''
+
+
+import tests
+import model.user
+import model.problem
+import model.challenge
+from model import model_context
+from model.job import *
+from unittest import TestCase
+
+
+@model_context
+async def run(func, *args, ctx=None):
+    '''Run the function with the connection.'''
+
+    return await func(*args, conn=ctx.conn)
+
+
+class TestQueue(TestCase):
+    '''Queue unittest.'''
+
+    @tests.async_test
+    async def test_lease(self):
+        '''Test claim, lease expiration and finish.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        low = await model.challenge.create(user, problem)
+        high = await model.challenge.create(user, problem)
+
+        self.assertIsNotNone(await push(low, 'low.cpp', priority=-1))
+        self.assertIsNotNone(await push(high, 'high.cpp'))
+        # Replace the pending job.
+        self.assertIsNotNone(await push(high, 'high.cpp'))
+        self.assertEqual(await get_count(), 2)
+
+        job = await run(claim, 'foo', 60)
+        self.assertEqual(job.challenge.uid, high.uid)
+        self.assertEqual(job.attempts, 1)
+
+        # The worker died and the lease is expired.
+        dead_job = await run(claim, 'foo', -1)
+        self.assertEqual(dead_job.challenge.uid, low.uid)
+        self.assertTrue(await run(renew, job, 60))
+
+        new_job = await run(claim, 'bar', 60)
+        self.assertEqual(new_job.challenge.uid, low.uid)
+        self.assertEqual(new_job.attempts, 2)
+        self.assertIsNone(await run(claim, 'bar', 60))
+
+        # The job is owned by the new worker.
+        self.assertFalse(await run(renew, dead_job, 60))
+        self.assertFalse(await run(finish, dead_job))
+
+        self.assertTrue(await run(finish, job))
+        self.assertTrue(await run(finish, new_job))
+        self.assertEqual(await get_count(), 0)
+
+    @tests.async_test
+    async def test_recover(self):
+        '''Test recover the challenges without jobs.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+            ]
+        })
+        challenge = await model.challenge.create(user, problem)
+
+        self.assertEqual(await run(recover, lambda challenge: 'main.cpp'), 1)
+        self.assertEqual(await run(recover, lambda challenge: 'main.cpp'), 0)
+
+        job = await run(claim, 'foo', 60)
+        self.assertEqual(job.challenge.uid, challenge.uid)
+        self.assertEqual(job.code_path, 'main.cpp')
+
+    @tests.async_test
+    async def test_rejudge(self):
+        '''Test queue a rejudge with bounded running jobs.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+            ]
+        })
+
+        done_challenges = []
+        for idx in range(3):
+            challenge = await model.challenge.create(user, problem)
+            self.assertTrue(await challenge.update_subtask(0,
+                model.challenge.JudgeState.done, {
+                    'result': 1,
+                    'runtime': 1,
+                    'memory': 1,
+                    'verdict': [],
+                }))
+            done_challenges.append(challenge.uid)
+
+        pending = await model.challenge.create(user, problem)
+        self.assertIsNotNone(await push(pending, 'main.cpp'))
+
+        rejudge_job = await rejudge(problem)
+        self.assertFalse(rejudge_job.selective)
+        self.assertEqual(rejudge_job.total, 3)
+        self.assertEqual(await rejudge_job.get_remaining(), 3)
+        self.assertEqual(await get_count(), 4)
+
+        # The submission goes first.
+        job = await run(claim, 'foo', 60, 1)
+        self.assertEqual(job.challenge.uid, pending.uid)
+        self.assertIsNone(job.rejudge)
+
+        job = await run(claim, 'foo', 60, 1)
+        self.assertEqual(job.challenge.uid, done_challenges[0])
+        self.assertEqual(job.rejudge, rejudge_job.uid)
+        self.assertIsNone(job.code_path)
+
+        # Reach the limit of running rejudge jobs.
+        self.assertIsNone(await run(claim, 'foo', 60, 1))
+
+        self.assertTrue(await run(finish, job))
+        self.assertEqual(await rejudge_job.get_remaining(), 2)
+
+        rejudge_job = await get_rejudge(rejudge_job.uid)
+        self.assertEqual(rejudge_job.problem.uid, problem.uid)
+        self.assertEqual(rejudge_job.total, 3)
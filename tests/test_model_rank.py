@@ -0,0 +1,167 @@
+'''Rank model unittest'''
+
+
+import tests
+import model.user
+import model.proset
+import model.scoring
+import model.problem
+import model.challenge
+from model.user import UserCategory
+from model.challenge import JudgeResult
+from model import model_context
+from model.rank import *
+from tests.test_model_scoring import judge
+from unittest import TestCase
+
+
+@model_context
+async def query(proset, problem_uids, ctx=None):
+    '''List the rankers without the cache.'''
+
+    category = UserCategory(proset.metadata['category'])
+    partial_list = await query_list(proset.uid, category, problem_uids,
+        conn=ctx.conn)
+
+    return [(ranker['user'].uid, ranker['user'].name, ranker['rate'],
+        ranker['position'], ranker['results'])
+        for ranker in partial_list['data']]
+
+
+async def load(proset, problem_uids):
+    '''List the rankers with the cache.'''
+
+    partial_list = await get_list(proset, problem_uids)
+
+    return [(ranker['user'].uid, ranker['user'].name, ranker['rate'],
+        ranker['position'], ranker['results'])
+        for ranker in partial_list['data']]
+
+
+class TestBasic(TestCase):
+    '''Basic unittest.'''
+
+    @tests.async_test
+    async def test_list(self):
+        '''Test list and position.'''
+
+        users = []
+        for idx in range(5):
+            users.append(await model.user.create('user{}'.format(idx), '1234',
+                'User{}'.format(idx), category=UserCategory.algo))
+
+        await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.clang)
+
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        await model.scoring.refresh()
+
+        partial_list = await get_list(proset, [])
+        self.assertEqual(partial_list['count'], 5)
+        self.assertEqual([ranker['user'].uid for ranker
+            in partial_list['data']], [user.uid for user in users])
+
+        partial_list = await get_list(proset, [], offset=2, limit=2)
+        self.assertEqual(partial_list['count'], 5)
+        self.assertEqual([ranker['position'] for ranker
+            in partial_list['data']], [3, 4])
+
+        position = await get_position(proset, users[3])
+        self.assertEqual(position['position'], 4)
+        self.assertEqual(position['rate'], 0)
+
+
+class TestCache(TestCase):
+    '''Leaderboard cache unittest.'''
+
+    @tests.async_test
+    async def test_update(self):
+        '''Test the cache follows the scoring updates.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'score': 100,
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        self.assertIsNotNone(await proset.add(problem, False))
+        await model.scoring.change_problem(problem.uid)
+
+        AC = JudgeResult.STATUS_AC
+        WA = JudgeResult.STATUS_WA
+        await judge(self, bar, problem, [WA, WA])
+
+        # Build the cache.
+        self.assertEqual(await load(proset, [problem.uid]),
+            await query(proset, [problem.uid]))
+
+        await judge(self, foo, problem, [AC, WA])
+        await judge(self, bar, problem, [AC, AC])
+        self.assertEqual(await load(proset, [problem.uid]),
+            await query(proset, [problem.uid]))
+
+        position = await get_position(proset, bar)
+        self.assertEqual(position['position'], 1)
+        self.assertGreater(position['rate'], 0)
+
+        await invalidate(UserCategory.algo)
+        self.assertEqual(await load(proset, [problem.uid]),
+            await query(proset, [problem.uid]))
+
+    @tests.async_test
+    async def test_incremental(self):
+        '''Test only the affected users are written into the cache.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'score': 100,
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        self.assertIsNotNone(await proset.add(problem, False))
+        await model.scoring.change_problem(problem.uid)
+
+        # Build the cache.
+        self.assertEqual(await load(proset, [problem.uid]),
+            await query(proset, [problem.uid]))
+
+        # Bar doesn't submit, so the cached profile isn't rebuilt.
+        bar.name = 'Baz'
+        self.assertTrue(await bar.update())
+
+        AC = JudgeResult.STATUS_AC
+        challenge = await judge(self, foo, problem, [AC, AC])
+
+        cached = await load(proset, [problem.uid])
+        rankers = await query(proset, [problem.uid])
+        self.assertEqual(cached[0], rankers[0])
+        self.assertEqual(cached[0][0], foo.uid)
+        self.assertGreater(cached[0][2], 0)
+        self.assertEqual(cached[1][1], 'Bar')
+        self.assertEqual(rankers[1][1], 'Baz')
+
+        # The best result is gone with the removed challenge.
+        self.assertTrue(await challenge.remove())
+        cached = await load(proset, [problem.uid])
+        self.assertEqual([ranker[2:] for ranker in cached],
+            [ranker[2:] for ranker in await query(proset, [problem.uid])])
@@ -0,0 +1,342 @@
+'''Scoring model unittest'''
+
+
+import tests
+import model.user
+import model.problem
+import model.proset
+import model.challenge
+import model.scoring
+from model.user import UserCategory
+from model.challenge import JudgeState, JudgeResult
+from model import model_context
+from model.scoring import *
+from unittest import TestCase
+
+
+@model_context
+async def dump(ctx=None):
+    '''Dump all rate counts and rate scores.'''
+
+    counts = []
+    async for rate_count in await (RateCountModel.select()
+            .order_by(RateCountModel.category, RateCountModel.problem_uid,
+                RateCountModel.index)
+            .execute(ctx.conn)):
+        counts.append((rate_count.category, rate_count.problem_uid,
+            rate_count.index, rate_count.count, rate_count.score))
+
+    scores = []
+    async for rate_score in await (RateScoreModel.select()
+            .order_by(RateScoreModel.category, RateScoreModel.user_uid,
+                RateScoreModel.problem_uid, RateScoreModel.index)
+            .execute(ctx.conn)):
+        scores.append((rate_score.category, rate_score.user_uid,
+            rate_score.problem_uid, rate_score.index, rate_score.score))
+
+    return (counts, scores)
+
+
+@model_context
+async def dump_scores(ctx=None):
+    '''Dump all user scores.'''
+
+    scores = []
+    async for user_score in await (UserScoreModel.select()
+            .order_by(UserScoreModel.user_uid, UserScoreModel.proset_uid)
+            .execute(ctx.conn)):
+        scores.append((user_score.user_uid, user_score.proset_uid,
+            user_score.score))
+
+    return scores
+
+
+async def judge(test, user, problem, results):
+    '''Create a challenge and finish it with the results.'''
+
+    challenge = await model.challenge.create(user, problem)
+    test.assertIsNotNone(challenge)
+
+    for idx, result in enumerate(results):
+        test.assertTrue(await challenge.update_subtask(idx, JudgeState.done, {
+            'result': result,
+            'runtime': 0,
+            'memory': 0,
+            'verdict': [],
+        }))
+
+    return challenge
+
+
+async def check_refresh(test):
+    '''Check the incremental update matches the full refresh.'''
+
+    incremental = (await dump(), await dump_scores())
+    await refresh()
+    test.assertEqual(incremental, (await dump(), await dump_scores()))
+
+
+async def create_problem(test, uid, *prosets):
+    '''Create a problem and add it to the problem sets.'''
+
+    problem = await model.problem.create(uid, 'deadbeef', {
+        'name': str(uid),
+        'score': 100,
+        'test': [
+            { 'data': [1, 2], 'weight': 60 },
+            { 'data': [3], 'weight': 40 },
+        ]
+    })
+    for proset in prosets:
+        test.assertIsNotNone(await proset.add(problem, False))
+
+    await change_problem(problem.uid)
+    return problem
+
+
+class TestIncremental(TestCase):
+    '''Incremental scoring unittest.'''
+
+    @tests.async_test
+    async def test_match_refresh(self):
+        '''Test the incremental update matches the full refresh.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'score': 100,
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        self.assertIsNotNone(await proset.add(problem, False))
+        await change_problem(problem.uid)
+
+        AC = JudgeResult.STATUS_AC
+        WA = JudgeResult.STATUS_WA
+        await judge(self, foo, problem, [AC, WA])
+        await judge(self, bar, problem, [AC, AC])
+        await judge(self, foo, problem, [AC, AC])
+        await judge(self, foo, problem, [WA, AC])
+
+        incremental = await dump()
+        self.assertGreater(len(incremental[0]), 0)
+        self.assertGreater(len(incremental[1]), 0)
+
+        await refresh()
+        self.assertEqual(incremental, await dump())
+
+        for user in [foo, bar]:
+            for spec_proset_uid in [None, proset.uid]:
+                self.assertEqual(
+                    await get_user_rate(user, spec_proset_uid),
+                    await get_user_score(user,
+                        spec_proset_uid=spec_proset_uid))
+
+    @tests.async_test
+    async def test_proset_rate(self):
+        '''Test the scores of each problem set.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        first = await model.proset.create('first', False, {
+            'category': int(UserCategory.algo)
+        })
+        second = await model.proset.create('second', False, {
+            'category': int(UserCategory.algo)
+        })
+        square = await create_problem(self, 1000, first)
+        cube = await create_problem(self, 1001, first, second)
+
+        AC = JudgeResult.STATUS_AC
+        WA = JudgeResult.STATUS_WA
+        await judge(self, foo, square, [AC, AC])
+        await judge(self, bar, cube, [AC, WA])
+        await judge(self, foo, cube, [WA, AC])
+
+        for user in [foo, bar]:
+            for spec_proset_uid in [None, first.uid, second.uid]:
+                self.assertEqual(
+                    await get_user_rate(user, spec_proset_uid),
+                    await get_user_score(user,
+                        spec_proset_uid=spec_proset_uid))
+
+        # Square only counts in the first problem set.
+        self.assertGreater(await get_user_rate(foo, first.uid),
+            await get_user_rate(foo, second.uid))
+        self.assertEqual(await get_user_rate(bar, first.uid),
+            await get_user_rate(bar, second.uid))
+
+        await check_refresh(self)
+
+    @tests.async_test
+    async def test_change_category(self):
+        '''Test moving a user to another category.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        problem = await create_problem(self, 1000, proset)
+
+        AC = JudgeResult.STATUS_AC
+        await judge(self, foo, problem, [AC, AC])
+        await judge(self, bar, problem, [AC, AC])
+        self.assertGreater(await get_user_rate(foo), 0)
+
+        foo.category = UserCategory.clang
+        self.assertTrue(await foo.update())
+        await change_category(UserCategory.algo, UserCategory.clang)
+
+        # The statistic score of the clang problem sets.
+        self.assertEqual(await get_user_rate(foo),
+            await get_user_score(foo))
+        self.assertEqual(await get_user_rate(bar),
+            await get_user_score(bar))
+
+        await check_refresh(self)
+
+    @tests.async_test
+    async def test_remove(self):
+        '''Test removing challenges, items and problems.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        square = await create_problem(self, 1000, proset)
+        cube = await create_problem(self, 1001, proset)
+
+        AC = JudgeResult.STATUS_AC
+        challenge = await judge(self, foo, square, [AC, AC])
+        await judge(self, bar, square, [AC, AC])
+        await judge(self, foo, cube, [AC, AC])
+        await judge(self, bar, cube, [AC, AC])
+
+        # Foo has no other challenges of square.
+        self.assertTrue(await challenge.remove())
+        self.assertEqual(await get_user_rate(foo),
+            await get_user_score(foo))
+        await check_refresh(self)
+
+        proitem = (await proset.list(hidden=True))[0]
+        self.assertTrue(await proitem.remove())
+        await change_problem(proitem.problem.uid, removed=True)
+        for user in [foo, bar]:
+            self.assertEqual(await get_user_rate(user, proset.uid),
+                await get_user_score(user, spec_proset_uid=proset.uid))
+        await check_refresh(self)
+
+        self.assertTrue(await cube.remove())
+        for user in [foo, bar]:
+            self.assertEqual(await get_user_rate(user),
+                await get_user_score(user))
+        await check_refresh(self)
+
+
+class TestScheduler(TestCase):
+    '''Scoring scheduler unittest.'''
+
+    def test_merge(self):
+        '''Test merging invalidations.'''
+
+        scheduler = ScoringScheduler(None, 0, 1)
+
+        scheduler.schedule(UserCategory.algo, 1000, ScoringJob({0}))
+        scheduler.schedule(UserCategory.algo, 1000, ScoringJob({1}))
+        scheduler.schedule(UserCategory.clang, 1000, ScoringJob({1}))
+        self.assertEqual(len(scheduler.pending), 2)
+        self.assertEqual(scheduler.pending[(UserCategory.algo, 1000)].indices,
+            {0, 1})
+
+        scheduler.schedule(UserCategory.algo, 1000)
+        job = scheduler.pending[(UserCategory.algo, 1000)]
+        self.assertIsNone(job.indices)
+
+        scheduler.schedule(UserCategory.clang, 1000,
+            ScoringJob(user_uids={7}, removed=True))
+        job = scheduler.pending[(UserCategory.clang, 1000)]
+        self.assertIsNone(job.indices)
+        self.assertEqual(job.user_uids, {7})
+        self.assertTrue(job.removed)
+
+        scheduler.schedule(UserCategory.algo, 1001)
+        scheduler.schedule(UserCategory.algo)
+        scheduler.schedule(UserCategory.algo, 1002)
+        self.assertEqual(set(scheduler.pending.keys()), {
+            (UserCategory.algo, None),
+            (UserCategory.clang, 1000),
+        })
+        self.assertEqual(scheduler.status()['pending'], 2)
+
+    @tests.async_test
+    async def test_drain(self):
+        '''Test the worker drains overlapping updates.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo',
+            category=UserCategory.algo)
+        bar = await model.user.create('bar', '1234', 'Bar',
+            category=UserCategory.algo)
+        proset = await model.proset.create('square', False, {
+            'category': int(UserCategory.algo)
+        })
+        square = await create_problem(self, 1000, proset)
+        cube = await create_problem(self, 1001, proset)
+
+        scheduler = ScoringScheduler(tests.engine, 0.1, 2, tests.redis_pool)
+        scheduler.start()
+        model.scoring.scheduler = scheduler
+        try:
+            AC = JudgeResult.STATUS_AC
+            WA = JudgeResult.STATUS_WA
+            await judge(self, foo, square, [AC, WA])
+            await judge(self, bar, square, [AC, AC])
+            await judge(self, foo, cube, [WA, AC])
+
+            # Overlap the problem updates with the whole category.
+            scheduler.schedule(UserCategory.algo, square.uid, ScoringJob({0}))
+            scheduler.schedule(UserCategory.algo, square.uid, ScoringJob({1}))
+            scheduler.schedule(UserCategory.algo)
+            scheduler.schedule(UserCategory.algo, cube.uid)
+            # A broken job fails without stopping the worker.
+            scheduler.schedule('broken')
+            await scheduler.join()
+
+            await judge(self, bar, cube, [AC, AC])
+            await scheduler.join()
+
+            status = scheduler.status()
+            self.assertEqual(status['pending'], 0)
+            self.assertEqual(status['running'], 0)
+            self.assertGreater(status['merged'], 0)
+            self.assertGreater(status['done'], 0)
+            self.assertGreater(status['failed'], 0)
+        finally:
+            model.scoring.scheduler = None
+            await scheduler.stop()
+
+        self.assertIsNone(scheduler.worker)
+
+        for user in [foo, bar]:
+            for spec_proset_uid in [None, proset.uid]:
+                self.assertEqual(
+                    await get_user_rate(user, spec_proset_uid),
+                    await get_user_score(user,
+                        spec_proset_uid=spec_proset_uid))
+
+        await check_refresh(self)
@@ -0,0 +1,70 @@
+'''Verdict cache model unittest'''
+
+
+import tests
+import config
+import model.user
+import model.problem
+import model.challenge
+from model.challenge import JudgeState, JudgeResult
+from model.verdict import *
+from unittest import TestCase
+
+
+class TestCache(TestCase):
+    '''Cache unittest.'''
+
+    def setUp(self):
+        '''Set the cache policy.'''
+
+        self.policy = config.JUDGE_CACHE
+        config.JUDGE_CACHE = 'ce'
+
+    def tearDown(self):
+        '''Restore the cache policy.'''
+
+        config.JUDGE_CACHE = self.policy
+
+    @tests.async_test
+    async def test_replay(self):
+        '''Test replay the cached compile errors.'''
+
+        user = await model.user.create('foo', '1234', 'Foo')
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+                { 'data': [3], 'weight': 40 },
+            ]
+        })
+
+        fp = fingerprint('int main() {', problem)
+        self.assertNotEqual(fingerprint('int main() {}', problem), fp)
+        self.assertIsNone(await lookup(fp))
+
+        challenge = await model.challenge.create(user, problem)
+        self.assertTrue(await challenge.update_subtasks([
+            (idx, JudgeState.done, {
+                'result': JudgeResult.STATUS_CE,
+                'runtime': 0,
+                'memory': 0,
+                'verdict': ['error'],
+            }) for idx in range(2)
+        ]))
+        self.assertTrue(await store(fp, challenge))
+
+        results = await lookup(fp)
+        self.assertEqual([(idx, state) for idx, state, metadata in results],
+            [(0, JudgeState.done), (1, JudgeState.done)])
+
+        challenge = await model.challenge.create(user, problem)
+        self.assertTrue(await challenge.update_subtasks(results))
+        self.assertEqual(challenge.state, JudgeState.done)
+        self.assertEqual(challenge.metadata['verdict'], 'error')
+
+        self.assertEqual(await get_stat(), { 'hit': 1, 'miss': 1 })
+
+        # Only compile errors are cached.
+        self.assertFalse(is_cacheable(JudgeResult.STATUS_AC))
+        self.assertTrue(is_cacheable(JudgeResult.STATUS_AC, 'all'))
+        self.assertFalse(is_cacheable(JudgeResult.STATUS_ERR, 'all'))
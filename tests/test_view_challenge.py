@@ -0,0 +1,70 @@
+'''Challenge API unittest'''
+
+
+import tests
+import config
+import model.user
+import model.problem
+import model.challenge
+import model.code
+from unittest import TestCase
+
+
+class TestCode(TestCase):
+    '''Code unittest.'''
+
+    def setUp(self):
+        '''Enable x-accel-redirect.'''
+
+        self.accel = config.CODE_ACCEL
+        config.CODE_ACCEL = True
+
+    def tearDown(self):
+        '''Restore the config.'''
+
+        config.CODE_ACCEL = self.accel
+
+    @tests.async_test
+    async def test_accel(self):
+        '''Test serve the code through x-accel-redirect.'''
+
+        admin = await model.user.create('admin', '1234', 'Admin',
+            level=model.user.UserLevel.kernel)
+        problem = await model.problem.create(1000, 'deadbeef', {
+            'name': 'foo',
+            'test': [
+                { 'data': [1, 2], 'weight': 60 },
+            ]
+        })
+        code_hash = model.code.put('int main() {}')
+        challenge = await model.challenge.create(admin, problem, code_hash)
+
+        api_url = 'http://localhost:7000/challenge/{}/code'.format(
+            challenge.uid)
+        async with tests.http_session.get(api_url) as response:
+            self.assertEqual(response.status, 404)
+
+        response = await tests.request('/user/login', {
+            'mail': 'admin',
+            'password': '1234'
+        })
+        self.assertEqual(response, 'Success')
+
+        response = await tests.request(
+            '/challenge/{}/get'.format(challenge.uid), {})
+        self.assertNotIn('code', response)
+        self.assertEqual(response['code_url'],
+            '/challenge/{}/code'.format(challenge.uid))
+
+        # Code which isn't cached is sent directly.
+        async with tests.http_session.get(api_url) as response:
+            self.assertEqual(response.status, 200)
+            self.assertNotIn('x-accel-redirect', response.headers)
+            self.assertEqual(await response.text(), 'int main() {}')
+        self.assertIsNone(model.code.get_cached(challenge))
+
+        model.code.materialize(challenge)
+        async with tests.http_session.get(api_url) as response:
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.headers['x-accel-redirect'],
+                '/internal/code/cache/{}/main.cpp'.format(code_hash))
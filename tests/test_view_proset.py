@@ -3,6 +3,9 @@
 
 import tests
 import model.user
+import model.problem
+import model.proset
+from view.proset import get_hidden_problems, is_problem_hidden
 from unittest import TestCase
 
 
@@ -164,3 +167,38 @@ class TestBasic(TestCase):
                     'lang': 'c++',
                 })
             self.assertNotEqual(response, 'Error')
+
+
+class TestVisibility(TestCase):
+    '''Problem visibility unittest.'''
+
+    @tests.async_test
+    async def test_hidden_problems(self):
+        '''Test resolve the hidden problems at once.'''
+
+        admin = await model.user.create('admin', '1234', 'Admin',
+            level=model.user.UserLevel.kernel)
+        user = await model.user.create('foo', '1234', 'Foo')
+
+        problems = []
+        for uid in range(1000, 1004):
+            problems.append(await model.problem.create(uid, 'deadbeef', {
+                'name': 'foo',
+                'test': [
+                    { 'data': [1], 'weight': 100 },
+                ]
+            }))
+
+        visible_set = await model.proset.create('visible', False)
+        hidden_set = await model.proset.create('hidden', True)
+        await visible_set.add(problems[0], hidden=False)
+        await visible_set.add(problems[1], hidden=True)
+        await hidden_set.add(problems[2], hidden=False)
+
+        problem_uids = [problem.uid for problem in problems]
+        self.assertEqual(await get_hidden_problems(user, problem_uids),
+            set(problem_uids[1:]))
+        self.assertEqual(await get_hidden_problems(admin, problem_uids),
+            set())
+        self.assertFalse(await is_problem_hidden(None, problem_uids[0]))
+        self.assertTrue(await is_problem_hidden(None, problem_uids[3]))
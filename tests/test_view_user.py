@@ -3,6 +3,9 @@
 
 import tests
 import model.user
+import model.problem
+import model.challenge
+from model.challenge import JudgeState, JudgeResult
 from unittest import TestCase
 
 
@@ -220,3 +223,39 @@ class TestList(TestCase):
         response = await tests.request('/user/list', {})
         self.assertNotEqual(response, 'Error')
         self.assertEqual(len(response), 2)
+
+
+class TestStatistic(TestCase):
+    '''Statistic unittest.'''
+
+    @tests.async_test
+    async def test_statistic(self):
+        '''Test the statistic of the tried problems.'''
+
+        foo = await model.user.create('foo', '1234', 'Foo')
+        problems = []
+        for uid in [1000, 1001]:
+            problems.append(await model.problem.create(uid, 'deadbeef', {
+                'name': 'foo',
+                'score': 100,
+                'test': [
+                    { 'data': [1, 2], 'weight': 60 },
+                ]
+            }))
+
+        challenge = await model.challenge.create(foo, problems[0])
+        self.assertTrue(await challenge.update_subtask(0, JudgeState.done, {
+            'result': JudgeResult.STATUS_AC,
+            'runtime': 0,
+            'memory': 0,
+            'verdict': [],
+        }))
+        # The pending challenge isn't counted.
+        await model.challenge.create(foo, problems[1])
+
+        # The problems aren't in any problem set, but still counted.
+        response = await tests.request(
+            '/user/{}/statistic'.format(foo.uid), {})
+        self.assertEqual(response['tried_problems'], {
+            '1000': { 'result': int(JudgeResult.STATUS_AC) },
+        })
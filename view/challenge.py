@@ -2,70 +2,64 @@
 
 
 import config
+import model.problem
 import model.challenge
+import model.job
+import model.code
+import model.verdict
 import view.proset
 import os
-import json
 import enum
 import asyncio
-import aiohttp
 from datetime import datetime
 from model.user import UserLevel
-from model.challenge import JudgeState
+from model.challenge import ChallengeModel
 from .interface import *
-from . import APIHandler, Attribute, Interface, worker_context
+from . import APIHandler, Attribute, Interface
 
 
-@worker_context
-async def emit_challenge(challenge, code_path):
-    '''Emit the challenge and update the results.
+async def emit_challenge(challenge, code_path, code=None):
+    '''Queue the challenge for the judge dispatchers.
+
+    With the code, the cached verdicts of the same code and problem revision
+    are replayed instead.
 
     Args:
         challenge (ChallengeModel): Challenge.
-        code_path (string): File path of the code.
+        code_path (string | None): File path of the code, None to materialize
+            the stored code on the dispatcher.
+        code (string) optional: Code.
+
+    Returns:
+        True | False
 
     '''
 
-    problem = challenge.problem
-    code_path = os.path.abspath(code_path)
-    res_path = os.path.abspath(
-        os.path.join(config.PROBLEM_DIR, '{}/res'.format(problem.uid)))
-    code_path = code_path[len('/home/sptoj'):]
-    res_path = res_path[len('/home/sptoj'):]
-
-    tests = []
-    for idx, test in enumerate(problem.metadata['test']):
-        tests.append({
-            'test_idx': idx,
-            'timelimit': problem.metadata['timelimit'],
-            'memlimit': problem.metadata['memlimit'] * 1024,
-            'metadata': { 'data': test['data'] }
-        })
-        await challenge.update_subtask(idx, JudgeState.running)
-
-    data = {
-        'chal_id': challenge.uid,
-        'code_path': code_path,
-        'res_path': res_path,
-        'comp_type': problem.metadata['compile'],
-        'check_type': problem.metadata['check'],
-        'metadata': problem.metadata.get('metadata', {}),
-        'test': tests,
-    }
-
-    api_url = config.JUDGE_URL + '/reqjudge'
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(api_url, data=json.dumps(data)) as response:
-            results = (await response.json())['result']
-            for result in results:
-                await challenge.update_subtask(result['test_idx'],
-                    JudgeState.done, {
-                        'result': result['state'],
-                        'runtime': result['runtime'],
-                        'memory': result['peakmem'] / 1024,
-                        'verdict': result['verdict'],
-                    })
+    fingerprint = None
+    if code is not None and config.JUDGE_CACHE != 'off':
+        fingerprint = model.verdict.fingerprint(code, challenge.problem)
+        results = await model.verdict.lookup(fingerprint)
+        if results is not None:
+            return await challenge.update_subtasks(results)
+
+    return await model.job.push(challenge, code_path,
+        fingerprint=fingerprint) is not None
+
+
+def is_code_viewable(user, challenge):
+    '''Check if the user can view the code and verdicts of the challenge.
+
+    Args:
+        user (UserModel): User.
+        challenge (ChallengeModel): Challenge.
+
+    Returns:
+        True | False
+
+    '''
+
+    return user is not None and (user.uid == challenge.submitter.uid or
+        user.level <= UserLevel.kernel)
 
 
 class GetHandler(APIHandler):
@@ -78,6 +72,9 @@ class GetHandler(APIHandler):
             uid (int): Challenge ID.
             data (object): {}
 
+        With config.CODE_ACCEL, the code is omitted and served by
+        CodeHandler instead.
+
         Returns:
             ChallengeInterface | 'Error'
 
@@ -97,40 +94,69 @@ class GetHandler(APIHandler):
         if subtasks is None:
             return 'Error'
 
-        viewall = False
-        if self.user is not None and (
-                self.user.uid == challenge.submitter.uid or
-                self.user.level <= UserLevel.kernel):
-            viewall = True
+        viewall = is_code_viewable(self.user, challenge)
 
+        code = None
+        code_url = None
         if viewall:
-            loop = asyncio.get_event_loop()
-            task = loop.run_in_executor(None, GetHandler.load_code,
-                challenge.uid)
-            code = await task
-        else:
-            code = None
+            if config.CODE_ACCEL:
+                code_url = '/challenge/{}/code'.format(challenge.uid)
+            else:
+                loop = asyncio.get_event_loop()
+                task = loop.run_in_executor(None, model.code.load, challenge)
+                code = await task
 
-        return ChallengeInterface(challenge, subtasks, code, not viewall)
+        return ChallengeInterface(challenge, subtasks, code, not viewall,
+            code_url)
 
-    def load_code(challenge_uid):
-        '''Load the submitted code.
 
-        Args:
-            challenge_uid (int): Challenge ID.
+class CodeHandler(APIHandler):
+    '''Serve the submitted code.'''
 
-        Returns:
-            String | None
+    async def retrieve(self, uid):
+        '''Process the request.
+
+        The cached plain file of the code is sent by the front server through
+        x-accel-redirect. Otherwise the stored code is decompressed and sent
+        directly, so browsing the old challenges doesn't fill the cache.
+
+        Args:
+            uid (int): Challenge ID.
 
         '''
 
-        code_root = os.path.join(config.CODE_DIR, '{}'.format(challenge_uid))
-        code_main = os.path.join(code_root, 'main.cpp')
-        try:
-            with open(code_main, 'r') as main_file:
-                return main_file.read()
-        except:
-            return None
+        uid = int(uid)
+
+        challenge = await model.challenge.get(uid)
+        if challenge is None or not is_code_viewable(self.user, challenge):
+            self.set_status(404)
+            return
+
+        if await view.proset.is_problem_hidden(self.user,
+                challenge.problem.uid):
+            self.set_status(404)
+            return
+
+        loop = asyncio.get_event_loop()
+        code_path = await loop.run_in_executor(None, model.code.get_cached,
+            challenge)
+        if code_path is not None:
+            rel_path = os.path.relpath(code_path, config.CODE_DIR)
+            self.set_header('content-type', 'text/plain; charset=utf-8')
+            self.set_header('x-accel-redirect',
+                '/internal/code/{}'.format(rel_path))
+
+            self.set_status(200)
+            return
+
+        code = await loop.run_in_executor(None, model.code.load, challenge)
+        if code is None:
+            self.set_status(404)
+            return
+
+        self.set_header('content-type', 'text/plain; charset=utf-8')
+        self.set_status(200)
+        self.write(code)
 
 
 class ListHandler(APIHandler):
@@ -179,17 +205,21 @@ class ListHandler(APIHandler):
             user_uid=filter_user_uid,
             problem_uid=filter_problem_uid,
             result=filter_result,
-            limit=100)
+            limit=100,
+            defer=(ChallengeModel.submitter.password,
+                ChallengeModel.submitter.metadata))
         if partial_list is None:
             return 'Error'
 
         count = partial_list['count']
         challenges = partial_list['data']
 
+        hidden_uids = await view.proset.get_hidden_problems(self.user,
+            [challenge.problem.uid for challenge in challenges])
+
         ret = []
         for challenge in challenges:
-            problem = challenge.problem
-            if await view.proset.is_problem_hidden(self.user, problem.uid):
+            if challenge.problem.uid in hidden_uids:
                 ret.append(None)
             else:
                 ret.append(ChallengeInterface(challenge))
@@ -205,13 +235,18 @@ class RejudgeHandler(APIHandler):
     async def process(self, data=None):
         '''Process the request.
 
+        The challenges are queued as a background rejudge with a lower
+        priority than the submissions.
+
         Args:
             data (object): {
-                problem_uid (int) optional
+                problem_uid (int) optional,
+                selective (bool) optional: Only judge the subtasks whose
+                    tests changed, default to judge all subtasks.
             }
 
         Returns:
-            'Success' | 'Error'
+            RejudgeInterface | 'Error'
 
         '''
 
@@ -222,25 +257,44 @@ class RejudgeHandler(APIHandler):
         if problem_uid is None:
             return 'Error'
 
-        partial_list = await model.challenge.get_list(problem_uid=problem_uid,
-            state=JudgeState.done)
-        if partial_list is None:
+        problem = await model.problem.get(problem_uid)
+        if problem is None:
             return 'Error'
 
-        challenges = partial_list['data']
-        for challenge in challenges:
-            # Reset the challenge.
-            await challenge.reset()
+        selective = bool(data.get('selective', False))
+
+        rejudge = await model.job.rejudge(problem, selective)
+        if rejudge is None:
+            return 'Error'
+
+        return RejudgeInterface(rejudge, rejudge.total)
+
+
+class RejudgeStatusHandler(APIHandler):
+    '''Rejudge status handler.'''
+
+    level = UserLevel.kernel
 
-            # Get code path.
-            code_root = os.path.join(config.CODE_DIR,
-                '{}'.format(challenge.uid))
-            code_path = os.path.join(code_root, 'main.cpp')
+    async def process(self, uid, data=None):
+        '''Process the request.
+
+        Args:
+            uid (int): Rejudge ID.
+            data (object): {}
+
+        Returns:
+            RejudgeInterface | 'Error'
 
-            # Emit the challange worker and wait.
-            try:
-                await emit_challenge(challenge, code_path)
-            except:
-                pass
+        '''
+
+        uid = int(uid)
+
+        rejudge = await model.job.get_rejudge(uid)
+        if rejudge is None:
+            return 'Error'
+
+        remaining = await rejudge.get_remaining()
+        if remaining is None:
+            return 'Error'
 
-        return 'Success'
+        return RejudgeInterface(rejudge, remaining)
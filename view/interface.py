@@ -202,13 +202,15 @@ class ChallengeInterface(Interface):
     problem = Attribute()
     subtasks = Attribute(optional=True)
     code = Attribute(optional=True)
+    code_url = Attribute(optional=True)
 
     def __init__(self, challenge, subtasks=None, code=None,
-        hidden_verdict=True):
+        hidden_verdict=True, code_url=None):
         '''Initialize.
 
         Args:
             challenge (ChallengeModel): Challenge model.
+            code_url (string): URL to get the code if it's omitted.
 
         '''
 
@@ -233,6 +235,9 @@ class ChallengeInterface(Interface):
         if code is not None:
             self.code = code
 
+        if code_url is not None:
+            self.code_url = code_url
+
 
 class SubtaskInterface(Interface):
     '''Subtask view interface.'''
@@ -266,6 +271,7 @@ class RankerInterface(Interface):
     profile = Attribute()
     rate = Attribute()
     results = Attribute()
+    position = Attribute(optional=True)
 
     def __init__(self, data):
         '''Initialize.
@@ -275,6 +281,7 @@ class RankerInterface(Interface):
                 'user' (UserModel),
                 'rate' (int),
                 'results' ({ int: int, ... }),
+                'position' (int) optional,
             }
 
         '''
@@ -282,3 +289,79 @@ class RankerInterface(Interface):
         self.profile = ProfileInterface(data['user'])
         self.rate = data['rate']
         self.results = data['results']
+        if 'position' in data:
+            self.position = data['position']
+
+
+class RankPositionInterface(Interface):
+    '''Rank position interface.'''
+
+    rate = Attribute()
+    position = Attribute()
+    count = Attribute()
+
+    def __init__(self, data):
+        '''Initialize.
+
+        Args:
+            data (object): {
+                'rate' (int),
+                'position' (int),
+                'count' (int),
+            }
+
+        '''
+
+        self.rate = data['rate']
+        self.position = data['position']
+        self.count = data['count']
+
+
+class RejudgeInterface(Interface):
+    '''Rejudge interface.'''
+
+    uid = Attribute()
+    problem_uid = Attribute()
+    timestamp = Attribute()
+    total = Attribute()
+    remaining = Attribute()
+    selective = Attribute()
+
+    def __init__(self, rejudge, remaining):
+        '''Initialize.
+
+        Args:
+            rejudge (RejudgeModel): Rejudge model.
+            remaining (int): Number of remaining challenges.
+
+        '''
+
+        self.uid = rejudge.uid
+        self.problem_uid = rejudge.problem.uid
+        self.timestamp = rejudge.timestamp.isoformat()
+        self.total = rejudge.total
+        self.remaining = remaining
+        self.selective = rejudge.selective
+
+
+class JudgeStatusInterface(Interface):
+    '''Judge status interface.'''
+
+    count = Attribute()
+    dispatchers = Attribute()
+    cache = Attribute()
+
+    def __init__(self, count, dispatchers, cache):
+        '''Initialize.
+
+        Args:
+            count (int): Number of queued jobs.
+            dispatchers ([object]): Status of the dispatchers and their judge
+                endpoints.
+            cache (object): Hit and miss counters of the verdict cache.
+
+        '''
+
+        self.count = count
+        self.dispatchers = dispatchers
+        self.cache = cache
@@ -0,0 +1,104 @@
+'''Judge view module'''
+
+
+import judge
+import model.job
+import model.challenge
+import model.verdict
+from model.user import UserLevel
+from model.challenge import JudgeState
+from .interface import *
+from . import APIHandler
+
+
+class StatusHandler(APIHandler):
+    '''Judge status handler.'''
+
+    level = UserLevel.kernel
+
+    async def process(self, data=None):
+        '''Process the request.
+
+        Args:
+            data (object): {}
+
+        Returns:
+            JudgeStatusInterface | 'Error'
+
+        '''
+
+        count = await model.job.get_count()
+        if count is None:
+            return 'Error'
+
+        dispatchers = await model.job.get_dispatchers()
+        if dispatchers is None:
+            return 'Error'
+
+        cache = await model.verdict.get_stat()
+        if cache is None:
+            return 'Error'
+
+        return JudgeStatusInterface(count, dispatchers, cache)
+
+
+class ResultHandler(APIHandler):
+    '''Judge result callback handler.'''
+
+    async def process(self, uid, data):
+        '''Process the request.
+
+        Results can be posted per test or in batches. The judge job is removed
+        once the challenge is done.
+
+        Args:
+            uid (int): Challenge ID.
+            data (object): {
+                'job' (int),
+                'token' (string),
+                'result' ([{
+                    'test_idx' (int),
+                    'state' (int),
+                    'runtime' (int),
+                    'peakmem' (int),
+                    'verdict' ([string]),
+                }]),
+            }
+
+        Returns:
+            'Success' | 'Error'
+
+        '''
+
+        uid = int(uid)
+        try:
+            job_uid = int(data['job'])
+            token = str(data['token'])
+            results = judge.parse_results(data['result'])
+        except (KeyError, TypeError, ValueError):
+            return 'Error'
+
+        if not judge.verify(uid, job_uid, token):
+            return 'Error'
+
+        # The job is replaced after a rejudge.
+        job = await model.job.get(job_uid)
+        if job is None or job.challenge.uid != uid:
+            return 'Error'
+
+        challenge = await model.challenge.get(uid)
+        if challenge is None:
+            return 'Error'
+
+        # Callbacks of the same challenge are serialized by the row lock in
+        # update_subtasks, so the last one always sees the done state.
+        if not await challenge.update_subtasks(results):
+            return 'Error'
+
+        if challenge.state == JudgeState.done:
+            if job.fingerprint is not None:
+                await model.verdict.store(job.fingerprint, challenge)
+
+            await model.job.remove(job_uid)
+
+        return 'Success'
@@ -3,6 +3,7 @@
 
 import config
 import model.problem
+import model.code
 import model.scoring
 import view.proset
 import re
@@ -11,6 +12,7 @@ import stat
 import fcntl
 import json
 import binascii
+import hashlib
 import git
 import asyncio
 from model.user import UserLevel, UserCategory
@@ -71,6 +73,10 @@ class UpdateHandler(APIHandler):
 
         metadata['git'] = git_url
 
+        task = loop.run_in_executor(None, UpdateHandler.sign_tests, uid,
+            metadata)
+        await task
+
         if (await model.problem.create(uid, revision, metadata)) is None:
             return 'Error'
 
@@ -140,6 +146,61 @@ class UpdateHandler(APIHandler):
             fcntl.flock(lockfd, fcntl.LOCK_UN)
             os.close(lockfd)
 
+    def sign_tests(uid, metadata):
+        '''Store the signature of each test in the metadata.
+
+        A signature covers the test data, the limits, the judge options and
+        the other resources, so the tests with unchanged signatures needn't be
+        judged again. The data of a test are the blobs named {dataidx}.* in
+        res/testdata, or the whole res tree if the directory is missing.
+        Tests without signatures are always judged again.
+
+        Args:
+            uid (int): The problem ID.
+            metadata (object): Problem metadata.
+
+        '''
+
+        try:
+            problem_dir = os.path.join(config.PROBLEM_DIR, '{}'.format(uid))
+            repo = git.Repo(problem_dir)
+            res_tree = repo.heads.current.commit.tree / 'res'
+
+            data_blobs = None
+            resources = []
+            for item in res_tree:
+                if item.name == 'testdata' and item.type == 'tree':
+                    data_blobs = [(blob.name, blob.hexsha)
+                        for blob in item.traverse() if blob.type == 'blob']
+                else:
+                    resources.append((item.name, item.hexsha))
+
+            judge_options = {
+                'timelimit': metadata.get('timelimit'),
+                'memlimit': metadata.get('memlimit'),
+                'compile': metadata.get('compile'),
+                'check': metadata.get('check'),
+                'metadata': metadata.get('metadata', {}),
+                'resources': sorted(resources),
+            }
+
+            for test in metadata['test']:
+                if data_blobs is None:
+                    data = res_tree.hexsha
+                else:
+                    data = [sorted((name, hexsha) for name, hexsha
+                            in data_blobs
+                            if name.split('.', 1)[0] == str(dataidx))
+                        for dataidx in test['data']]
+
+                content = json.dumps({ 'options': judge_options, 'data': data },
+                    sort_keys=True)
+                test['signature'] = hashlib.sha1(
+                    content.encode('utf-8')).hexdigest()
+        except:
+            for test in metadata.get('test', []):
+                test['signature'] = None
+
     async def load_problem(self, uid):
         '''Try to load the problem.
 
@@ -320,41 +381,19 @@ class SubmitHandler(APIHandler):
         if problem is None:
             return 'Error'
 
-        challenge = await model.challenge.create(self.user, problem)
+        loop = asyncio.get_event_loop()
+        task = loop.run_in_executor(None, model.code.put, code)
+        code_hash = await task
+        if code_hash is None:
+            return 'Error'
+
+        challenge = await model.challenge.create(self.user, problem, code_hash)
         if challenge is None:
             return 'Error'
 
-        loop = asyncio.get_event_loop()
-        task = loop.run_in_executor(None, SubmitHandler.store_code,
-            challenge.uid, code)
-        code_path = await task
-        if code_path is None:
+        # Queue the challenge, the dispatcher materializes the code.
+        if not await view.challenge.emit_challenge(challenge, None, code):
             await challenge.remove()
             return 'Error'
 
-        # Emit the challange worker.
-        view.challenge.emit_challenge(challenge, code_path)
-
         return challenge.uid
-
-    def store_code(challenge_uid, code):
-        '''Store the submitted code.
-
-        Args:
-            challenge_uid (int): Challenge ID.
-            code (string): Code.
-
-        Returns:
-            String | None
-
-        '''
-
-        code_root = os.path.join(config.CODE_DIR, '{}'.format(challenge_uid))
-        code_main = os.path.join(code_root, 'main.cpp')
-        try:
-            os.mkdir(code_root, mode=0o755)
-            with open(code_main, 'w') as main_file:
-                main_file.write(code)
-                return code_main
-        except:
-            return None
@@ -10,9 +10,10 @@ import view.challenge
 import os
 import asyncio
 from datetime import datetime
-from model import model_context
+from model import model_context, select
 from model.user import UserLevel, UserCategory
-from model.proset import ProItemModel
+from model.problem import ProblemModel
+from model.proset import ProSetModel, ProItemModel
 from .interface import *
 from . import APIHandler, Attribute, Interface
 
@@ -68,25 +69,53 @@ async def get_proitem(user, proset_uid, proitem_uid):
 
 
 @model_context
-async def is_problem_hidden(user, problem_uid, ctx):
-    '''Check if the problem is hidden.
+async def get_hidden_problems(user, problem_uids, ctx):
+    '''Get the hidden problems among the problems in one query.
+
+    A problem is visible if it's in any visible item of a visible problem set.
+
+    Args:
+        user (UserModel): User.
+        problem_uids ([int]): Problem IDs.
 
     Returns:
-        True | False
+        Set of the hidden problem IDs.
 
     '''
 
+    problem_uids = set(problem_uids)
+    if len(problem_uids) == 0:
+        return set()
+
     if user is not None and user.level <= UserLevel.kernel:
-        return False
+        return set()
 
     try:
-        query = (ProItemModel.select()
-            .where((ProItemModel.problem.uid == problem_uid) &
-                (ProItemModel.hidden == False) &
-                (ProItemModel.parent.hidden == False)))
-        return (await query.execute(ctx.conn)).rowcount == 0
+        query = (select([ProblemModel.uid])
+            .select_from(ProItemModel.join(ProblemModel).join(ProSetModel))
+            .where(ProblemModel.uid.in_(list(problem_uids)))
+            .where(ProItemModel.hidden == False)
+            .where(ProSetModel.hidden == False)
+            .distinct())
+
+        visible_uids = set()
+        async for result in await query.execute(ctx.conn):
+            visible_uids.add(result.uid)
+
+        return problem_uids - visible_uids
     except:
-        return True
+        return problem_uids
+
+
+async def is_problem_hidden(user, problem_uid):
+    '''Check if the problem is hidden.
+
+    Returns:
+        True | False
+
+    '''
+
+    return problem_uid in await get_hidden_problems(user, [problem_uid])
 
 
 class CreateHandler(APIHandler):
@@ -410,11 +439,10 @@ class RemoveItemHandler(APIHandler):
         if proitem is None:
             return 'Error'
 
-        problem_uid = proitem.problem.uid
-
         if not await proitem.remove():
             return 'Error'
 
-        await model.scoring.change_problem(problem_uid)
+        # The problem is gone from the problem set.
+        await model.scoring.change_problem(proitem.problem.uid, removed=True)
 
         return 'Success'
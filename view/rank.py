@@ -1,14 +1,35 @@
 '''Rank view module.'''
 
-import model.scoring
-import model.user
-import model.challenge
+import model.rank
 import view.proset
-from model.user import UserLevel, UserCategory
+from model.user import UserLevel
 from .interface import *
 from . import APIHandler
 
 
+async def get_problem_uids(user, proset):
+    '''Get the distinct visible problem IDs of the problem set.
+
+    Args:
+        user (UserModel): User.
+        proset (ProSetModel): Problem set.
+
+    Returns:
+        [int] | None
+
+    '''
+
+    show_hidden = False
+    if user is not None and user.level <= UserLevel.kernel:
+        show_hidden = True
+
+    proitems = await proset.list(hidden=show_hidden)
+    if proitems is None:
+        return None
+
+    return list(set(proitem.problem.uid for proitem in proitems))
+
+
 class ListHandler(APIHandler):
     '''List handler.'''
 
@@ -17,10 +38,13 @@ class ListHandler(APIHandler):
 
         Args:
             uid (int): Problem set ID.
-            data (object): {}
+            data (object): {
+                'offset' (int) optional,
+                'limit' (int) optional,
+            }
 
         Returns:
-            [RankerInterface] | 'Error'
+            [RankerInterface] | PartialListInterface | 'Error'
 
         '''
 
@@ -29,42 +53,53 @@ class ListHandler(APIHandler):
         if proset is None:
             return 'Error'
 
-        show_hidden = False
-        if self.user is not None and self.user.level <= UserLevel.kernel:
-            show_hidden = True
-
-        proitems = await proset.list(hidden=show_hidden)
-        if proitems is None:
+        problem_ids = await get_problem_uids(self.user, proset)
+        if problem_ids is None:
             return 'Error'
 
-        # Distinct problem IDs.
-        problem_ids = list(set(proitem.problem.uid for proitem in proitems))
+        offset = int(data.get('offset', 0))
+        limit = data.get('limit')
+        if limit is not None:
+            limit = int(limit)
 
-        users = await model.user.get_list(
-            category=UserCategory(proset.metadata['category']))
-        if users is None:
+        partial_list = await model.rank.get_list(proset, problem_ids,
+            offset=offset, limit=limit)
+        if partial_list is None:
             return 'Error'
 
-        rankers = {}
-        for user in users:
-            rate = await model.scoring.get_user_score(user,
-                spec_proset_uid=proset.uid)
-            rankers[user.uid] = {
-                'user': user,
-                'rate': rate,
-                'results': {},
-            }
+        rankers = [RankerInterface(ranker) for ranker in partial_list['data']]
 
-        result_map = await model.challenge.stat_result(rankers.keys(),
-            problem_ids)
-        if result_map is None:
-            return 'Error'
+        # Keep the plain list without pagination.
+        if 'offset' not in data and 'limit' not in data:
+            return rankers
 
-        for key, result in result_map.items():
-            user_uid, problem_uid = key
-            rankers[user_uid]['results'][problem_uid] = result
+        return PartialListInterface(data=rankers, count=partial_list['count'])
 
-        ranker_list = sorted(rankers.values(), key=lambda x: x['rate'],
-            reverse=True)
 
-        return [RankerInterface(ranker) for ranker in ranker_list]
+class PositionHandler(APIHandler):
+    '''Position handler.'''
+
+    level = UserLevel.user
+
+    async def process(self, uid, data):
+        '''Process the request.
+
+        Args:
+            uid (int): Problem set ID.
+            data (object): {}
+
+        Returns:
+            RankPositionInterface | 'Error'
+
+        '''
+
+        uid = int(uid)
+        proset = await view.proset.get_proset(self.user, uid)
+        if proset is None:
+            return 'Error'
+
+        position = await model.rank.get_position(proset, self.user)
+        if position is None:
+            return 'Error'
+
+        return RankPositionInterface(position)
@@ -5,8 +5,9 @@ import collections
 import model.user
 import model.scoring
 import model.challenge
-from model.user import UserLevel, UserCategory
-from model.challenge import JudgeState, JudgeResult
+import model.rank
+from model.user import UserModel, UserLevel, UserCategory
+from model.challenge import ChallengeModel, JudgeState, JudgeResult
 from .interface import *
 from . import APIHandler, Attribute, Interface
 
@@ -32,10 +33,14 @@ class RegisterHandler(APIHandler):
         mail = data['mail']
         password = data['password']
         name = data['name']
-        if await model.user.create(mail, password, name) is None:
+        user = await model.user.create(mail, password, name)
+        if user is None:
             return 'Eexist'
-        else:
-            return 'Success'
+
+        # The new user joins the leaderboards of the category.
+        await model.rank.invalidate(user.category)
+
+        return 'Success'
 
 
 class LoginHandler(APIHandler):
@@ -130,7 +135,9 @@ class ProfileHandler(APIHandler):
         if user is None:
             return 'Error'
 
-        rate = await model.scoring.get_user_score(user)
+        rate = await model.scoring.get_user_rate(user)
+        if rate is None:
+            return 'Error'
 
         return ProfileInterface(user, rate)
 
@@ -181,7 +188,11 @@ class SetHandler(APIHandler):
         if not await user.update(password=password):
             return 'Error'
 
-        await model.scoring.change_category(old_category, user.category)
+        if old_category == user.category:
+            # Only the profile in the leaderboards is changed.
+            await model.rank.invalidate(user.category)
+        else:
+            await model.scoring.change_category(old_category, user.category)
 
         return 'Success'
 
@@ -202,7 +213,9 @@ class ListHandler(APIHandler):
 
         '''
 
-        users = await model.user.get_list()
+        # The interface needn't the password hashes and the metadata.
+        users = await model.user.get_list(defer=(UserModel.password,
+            UserModel.metadata))
         if users is None:
             return 'Error'
 
@@ -256,7 +269,9 @@ class StatisticHandler(APIHandler):
         '''
 
         uid = int(uid)
-        partial_list = await model.challenge.get_list(user_uid=uid)
+        partial_list = await model.challenge.get_list(user_uid=uid, defer=(
+            ChallengeModel.problem.metadata,
+            ChallengeModel.submitter.metadata))
         if partial_list is None:
             return 'Error'
 